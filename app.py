@@ -1,21 +1,14 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-from postgresql_database import init_postgres_connection, test_connection
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Try to import Gemini, fallback to simple generator
-try:
-    from query_generator_gemini import generate_sql_query
-    ai_available = True
-except ImportError:
-    st.warning("Google Gemini not available. Using simple query generator.")
-    from simple_query_generator import generate_sql_query
-    ai_available = False
+from startup import timed_import, mark, preload, startup_timings, HealthCheck
+import importlib.util
+import uuid
+from backends import get_backend
+from scheduler import scheduler
+from tracing import Trace, span, start_metrics_server
+from warmer import start_warmer, get_warmer
+
+# Heavy modules (pandas, plotly, SQLAlchemy, google.generativeai) are imported on
+# first use or by the background preload, so the page renders before they load
 
 # Page configuration
 st.set_page_config(
@@ -27,23 +20,27 @@ st.set_page_config(
 st.title("📊 Conversational BI Assistant")
 st.markdown("Ask questions about your sales data in plain English and get visualizations!")
 
-# Initialize database connection
-@st.cache_resource
-def get_connection():
-    return init_postgres_connection()
+backend = get_backend()
 
-engine = get_connection()
+def _gemini_installed():
+    try:
+        return importlib.util.find_spec("google.generativeai") is not None
+    except ModuleNotFoundError:
+        return False
 
-if engine is None:
-    st.error("Could not connect to PostgreSQL database. Please check your connection settings.")
-    st.stop()
+ai_available = _gemini_installed()
 
-# Test the connection
-if not test_connection():
-    st.error("Sales table not found in the database. Please create it before proceeding.")
-    st.stop()
+def load_generator():
+    """(generate_sql_query, warm_up_llm): Gemini when it imports, else the simple generator."""
+    if ai_available:
+        try:
+            module = timed_import("query_generator_gemini")
+            return module.generate_sql_query, module.warm_up
+        except ImportError:
+            pass
+    return timed_import("simple_query_generator").generate_sql_query, None
 
-# Sample questions
+# Sample questions (also pre-generated by the background warmer)
 sample_questions = [
     "Show me last 5 sales records",
     "Which product has the highest total sales?",
@@ -53,9 +50,33 @@ sample_questions = [
     "What is the average sale amount by product?"
 ]
 
+@st.cache_resource
+def start_background():
+    """Health check, module preloading and warm-up, started once per process."""
+    health = HealthCheck(backend)
+    health.start()
+
+    def warm_up():
+        generate_fn, warm_up_llm = load_generator()
+        timed_import("pipeline").warm_up(warm_up_llm)
+        # Suggested and popular questions are answered from cache by the time someone clicks them
+        start_warmer(sample_questions, generate_fn)
+
+    generator = "query_generator_gemini" if ai_available else "simple_query_generator"
+    preload(["pandas", generator, "pipeline", "chart_builder", "plotly.graph_objects"], then=warm_up)
+    start_metrics_server()
+    return health
+
+health = start_background()
+# Re-check once the cached result is stale (or failed); never blocks the render
+health.start()
+
+def ask(question):
+    st.session_state["query"] = question
+
 st.subheader("💡 Try asking something like:")
 for question in sample_questions:
-    st.markdown(f"- `{question}`")
+    st.button(question, key=f"sample:{question}", on_click=ask, args=(question,))
 
 # AI status
 if ai_available:
@@ -63,53 +84,269 @@ if ai_available:
 else:
     st.warning("⚠ Using simple query generator.")
 
-query = st.text_input("Ask your question about the sales data:", placeholder="e.g., Show me sales trends for Product X")
+query = st.text_input("Ask your question about the sales data:", placeholder="e.g., Show me sales trends for Product X",
+                      key="query")
+mark("first_render")
+
+def show_health(status):
+    if status == "pending":
+        st.caption(f"Connecting to the {backend.display_name} database…")
+    elif status in ("no_connection", "error"):
+        st.error(f"Could not connect to {backend.display_name} database. Please check your connection settings.")
+    elif status == "no_table":
+        st.error("Sales table not found in the database. Please create it before proceeding.")
+
+health_status = health.status
+show_health(health_status)
+
+with st.sidebar:
+    st.subheader("🚀 Startup")
+    timings = startup_timings()
+    milestones = timings["milestones"]
+    st.caption(
+        f"First render {milestones['first_render']:.2f}s after start"
+        + (f", preload done at {milestones['preload_done']:.2f}s" if "preload_done" in milestones else ", preloading…")
+    )
+    if health.seconds is not None:
+        st.caption(f"Health check: {health.status} ({health.seconds:.2f}s)" + (f": {health.error}" if health.error else ""))
+    else:
+        st.caption("Health check: running…")
+    if timings["imports"]:
+        with st.expander("Import timings"):
+            st.json({name: round(seconds, 3) for name, seconds in
+                     sorted(timings["imports"].items(), key=lambda item: -item[1])})
+
+    # Everything below touches the database; wait for the background health check
+    if health.ok:
+        from schema_catalog import refresh_schema, get_catalog_info
+        from result_cache import get_cache_stats, clear_caches
+        import local_mirror
+
+        if backend.full_pipeline:
+            st.subheader("🗂️ Schema Catalog")
+            if st.button("Refresh schema"):
+                refresh_schema()
+                st.success("Schema reloaded from the database.")
+            catalog_info = get_catalog_info()
+            if catalog_info["age_seconds"] is not None:
+                st.caption(f"{catalog_info['tables']} tables cached, loaded {int(catalog_info['age_seconds'])}s ago")
+            else:
+                st.caption("Schema not loaded yet.")
+
+        st.subheader(f"🔌 Connection Pool ({backend.display_name})")
+        pool_metrics = backend.pool_metrics()
+        st.caption(
+            f"{pool_metrics['checked_out']} checked out / {pool_metrics['idle']} idle "
+            f"(pool {pool_metrics['pool_size']}, peak {pool_metrics['peak_checked_out']}), "
+            f"{pool_metrics['connects']} connects, avg wait {pool_metrics['avg_wait_seconds'] * 1000:.1f} ms"
+        )
+
+    st.subheader("🚦 Request Queue")
+    scheduler_stats = scheduler.stats()
+    for label, key in (("LLM", "llm"), ("Database", "db")):
+        stats = scheduler_stats[key]
+        st.caption(
+            f"{label}: {stats['running']}/{stats['limit']} running, {stats['queue_depth']} queued "
+            f"({stats['waiting_users']} users), avg wait {stats['avg_wait_seconds'] * 1000:.0f} ms"
+            + (f", backing off {stats['paused_seconds']:.0f}s" if stats["paused_seconds"] > 0 else "")
+        )
+    st.caption(f"{scheduler_stats['coalesced']} duplicate requests coalesced")
+
+    if health.ok:
+        if backend.full_pipeline and local_mirror.is_enabled():
+            st.subheader("🦆 Local Mirror")
+            lag = local_mirror.get_lag()
+            if lag["seconds"] is None:
+                st.caption("Not synced yet.")
+            else:
+                st.caption(f"Synced {int(lag['seconds'])}s ago, {lag['rows_behind'] or 0:,} sales rows behind")
+            if lag["last_error"]:
+                st.caption(f"Last sync error: {lag['last_error']}")
+
+        st.subheader("⚡ Query Cache")
+        cache_stats = get_cache_stats()
+        for label, key in (("SQL", "sql"), ("Results", "results")):
+            stats = cache_stats[key]
+            st.caption(f"{label}: {stats['hits']} hits / {stats['misses']} misses, {stats['entries']} entries")
+        if ai_available:
+            from semantic_cache import semantic_cache
+            semantic_stats = semantic_cache.stats()
+            st.caption(
+                f"Semantic: {semantic_stats['hits']} hits / {semantic_stats['misses']} misses, "
+                f"{semantic_stats['entries']} entries"
+            )
+        session_results = st.session_state.get("session_results")
+        if session_results is not None:
+            followup_stats = session_results.stats()
+            st.caption(
+                f"Follow-ups: {followup_stats['hits']} answered locally / {followup_stats['misses']} re-queried, "
+                f"{followup_stats['results']} results kept"
+            )
+        warmer = get_warmer()
+        if warmer is not None:
+            warmer_stats = warmer.stats()
+            if warmer_stats["last_run_age_seconds"] is None:
+                st.caption("Warmer: first run pending")
+            else:
+                st.caption(
+                    f"Warmer: {warmer_stats['warmed']} questions warmed {int(warmer_stats['last_run_age_seconds'])}s ago "
+                    f"in {warmer_stats['last_seconds']:.1f}s"
+                )
+        if st.button("Clear cache"):
+            clear_caches()
+            if session_results is not None:
+                session_results.clear()
 
 if st.button("Generate Results") or query:
     if query:
-        with st.spinner("Generating SQL query and fetching results..."):
-            sql_query = generate_sql_query(query)
-            st.subheader("Generated SQL Query")
-            st.code(sql_query, language="sql")
-
-            try:
-                df = pd.read_sql(sql_query, engine)
-
-                if not df.empty:
-                    st.subheader("Results")
-                    st.dataframe(df)
-
-                    if len(df) > 1:
-                        st.subheader("Visualization")
-                        df.columns = [col.upper() for col in df.columns]
-
-                        if len(df.columns) == 2 and df.shape[0] > 1:
-                            fig = px.bar(df, x=df.columns[0], y=df.columns[1])
-                            st.plotly_chart(fig, use_container_width=True)
-
-                        elif 'SALE_DATE' in df.columns and 'AMOUNT' in df.columns:
-                            df['SALE_DATE'] = pd.to_datetime(df['SALE_DATE'])
-                            df = df.sort_values('SALE_DATE')
-                            fig = px.line(df, x='SALE_DATE', y='AMOUNT', title='Sales Over Time')
-                            st.plotly_chart(fig, use_container_width=True)
-
-                        elif 'PRODUCT_NAME' in df.columns and 'AMOUNT' in df.columns:
-                            fig = px.bar(df, x='PRODUCT_NAME', y='AMOUNT', title='Sales by Product')
-                            st.plotly_chart(fig, use_container_width=True)
-
-                        elif 'REGION' in df.columns and 'AMOUNT' in df.columns:
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                fig = px.bar(df, x='REGION', y='AMOUNT', title='Sales by Region')
-                                st.plotly_chart(fig, use_container_width=True)
-                            with col2:
-                                fig = px.pie(df, values='AMOUNT', names='REGION', title='Sales Distribution by Region')
-                                st.plotly_chart(fig, use_container_width=True)
+        # Only blocks when the background health check has not finished yet
+        status = health.wait()
+        if status != "ok":
+            if status != health_status:
+                show_health(status)
+            if status == "pending":
+                st.error(f"Still connecting to the {backend.display_name} database. Please try again in a moment.")
+            st.stop()
+        import pandas as pd
+        import plotly.graph_objects as go
+        from pipeline import start_pipeline
+        from chart_builder import build_figures, pushdown_chart_sql
+        from query_executor import stream_query, PREVIEW_ROWS
+        from followups import SessionResults
+        generate_sql_query, warm_up_llm = load_generator()
+
+        def show_table(df):
+            st.subheader("Results")
+            if df.attrs.get("truncated"):
+                st.warning(
+                    f"Result truncated to {len(df):,} rows by the row/byte budget. "
+                    "Add filters or aggregation to see everything."
+                )
+            if len(df) > PREVIEW_ROWS:
+                st.caption(f"Showing the first {PREVIEW_ROWS:,} of {len(df):,} rows.")
+                st.dataframe(df.head(PREVIEW_ROWS))
+            else:
+                st.dataframe(df)
+
+        def show_charts(chart_df, trace):
+            with trace.activate(), span("chart_build") as chart_span:
+                figures = build_figures(chart_df)
+                chart_span.set(rows=len(chart_df), figures=len(figures))
+            if figures:
+                st.subheader("Visualization")
+                for column, fig in zip(st.columns(len(figures)), figures):
+                    with column:
+                        st.plotly_chart(fig, use_container_width=True)
+
+        # Refinements of an earlier answer ("only North", "top 5 of those") are answered
+        # from this session's stored results without going back to the database
+        session_results = st.session_state.setdefault("session_results", SessionResults())
+        followup_trace = Trace(query)
+        with followup_trace.activate(), span("followup_lookup") as followup_span:
+            followup = session_results.answer(query)
+            followup_span.set(cache_hit=followup is not None)
+        if followup is not None:
+            st.subheader("Follow-up")
+            st.caption(f"Answered from the result of “{followup.base.question}” without querying the database: "
+                       f"{followup.description}.")
+            if followup.df.empty:
+                st.warning("No rows left after applying the follow-up.")
+            else:
+                show_table(followup.df)
+                show_charts(followup.df, followup_trace)
+        else:
+            # A refinement the stored results cannot answer is sent together with the question it refines
+            question = session_results.contextualize(query)
+            # Streamlit reruns the script when the question is edited; abandon the previous run
+            previous_run = st.session_state.get("pipeline_run")
+            if previous_run is not None and previous_run.question != question and not previous_run.done:
+                previous_run.cancel()
+            # Identifies this browser session to the scheduler's per-user fair queueing
+            user_id = st.session_state.setdefault("user_id", uuid.uuid4().hex)
+            run = start_pipeline(question, generate_sql_query, warm_up_llm, user_id)
+            st.session_state["pipeline_run"] = run
+
+            with st.spinner("Generating SQL query and fetching results..."):
+                try:
+                    sql_query = run.sql()
+                except Exception as e:
+                    st.error(f"Error generating query: {str(e)}")
+                    st.stop()
+                st.subheader("Generated SQL Query")
+                st.code(sql_query, language="sql")
+
+                try:
+                    preview = st.empty()
+
+                    def show_preview(preview_df):
+                        with preview.container():
+                            st.subheader("Results (first rows)")
+                            st.dataframe(preview_df)
+
+                    df = run.fetch(on_preview=show_preview)
+                    preview.empty()
+                    if df is None:
+                        st.info("Query cancelled.")
+                        st.stop()
+                    session_results.add(run.question, run.executed_sql or sql_query, df)
+
+                    with st.expander("⏱️ Stage timings"):
+                        st.json({stage: round(seconds, 3) for stage, seconds in run.timings.items()})
+                        queued = run.timings.get("queue_llm", 0.0) + run.timings.get("queue_db", 0.0)
+                        if queued > 0.05:
+                            st.caption(f"Waited {queued:.2f}s in the request queue")
+                        st.caption(f"End-to-end: {run.total_seconds():.3f}s" + (" (result cache hit)" if run.from_cache else ""))
+                        if run.route:
+                            st.caption(f"Executed on: {run.route} ({run.route_reason})")
+                        if run.guard_decision is not None:
+                            estimate = run.guard_decision.estimate
+                            st.caption(
+                                f"Planner estimate: cost {estimate['cost']:,.0f}, rows {estimate['rows']:,.0f} "
+                                f"→ {run.guard_decision.action} ({run.guard_decision.reason})"
+                            )
+                        if run.used_rollup:
+                            st.caption("Answered from the pre-aggregated sales rollup:")
+                            st.code(run.executed_sql, language="sql")
+
+                    if not df.empty:
+                        show_table(df)
+
+                        chart_df = df
+                        chart_sql = None
+                        if df.attrs.get("truncated") and backend.full_pipeline:
+                            chart_sql = pushdown_chart_sql(run.executed_sql or sql_query, df)
+                        if chart_sql:
+                            # Partial rows would give a misleading chart; aggregate the full result server-side
+                            chart_df = stream_query(chart_sql).result()
+                            st.caption("Chart aggregated in the database over the complete result.")
+                        show_charts(chart_df, run.trace)
+                    else:
+                        st.warning("The query returned no results.")
+                except Exception as e:
+                    st.error(f"Error executing query: {str(e)}")
 
+            with st.expander("🐞 Debug: request waterfall"):
+                waterfall = run.trace.waterfall()
+                if waterfall:
+                    labels = [f"{'  ' * row['depth']}{row['name']}" for row in waterfall]
+                    fig = go.Figure(go.Bar(
+                        y=labels,
+                        x=[row["duration"] * 1000 for row in waterfall],
+                        base=[row["start"] * 1000 for row in waterfall],
+                        orientation="h",
+                        hovertext=[str(row["attributes"]) for row in waterfall],
+                    ))
+                    fig.update_yaxes(autorange="reversed")
+                    fig.update_layout(xaxis_title="ms since question", height=120 + 24 * len(waterfall))
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.dataframe(pd.DataFrame([
+                        {"span": label, "start_ms": round(row["start"] * 1000, 1),
+                         "duration_ms": round(row["duration"] * 1000, 1), "thread": row["thread"],
+                         **{key: str(value) for key, value in row["attributes"].items()}}
+                        for label, row in zip(labels, waterfall)
+                    ]))
                 else:
-                    st.warning("The query returned no results.")
-            except Exception as e:
-                st.error(f"Error executing query: {str(e)}")
+                    st.caption("No spans recorded for this request.")
     else:
         st.warning("Please enter a question about your data.")
 
@@ -0,0 +1,116 @@
+import os
+import threading
+import pandas as pd
+from settings import get_setting
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    arrow_available = True
+except ImportError:
+    pa = None
+    pa_csv = None
+    arrow_available = False
+
+# "auto" uses Arrow when pyarrow is installed, "arrow" requires it, "pandas" disables it
+RESULT_FETCH_MODE = get_setting("RESULT_FETCH_MODE", "auto").lower()
+# Bytes of CSV parsed per block; each block becomes one chunk of the streamed result
+ARROW_BLOCK_BYTES = int(get_setting("ARROW_BLOCK_BYTES", str(1024 * 1024)))
+
+def use_arrow():
+    if RESULT_FETCH_MODE == "pandas":
+        return False
+    if RESULT_FETCH_MODE == "arrow" and not arrow_available:
+        raise ImportError("RESULT_FETCH_MODE=arrow needs the pyarrow package")
+    return arrow_available
+
+def _arrow_type(column):
+    """Arrow type for a psycopg2 cursor.description column, or None to let Arrow infer it."""
+    if column.type_code == 1700:
+        # numeric with a declared precision keeps its exact value; SUM/AVG/ROUND (and
+        # EXTRACT on PG14+) carry none and are read as float64, like pandas' coerce_float
+        if column.precision is not None and 0 < column.precision <= 38:
+            return pa.decimal128(column.precision, column.scale or 0)
+        return pa.float64()
+    return {
+        16: pa.bool_(),
+        20: pa.int64(), 21: pa.int64(), 23: pa.int64(),
+        700: pa.float64(), 701: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp("us"),
+        25: pa.string(), 1042: pa.string(), 1043: pa.string(),
+    }.get(column.type_code)
+
+def iter_sql_arrow(sql, conn, max_rows=None, block_size=ARROW_BLOCK_BYTES):
+    """Run sql on a SQLAlchemy connection and yield Arrow-backed DataFrames as they arrive.
+
+    The result is streamed out with COPY ... TO STDOUT (FORMAT csv) through a pipe
+    and parsed block by block by Arrow's C++ reader straight into columns, so no
+    per-row Python tuples or object-dtype columns are built and only about one
+    block is held at a time. If max_rows is given, one extra row is requested so
+    the caller can detect truncation. Closing the generator early cancels the COPY.
+    """
+    query = sql.strip().rstrip(";")
+    if max_rows is not None:
+        query = f"SELECT * FROM ({query}) AS q LIMIT {int(max_rows) + 1}"
+
+    dbapi_conn = conn.connection.dbapi_connection
+    cursor = dbapi_conn.cursor()
+    # Column names and types without running the query
+    cursor.execute(f"SELECT * FROM ({query}) AS q LIMIT 0")
+    column_types = {col.name: _arrow_type(col) for col in cursor.description if _arrow_type(col) is not None}
+
+    read_fd, write_fd = os.pipe()
+    reader_file, writer_file = os.fdopen(read_fd, "rb"), os.fdopen(write_fd, "wb")
+    copy_error = []
+
+    def copy():
+        try:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", writer_file)
+        except Exception as e:
+            copy_error.append(e)
+        finally:
+            try:
+                writer_file.close()
+            except OSError:
+                pass
+
+    copier = threading.Thread(target=copy, daemon=True)
+    copier.start()
+    finished = False
+    try:
+        reader = pa_csv.open_csv(
+            reader_file,
+            read_options=pa_csv.ReadOptions(block_size=block_size),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types,
+                # COPY writes NULL as an unquoted empty field and booleans as t/f; with
+                # Arrow's default null values text such as "NA" or "null" would become NULL
+                null_values=[""],
+                true_values=["t"],
+                false_values=["f"],
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        for batch in reader:
+            if batch.num_rows:
+                yield batch.to_pandas(types_mapper=pd.ArrowDtype)
+        finished = True
+    except Exception:
+        # A failed COPY closes the pipe early; report its error rather than the parser's
+        if copy_error:
+            raise copy_error[0]
+        raise
+    finally:
+        if not finished:
+            # Stopped early (budget hit or cancelled): stop the server and unblock the writer
+            try:
+                dbapi_conn.cancel()
+            except Exception:
+                pass
+        reader_file.close()
+        copier.join()
+        cursor.close()
+    if copy_error:
+        raise copy_error[0]
@@ -0,0 +1,141 @@
+import threading
+from abc import ABC, abstractmethod
+from settings import get_setting
+
+
+# Which warehouse the app talks to: "postgres" (default) or "oracle"
+DB_BACKEND = get_setting("DB_BACKEND", "postgres").lower()
+
+
+class DatabaseBackend(ABC):
+    """What the app and the generators need from a warehouse.
+
+    full_pipeline backends support the Postgres-specific extras (data watermark,
+    result cache, rollups, local mirror, EXPLAIN cost guard, chart push-down);
+    other backends run generated SQL directly.
+    """
+
+    name = None
+    dialect = None
+    display_name = None
+    full_pipeline = False
+    # Prompt rules that differ per dialect
+    limit_rule = None
+    ping_sql = "SELECT 1"
+
+    @abstractmethod
+    def connect(self):
+        """Open the pool/engine; returns a truthy handle or None on failure."""
+
+    @abstractmethod
+    def test_connection(self):
+        ...
+
+    @abstractmethod
+    def get_schema_text(self):
+        ...
+
+    @abstractmethod
+    def get_schema_tables(self):
+        """{table: [(column, data_type), ...]} used to validate generated SQL."""
+
+    @abstractmethod
+    def read_sql(self, sql, max_rows):
+        """DataFrame for sql with at most max_rows rows and df.attrs["truncated"] set."""
+
+    @abstractmethod
+    def pool_metrics(self):
+        ...
+
+    def warm(self):
+        """Check out one connection so the first question does not pay for connecting."""
+        self.read_sql(self.ping_sql, 1)
+
+
+class PostgresBackend(DatabaseBackend):
+    name = "postgres"
+    dialect = "postgres"
+    display_name = "PostgreSQL"
+    full_pipeline = True
+    limit_rule = "For limiting results, use: LIMIT N"
+
+    def connect(self):
+        from postgresql_database import init_postgres_connection
+        return init_postgres_connection()
+
+    def test_connection(self):
+        from postgresql_database import test_connection
+        return test_connection()
+
+    def get_schema_text(self):
+        from schema_catalog import get_schema_text
+        return get_schema_text()
+
+    def get_schema_tables(self):
+        from schema_catalog import get_schema_tables
+        return get_schema_tables()
+
+    def read_sql(self, sql, max_rows):
+        from query_executor import stream_query
+        return stream_query(sql, max_rows=max_rows).result()
+
+    def pool_metrics(self):
+        from postgresql_database import get_pool_metrics
+        return get_pool_metrics()
+
+
+class OracleBackend(DatabaseBackend):
+    name = "oracle"
+    dialect = "oracle"
+    display_name = "Oracle"
+    limit_rule = "For limiting results, use: FETCH FIRST N ROWS ONLY (never LIMIT)"
+    ping_sql = "SELECT 1 FROM dual"
+
+    def __init__(self):
+        self._schema_tables = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        from oracle_database import init_oracle_connection
+        return init_oracle_connection()
+
+    def test_connection(self):
+        from oracle_database import test_connection
+        return test_connection()
+
+    def get_schema_tables(self):
+        # The Oracle schema is small and static here; fetch it once per process
+        if self._schema_tables is None:
+            with self._lock:
+                if self._schema_tables is None:
+                    from oracle_database import fetch_schema_tables
+                    self._schema_tables = fetch_schema_tables()
+        return self._schema_tables
+
+    def get_schema_text(self):
+        from schema_format import format_schema
+        try:
+            return format_schema(self.get_schema_tables())
+        except Exception as e:
+            return f"⚠️ Error fetching schema: {e}"
+
+    def read_sql(self, sql, max_rows):
+        from oracle_database import read_sql
+        return read_sql(sql, max_rows)
+
+    def pool_metrics(self):
+        from oracle_database import get_oracle_pool_metrics
+        return get_oracle_pool_metrics()
+
+
+BACKENDS = {"postgres": PostgresBackend, "oracle": OracleBackend}
+_backend = None
+
+def get_backend():
+    """The configured backend (DB_BACKEND), created once per process."""
+    global _backend
+    if _backend is None:
+        if DB_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown DB_BACKEND {DB_BACKEND!r}; expected one of {', '.join(BACKENDS)}")
+        _backend = BACKENDS[DB_BACKEND]()
+    return _backend
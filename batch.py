@@ -0,0 +1,415 @@
+"""Headless batch mode: answer a file of questions in one run and write the results.
+
+    python batch.py questions.txt --output-dir reports/2025-03-01 --format parquet
+    python batch.py questions.jsonl --format csv --workers 4
+
+Questions are read one per line (blank lines and "#" comments skipped), or from a
+"question" field per line in .jsonl files. Duplicates are answered once, SQL is
+generated in batches, aggregate queries that scan the same FROM/WHERE are merged
+into one GROUPING SETS query, and everything runs in parallel over the pool.
+Each result is written to its own file plus batch_summary.csv with timings.
+"""
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from settings import get_setting
+from result_cache import (normalize_question, get_cached_sql, put_cached_sql, result_cache_key,
+                          get_cached_result, put_cached_result, get_data_watermark)
+from query_executor import stream_query
+from pipeline import start_pipeline
+from cost_guard import guard, log_execution
+from scheduler import scheduler
+from tracing import span
+from backends import get_backend
+from date_ranges import rewrite_date_predicates
+from intent_matcher import FallbackSQL
+from sql_validation import SQLValidationError
+
+BATCH_WORKERS = int(get_setting("BATCH_WORKERS", "4"))
+BATCH_USER = "batch"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_EXTRACT_FROM = re.compile(r"\bEXTRACT\s*\(\s*(\w+)\s+FROM\b", re.IGNORECASE)
+_UNSUPPORTED = re.compile(
+    r"\b(?:UNION|INTERSECT|EXCEPT|WITH|OVER|DISTINCT|HAVING|GROUPING|ROLLUP|CUBE|OFFSET|FETCH)\b|\(\s*SELECT\b",
+    re.IGNORECASE,
+)
+_GROUPED_QUERY = re.compile(
+    r"^SELECT (?P<select>.+?) (?P<source>FROM .+?)(?: WHERE (?P<where>.+?))? GROUP BY (?P<group>.+?)"
+    r"(?: ORDER BY (?P<order>.+?))?(?: LIMIT (?P<limit>\d+))?$",
+    re.IGNORECASE,
+)
+_AGGREGATE = re.compile(r"\b(?:SUM|AVG|MIN|MAX|COUNT)\s*\(", re.IGNORECASE)
+
+
+class BatchItem:
+    """One distinct question of a batch and what happened to it."""
+
+    def __init__(self, question, duplicates=()):
+        self.question = question
+        self.duplicates = list(duplicates)
+        self.sql = None
+        self.df = None
+        self.route = None
+        self.error = None
+        self.output = None
+        self.timings = {}
+
+
+# --- Shared-scan consolidation ---
+
+def _split_top_level(text, sep=","):
+    parts, depth, current = [], 0, []
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == sep and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current).strip())
+    return parts
+
+def _output_name(expr):
+    """Postgres' default output column name for an unaliased select expression."""
+    column = re.fullmatch(r"(?:\w+\.)?(\w+)", expr)
+    if column:
+        return column.group(1).lower()
+    function = re.match(r"(\w+)\s*\(", expr)
+    return function.group(1).lower() if function else "?column?"
+
+def parse_grouped_query(sql):
+    """Break a single-scan aggregate query into its parts, or None if it is not one.
+
+    Returns {"scan": (from, where), "columns": [(expr, name, is_dimension)],
+    "dimensions": [expr], "order": [(name, ascending)], "limit": int or None}.
+    """
+    normalized = re.sub(r"\s+", " ", sql.strip()).rstrip(";").strip()
+    literals = []
+    def mask(match):
+        literals.append(match.group(0))
+        return f"__lit{len(literals) - 1}__"
+    masked = _EXTRACT_FROM.sub(lambda m: f"EXTRACT({m.group(1)} __from__", _STRING_LITERAL.sub(mask, normalized))
+    if _UNSUPPORTED.search(masked) or len(re.findall(r"\bFROM\b", masked, re.IGNORECASE)) != 1:
+        return None
+    match = _GROUPED_QUERY.match(masked)
+    if match is None:
+        return None
+
+    def restore(text):
+        text = text.replace("__from__", "FROM")
+        return re.sub(r"__lit(\d+)__", lambda m: literals[int(m.group(1))], text)
+
+    columns = []
+    for item in _split_top_level(match.group("select")):
+        alias = re.match(r"(?P<expr>.+?)\s+AS\s+(?P<name>\w+|\"[^\"]+\")$", item, re.IGNORECASE)
+        expr = alias.group("expr") if alias else item
+        name = alias.group("name").strip('"') if alias else _output_name(expr)
+        if not alias or not alias.group("name").startswith('"'):
+            name = name.lower()
+        columns.append([restore(expr), name, None])
+
+    dimensions = []
+    for item in _split_top_level(match.group("group")):
+        item = restore(item)
+        if item.isdigit() and 0 < int(item) <= len(columns):
+            item = columns[int(item) - 1][0]
+        else:
+            item = next((c[0] for c in columns if c[1] == item.lower()), item)
+        dimensions.append(item)
+    for column in columns:
+        if column[0] in dimensions:
+            column[2] = True
+        elif _AGGREGATE.search(column[0]):
+            column[2] = False
+        else:
+            return None
+    if len(dimensions) != len(set(dimensions)) or not all(any(c[0] == d for c in columns) for d in dimensions):
+        # Grouping by something that is not selected changes the grain; leave those alone
+        return None
+
+    order = []
+    for item in _split_top_level(match.group("order")) if match.group("order") else []:
+        direction = re.match(r"(?P<key>.+?)(?:\s+(?P<dir>ASC|DESC))?$", restore(item), re.IGNORECASE)
+        key = direction.group("key")
+        if key.isdigit() and 0 < int(key) <= len(columns):
+            name = columns[int(key) - 1][1]
+        else:
+            name = next((c[1] for c in columns if c[0] == key or c[1] == key.lower()), None)
+        if name is None:
+            return None
+        order.append((name, (direction.group("dir") or "ASC").upper() == "ASC"))
+
+    where = match.group("where")
+    return {
+        "scan": (restore(match.group("source")), restore(where) if where else None),
+        "columns": [tuple(c) for c in columns],
+        "dimensions": dimensions,
+        "order": order,
+        "limit": int(match.group("limit")) if match.group("limit") else None,
+    }
+
+def consolidate(parsed_queries):
+    """GROUPING SETS query answering every parsed query of one scan, plus the column maps.
+
+    Returns (sql, all_dimensions, all_aggregates); see split_consolidated.
+    """
+    source, where = parsed_queries[0]["scan"]
+    dimensions, aggregates, grouping_sets = [], [], []
+    for parsed in parsed_queries:
+        for expr, _, is_dimension in parsed["columns"]:
+            target = dimensions if is_dimension else aggregates
+            if expr not in target:
+                target.append(expr)
+        grouping_set = tuple(parsed["dimensions"])
+        if grouping_set not in grouping_sets:
+            grouping_sets.append(grouping_set)
+
+    select = [f"{expr} AS __d{i}" for i, expr in enumerate(dimensions)]
+    select += [f"{expr} AS __a{i}" for i, expr in enumerate(aggregates)]
+    select.append(f"GROUPING({', '.join(dimensions)}) AS __grouping")
+    sets = ", ".join(f"({', '.join(s)})" for s in grouping_sets)
+    sql = f"SELECT {', '.join(select)} {source}"
+    if where:
+        sql += f" WHERE {where}"
+    sql += f" GROUP BY GROUPING SETS ({sets})"
+    return sql, dimensions, aggregates
+
+def split_consolidated(df, parsed, dimensions, aggregates):
+    """The rows and columns of a consolidated result that answer one original query."""
+    # GROUPING() sets a bit (leftmost argument = highest bit) for each column not grouped on
+    mask = sum(1 << (len(dimensions) - 1 - i) for i, expr in enumerate(dimensions)
+               if expr not in parsed["dimensions"])
+    rows = df[df["__grouping"] == mask]
+    out = pd.DataFrame(index=rows.index)
+    for expr, name, is_dimension in parsed["columns"]:
+        source = f"__d{dimensions.index(expr)}" if is_dimension else f"__a{aggregates.index(expr)}"
+        column = rows[source]
+        if is_dimension and column.dtype.kind == "f" and column.notna().all() and (column % 1 == 0).all():
+            # NULLs from the other grouping sets turned integer keys into floats
+            column = column.astype("int64")
+        out[name] = column
+    if parsed["order"]:
+        names = [name for name, _ in parsed["order"]]
+        ascending = [asc for _, asc in parsed["order"]]
+        # Postgres puts NULLs last for ASC and first for DESC
+        out = out.sort_values(names, ascending=ascending, na_position="last" if ascending[0] else "first",
+                              kind="stable")
+    if parsed["limit"] is not None:
+        out = out.head(parsed["limit"])
+    return out.reset_index(drop=True)
+
+
+# --- Batch run ---
+
+def read_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line)["question"] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def _default_generators():
+    try:
+        from query_generator_gemini import generate_sql_query, generate_sql_queries
+        return generate_sql_query, generate_sql_queries
+    except ImportError:
+        from simple_query_generator import generate_sql_query
+        return generate_sql_query, None
+
+def _generate_one(generate_fn, question):
+    """SQL for one question, or the SQLValidationError when it cannot be made valid."""
+    try:
+        return scheduler.run("llm", BATCH_USER, ("sql", normalize_question(question)), generate_fn, question)
+    except SQLValidationError as e:
+        return e
+
+def _generate(items, generate_fn, generate_batch_fn):
+    started = time.perf_counter()
+    pending = []
+    for item in items:
+        item.sql = get_cached_sql(item.question)
+        if item.sql is None:
+            pending.append(item)
+        else:
+            item.timings["generate"] = 0.0
+
+    if pending:
+        questions = [item.question for item in pending]
+        batch_started = time.perf_counter()
+        if generate_batch_fn is not None:
+            sqls = scheduler.run("llm", BATCH_USER, None, generate_batch_fn, questions)
+        else:
+            sqls = [_generate_one(generate_fn, q) for q in questions]
+        # One LLM call served the whole batch; report its cost spread over the questions
+        per_question = (time.perf_counter() - batch_started) / len(pending)
+        for item, sql in zip(pending, sqls):
+            item.timings["generate"] = per_question
+            if isinstance(sql, SQLValidationError):
+                item.error = str(sql)
+                continue
+            item.sql = rewrite_date_predicates(sql)
+            if not isinstance(sql, FallbackSQL):
+                put_cached_sql(item.question, item.sql)
+    return time.perf_counter() - started
+
+def _run_single(item):
+    started = time.perf_counter()
+    try:
+        # SQL is already known; the pipeline adds caching, routing, the cost guard and the scheduler
+        run = start_pipeline(item.question, lambda _question, sql=item.sql: sql, user_id=BATCH_USER)
+        item.df = run.fetch()
+        item.route = "cache" if run.from_cache else run.route
+        item.timings["queue"] = run.timings.get("queue_db", 0.0)
+    except Exception as e:
+        item.error = str(e)
+    item.timings["execute"] = time.perf_counter() - started
+
+def _run_consolidated(group, watermark):
+    """Run one GROUPING SETS query for a group of (item, parsed) sharing a scan.
+
+    Returns False (without touching the items) when the guard would change the
+    combined query, so the caller can run the members one by one instead.
+    """
+    started = time.perf_counter()
+    sql, dimensions, aggregates = consolidate([parsed for _, parsed in group])
+    try:
+        decision = guard(sql, watermark)
+        if decision.action != "allow":
+            return False
+        def execute():
+            with span("execution", route="consolidated", queries=len(group)):
+                return stream_query(sql).result()
+        df = scheduler.run("db", BATCH_USER, ("result", result_cache_key(sql, watermark)), execute)
+    except Exception as e:
+        log_execution(sql, route="consolidated", error=str(e))
+        return False
+    seconds = time.perf_counter() - started
+    log_execution(sql, decision, seconds, len(df), "consolidated")
+    if df.attrs.get("truncated"):
+        return False
+    for item, parsed in group:
+        item.df = split_consolidated(df, parsed, dimensions, aggregates)
+        item.route = "consolidated"
+        item.timings["execute"] = seconds / len(group)
+        put_cached_result(result_cache_key(item.sql, watermark), item.df)
+    return True
+
+def _write(item, index, output_dir, fmt):
+    slug = re.sub(r"[^a-z0-9]+", "_", normalize_question(item.question))[:60].strip("_")
+    path = os.path.join(output_dir, f"{index:04d}_{slug}.{fmt}")
+    df = item.df
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    item.output = path
+
+def run_batch(questions, output_dir=None, fmt="parquet", workers=BATCH_WORKERS,
+              generate_fn=None, generate_batch_fn=None):
+    """Answer questions and return (items, summary DataFrame).
+
+    items holds one BatchItem per distinct question (by normalized text). When
+    output_dir is given, each result and batch_summary.csv are written there.
+    """
+    if generate_fn is None:
+        generate_fn, default_batch_fn = _default_generators()
+        generate_batch_fn = generate_batch_fn or default_batch_fn
+
+    batch_started = time.perf_counter()
+    distinct = {}
+    for question in questions:
+        key = normalize_question(question)
+        if key in distinct:
+            distinct[key].duplicates.append(question)
+        else:
+            distinct[key] = BatchItem(question)
+    items = list(distinct.values())
+
+    generate_seconds = _generate(items, generate_fn, generate_batch_fn)
+
+    # Already cached results need no database work; group the rest by shared scan.
+    # Caching and consolidation rely on Postgres features, other backends run each query.
+    full_pipeline = get_backend().full_pipeline
+    watermark = get_data_watermark() if full_pipeline else None
+    groups, singles = {}, []
+    for item in items:
+        if item.error is not None:
+            continue
+        if not full_pipeline:
+            singles.append(item)
+            continue
+        cached = get_cached_result(result_cache_key(item.sql, watermark))
+        if cached is not None:
+            item.df, item.route, item.timings["execute"] = cached, "cache", 0.0
+            log_execution(item.sql, seconds=0.0, rows=len(cached), route="cache", question=item.question, user=BATCH_USER)
+            continue
+        parsed = parse_grouped_query(item.sql)
+        if parsed is None:
+            singles.append(item)
+        else:
+            groups.setdefault(parsed["scan"], []).append((item, parsed))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bi-batch") as pool:
+        consolidated = {}
+        for scan, group in groups.items():
+            if len(group) > 1:
+                consolidated[scan] = pool.submit(_run_consolidated, group, watermark)
+            else:
+                singles.extend(item for item, _ in group)
+        futures = [pool.submit(_run_single, item) for item in singles]
+        for scan, future in consolidated.items():
+            if not future.result():
+                futures += [pool.submit(_run_single, item) for item, _ in groups[scan]]
+        for future in futures:
+            future.result()
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        for index, item in enumerate(items, 1):
+            if item.df is not None:
+                _write(item, index, output_dir, fmt)
+
+    summary = pd.DataFrame([{
+        "question": item.question,
+        "duplicates": len(item.duplicates),
+        "sql": item.sql,
+        "route": item.route,
+        "rows": len(item.df) if item.df is not None else None,
+        "truncated": bool(item.df.attrs.get("truncated")) if item.df is not None else None,
+        "generate_seconds": item.timings.get("generate"),
+        "queue_seconds": item.timings.get("queue"),
+        "execute_seconds": item.timings.get("execute"),
+        "error": item.error,
+        "output": item.output,
+    } for item in items])
+    summary.attrs["generate_seconds"] = generate_seconds
+    summary.attrs["total_seconds"] = time.perf_counter() - batch_started
+    if output_dir:
+        summary.to_csv(os.path.join(output_dir, "batch_summary.csv"), index=False)
+    return items, summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="text file with one question per line, or .jsonl with a question field")
+    parser.add_argument("--output-dir", default=os.path.join("reports", time.strftime("%Y-%m-%d")))
+    parser.add_argument("--format", choices=("parquet", "csv"), default="parquet")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    items, summary = run_batch(questions, args.output_dir, args.format, args.workers)
+    routes = summary["route"].value_counts(dropna=False).to_dict()
+    errors = summary["error"].notna().sum()
+    print(f"{len(questions)} questions, {len(items)} distinct, {errors} failed; routes: {routes}")
+    print(f"Generation {summary.attrs['generate_seconds']:.1f}s, total {summary.attrs['total_seconds']:.1f}s")
+    print(f"Results written to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from settings import get_setting
+
+# Upper bound on points sent to the browser per figure
+CHART_POINT_BUDGET = int(get_setting("CHART_POINT_BUDGET", "2000"))
+# Categorical charts show the top N categories and fold the rest into "Other"
+CHART_TOP_N = int(get_setting("CHART_TOP_N", "25"))
+# Categories at or below this count also get a pie chart
+PIE_MAX_CATEGORIES = 8
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling; returns the indices to keep."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third triangle vertex
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def _is_temporal(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    dtype = series.dtype
+    if isinstance(dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        return pa.types.is_temporal(dtype.pyarrow_dtype)
+    return series.name in ("SALE_DATE", "MONTH", "DAY", "WEEK", "DATE")
+
+def describe_columns(df):
+    """Split columns into temporal, numeric and categorical lists."""
+    temporal, numeric, categorical = [], [], []
+    for col in df.columns:
+        series = df[col]
+        if _is_temporal(series):
+            temporal.append(col)
+        elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            numeric.append(col)
+        else:
+            categorical.append(col)
+    return temporal, numeric, categorical
+
+def _value_column(df, numeric):
+    if "AMOUNT" in numeric:
+        return "AMOUNT"
+    return numeric[-1] if numeric else None
+
+def downsample_series(df, x, y, budget=CHART_POINT_BUDGET):
+    """Sorted time series with at most budget points (LTTB)."""
+    df = df.sort_values(x)
+    if len(df) <= budget:
+        return df
+    x_values = pd.to_datetime(df[x]).astype("int64").to_numpy()
+    y_values = pd.to_numeric(df[y], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    return df.iloc[lttb(x_values, y_values, budget)]
+
+# How each kind of measure is combined, in pandas and in SQL
+_PANDAS_AGGREGATES = {"SUM": "sum", "AVG": "mean", "MIN": "min", "MAX": "max"}
+
+def top_n_with_other(df, category, value, n=CHART_TOP_N, agg="SUM"):
+    """Aggregate value by category, keep the n largest and fold the rest into "Other".
+
+    agg is the measure's own aggregate (see _aggregate_for): "Other" is the sum of
+    the remaining sums, the row-weighted average of the remaining rows, or their
+    min/max, and always comes last.
+    """
+    how = _PANDAS_AGGREGATES[agg]
+    totals = df.groupby(category, sort=False, observed=True)[value].agg(how).sort_values(ascending=False)
+    if len(totals) <= n:
+        return totals.reset_index()
+    head = totals.iloc[:n]
+    rest = df.loc[~df[category].isin(head.index), value]
+    other = pd.Series([rest.agg(how)], index=["Other"])
+    return pd.concat([head, other]).rename_axis(category).rename(value).reset_index()
+
+def build_figures(df, budget=CHART_POINT_BUDGET):
+    """Pick the charts for a result set; returns a list of plotly figures (possibly empty).
+
+    Chart type follows from column dtypes and cardinality, and every figure is
+    reduced to at most budget points: time series with LTTB, categories with
+    top-N plus "Other".
+    """
+    if len(df) <= 1:
+        return []
+
+    df = df.copy(deep=False)
+    df.columns = [col.upper() for col in df.columns]
+    temporal, numeric, categorical = describe_columns(df)
+    value = _value_column(df, numeric)
+    if value is None:
+        return []
+
+    if temporal:
+        x = temporal[0]
+        if not pd.api.types.is_datetime64_any_dtype(df[x]):
+            df[x] = pd.to_datetime(df[x])
+        if categorical and df[categorical[0]].nunique() <= PIE_MAX_CATEGORIES:
+            # One line per category, each downsampled to its share of the budget
+            color = categorical[0]
+            share = max(budget // max(df[color].nunique(), 1), 3)
+            parts = [downsample_series(g, x, value, share) for _, g in df.groupby(color, sort=False)]
+            return [px.line(pd.concat(parts), x=x, y=value, color=color, title=f'{value.title()} Over Time')]
+        df = downsample_series(df, x, value, budget)
+        title = 'Sales Over Time' if x == 'SALE_DATE' and value == 'AMOUNT' else None
+        return [px.line(df, x=x, y=value, title=title)]
+
+    if not categorical:
+        if len(numeric) >= 2:
+            return [px.bar(df.head(budget), x=numeric[0], y=value)]
+        return []
+
+    category = categorical[0]
+    plot_df = top_n_with_other(df, category, value, min(CHART_TOP_N, budget), _aggregate_for(value))
+    titles = {'PRODUCT_NAME': 'Sales by Product', 'REGION': 'Sales by Region'}
+    title = titles.get(category) if value == 'AMOUNT' else None
+    figures = [px.bar(plot_df, x=category, y=value, title=title)]
+    if category == 'REGION' and len(plot_df) <= PIE_MAX_CATEGORIES and (plot_df[value] >= 0).all():
+        figures.append(px.pie(plot_df, values=value, names=category, title='Sales Distribution by Region'))
+    return figures
+
+
+# --- SQL push-down for results that were too large to fetch completely ---
+
+def _time_bucket(span_days, budget):
+    for bucket, days in (("day", 1), ("week", 7), ("month", 30), ("quarter", 91), ("year", 365)):
+        if span_days / days <= budget:
+            return bucket
+    return "year"
+
+def _aggregate_for(column):
+    """SQL aggregate that combines a measure's values without changing its meaning."""
+    name = column.lower()
+    if name.startswith(("avg", "average", "mean")):
+        return "AVG"
+    if name.startswith(("min", "lowest", "smallest")):
+        return "MIN"
+    if name.startswith(("max", "highest", "largest")):
+        return "MAX"
+    return "SUM"
+
+def _combine_other(agg, value):
+    """SQL combining per-category aggregates (with row counts n) into the "Other" bucket."""
+    if agg == "AVG":
+        # Weighted by each category's row count, not an average of averages
+        return f'SUM("{value}" * n) / NULLIF(SUM(n), 0)'
+    return f'{agg}("{value}")'
+
+def pushdown_chart_sql(sql, df, budget=CHART_POINT_BUDGET):
+    """SQL that bins/aggregates the full result server-side for charting, or None.
+
+    Used when the fetched frame was truncated: charting the partial rows would be
+    wrong, so the chart is built from date_trunc buckets or top-N + "Other"
+    computed over the complete result in the database.
+    """
+    temporal, numeric, categorical = describe_columns(df.rename(columns=str.upper))
+    columns = {col.upper(): col for col in df.columns}
+    value_upper = _value_column(df.rename(columns=str.upper), numeric)
+    if value_upper is None:
+        return None
+    value = columns[value_upper]
+    inner = sql.strip().rstrip(";")
+    agg = _aggregate_for(value)
+
+    if temporal:
+        x = columns[temporal[0]]
+        dates = pd.to_datetime(df[x])
+        span_days = max((dates.max() - dates.min()).days, 1) if len(dates) else 1
+        bucket = _time_bucket(span_days, budget)
+        return (f'SELECT date_trunc(\'{bucket}\', q."{x}") AS "{x}", {agg}(q."{value}") AS "{value}" '
+                f'FROM ({inner}) AS q GROUP BY 1 ORDER BY 1')
+
+    if categorical:
+        category = columns[categorical[0]]
+        n = min(CHART_TOP_N, budget)
+        # ORDER BY MIN(rnk) keeps the top categories by value and puts "Other" last
+        return (f'SELECT CASE WHEN rnk <= {n} THEN "{category}"::text ELSE \'Other\' END AS "{category}", '
+                f'{_combine_other(agg, value)} AS "{value}" FROM ('
+                f'SELECT "{category}", {agg}(q."{value}") AS "{value}", COUNT(q."{value}") AS n, '
+                f'RANK() OVER (ORDER BY {agg}(q."{value}") DESC) AS rnk '
+                f'FROM ({inner}) AS q GROUP BY 1) AS ranked GROUP BY 1 ORDER BY MIN(rnk)')
+    return None
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy import text
+from postgresql_database import get_db_connection
+from settings import get_setting
+from rollups import ROLLUP_ENABLED, is_rollup_current, rewrite_for_rollup
+
+logger = logging.getLogger(__name__)
+
+# Planner estimates above these budgets trigger COST_GUARD_ACTION
+COST_GUARD_MAX_COST = float(get_setting("COST_GUARD_MAX_COST", "1000000"))
+COST_GUARD_MAX_ROWS = float(get_setting("COST_GUARD_MAX_ROWS", "1000000"))
+# "limit" adds a LIMIT, "rollup" tries the sales rollup first, "reject" refuses to run
+COST_GUARD_ACTION = get_setting("COST_GUARD_ACTION", "limit").lower()
+COST_GUARD_LIMIT = int(get_setting("COST_GUARD_LIMIT", "10000"))
+GUARD_STATEMENT_TIMEOUT_MS = int(get_setting("GUARD_STATEMENT_TIMEOUT_MS", "30000"))
+COST_GUARD_LOG = get_setting("COST_GUARD_LOG", os.path.join(".cache", "query_log.jsonl"))
+
+_log_lock = threading.Lock()
+
+
+class QueryRejected(Exception):
+    """The planner estimate for a generated query is over budget."""
+
+
+class GuardDecision:
+    def __init__(self, sql, action, estimate, reason):
+        self.sql = sql
+        self.action = action
+        self.estimate = estimate
+        self.reason = reason
+
+
+def apply_session_guards(conn):
+    """Make the current transaction read-only and bound its runtime.
+
+    Must be called before any other statement on a fresh connection, since
+    SET TRANSACTION only applies as the first statement of a transaction.
+    """
+    conn.execute(text("SET TRANSACTION READ ONLY"))
+    conn.execute(text(f"SET LOCAL statement_timeout = {GUARD_STATEMENT_TIMEOUT_MS}"))
+
+def explain(sql, conn=None):
+    """Planner estimate for sql: {"cost": total cost, "rows": estimated rows, "node": top node}."""
+    # Sent verbatim rather than through text(), which would read ':word' inside a
+    # string literal as a bind parameter
+    statement = f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"
+    options = {"no_parameters": True}
+    if conn is None:
+        with get_db_connection() as conn:
+            apply_session_guards(conn)
+            result = conn.exec_driver_sql(statement, execution_options=options).scalar()
+    else:
+        result = conn.exec_driver_sql(statement, execution_options=options).scalar()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+    return {"cost": plan["Total Cost"], "rows": plan["Plan Rows"], "node": plan["Node Type"]}
+
+def _over_budget(estimate):
+    return estimate["cost"] > COST_GUARD_MAX_COST or estimate["rows"] > COST_GUARD_MAX_ROWS
+
+def guard(sql, watermark=None):
+    """Check a generated query against the planner budgets and decide how to run it.
+
+    The rollup action is only taken when the rollup is enabled and current for the
+    data watermark; otherwise it falls through to the LIMIT action.
+    Returns a GuardDecision; raises QueryRejected when nothing within budget is possible.
+    """
+    estimate = explain(sql)
+    if not _over_budget(estimate):
+        return GuardDecision(sql, "allow", estimate, "within budget")
+
+    over = f"estimated cost {estimate['cost']:,.0f}, rows {estimate['rows']:,.0f}"
+    if COST_GUARD_ACTION == "rollup" and ROLLUP_ENABLED and is_rollup_current(watermark):
+        rewritten = rewrite_for_rollup(sql)
+        if rewritten is not None:
+            rollup_estimate = explain(rewritten)
+            if not _over_budget(rollup_estimate):
+                return GuardDecision(rewritten, "rollup", rollup_estimate, f"{over}; routed to rollup")
+
+    if COST_GUARD_ACTION in ("limit", "rollup"):
+        limited = f"SELECT * FROM ({sql.strip().rstrip(';')}) AS q LIMIT {COST_GUARD_LIMIT}"
+        limited_estimate = explain(limited)
+        # A LIMIT only helps when the plan can stop early (not e.g. a huge sort or aggregate)
+        if limited_estimate["cost"] <= COST_GUARD_MAX_COST:
+            return GuardDecision(limited, "limit", limited_estimate, f"{over}; limited to {COST_GUARD_LIMIT} rows")
+
+    raise QueryRejected(
+        f"Query rejected by the cost guard ({over}; budget cost {COST_GUARD_MAX_COST:,.0f}, "
+        f"rows {COST_GUARD_MAX_ROWS:,.0f}). Try narrowing the question."
+    )
+
+def log_execution(sql, decision=None, seconds=None, rows=None, route=None, error=None, question=None, user=None):
+    """Append plan estimate vs actual runtime to the query log used to tune budgets."""
+    entry = {
+        "ts": time.time(),
+        "question": question,
+        "user": user,
+        "sql_hash": hashlib.sha256(sql.encode("utf-8")).hexdigest()[:16],
+        "sql": sql,
+        "route": route,
+        "action": decision.action if decision else None,
+        "est_cost": decision.estimate["cost"] if decision else None,
+        "est_rows": decision.estimate["rows"] if decision else None,
+        "actual_seconds": seconds,
+        "actual_rows": rows,
+        "error": error,
+    }
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(COST_GUARD_LOG) or ".", exist_ok=True)
+            with open(COST_GUARD_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        logger.warning("Could not write query log: %s", e)
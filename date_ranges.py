@@ -0,0 +1,182 @@
+import re
+from datetime import date
+
+# Date parts that can be turned into a range when the year is known
+_PART_MONTHS = {"MONTH": 1, "QUARTER": 3}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_COLUMN = r'(?:"?\w+"?\s*\.\s*)?"?\w+"?'
+# EXTRACT(part FROM col), optionally cast (EXTRACT(...)::int), compared to an integer
+_EXTRACT = rf"EXTRACT\s*\(\s*(?P<part{{n}}>YEAR|MONTH|QUARTER)\s+FROM\s+(?P<col{{n}}>{_COLUMN})\s*\)(?:\s*::\s*\w+)?"
+_NUMBER = r"'?(?P<{name}>\d{{1,4}})'?(?![\w.'])(?!\s*(?:[-+*/%|^]|::))"
+_EQUALS = _EXTRACT + r"\s*=\s*" + _NUMBER
+_PAIR = re.compile(
+    _EQUALS.format(n=1, name="value1") + r"\s+AND\s+" + _EQUALS.format(n=2, name="value2"),
+    re.IGNORECASE,
+)
+_YEAR = re.compile(
+    _EXTRACT.format(n=1)
+    + r"\s*(?:(?P<op>>=|<=|<>|!=|=|>|<)\s*" + _NUMBER.format(name="value")
+    + r"|\s+BETWEEN\s+" + _NUMBER.format(name="low") + r"\s+AND\s+" + _NUMBER.format(name="high")
+    + r"|\s+IN\s*\((?P<values>\s*'?\d{1,4}'?(?:\s*,\s*'?\d{1,4}'?)*\s*)\))",
+    re.IGNORECASE,
+)
+# Where a WHERE clause ends; a nested query is skipped over (its own WHERE is a separate clause)
+_CLAUSE_END = re.compile(
+    r"\b(?:GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET|FETCH|UNION|INTERSECT|EXCEPT|WINDOW|SELECT|RETURNING)\b|[();]",
+    re.IGNORECASE,
+)
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+
+
+def _literal(day):
+    return f"DATE '{day.isoformat()}'"
+
+def _add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _range(column, start, end):
+    """Half-open range predicate; either bound may be None."""
+    parts = []
+    if start is not None:
+        parts.append(f"{column} >= {_literal(start)}")
+    if end is not None:
+        parts.append(f"{column} < {_literal(end)}")
+    return parts[0] if len(parts) == 1 else f"({' AND '.join(parts)})"
+
+def _valid_year(year):
+    return 1 <= year <= 9998
+
+def _rewrite_pair(match):
+    """EXTRACT(YEAR ...) = y AND EXTRACT(MONTH|QUARTER ...) = n on the same column, in either order."""
+    parts = {match.group("part1").upper(): int(match.group("value1")),
+             match.group("part2").upper(): int(match.group("value2"))}
+    column = match.group("col1")
+    if re.sub(r"\s+", "", column.lower()) != re.sub(r"\s+", "", match.group("col2").lower()) \
+            or "YEAR" not in parts or len(parts) != 2:
+        return None
+    year = parts.pop("YEAR")
+    part, number = parts.popitem()
+    months = _PART_MONTHS[part]
+    if not _valid_year(year) or not 1 <= number <= 12 // months:
+        return None
+    start = date(year, (number - 1) * months + 1, 1)
+    return _range(column, start, _add_months(start, months))
+
+def _rewrite_year(match):
+    if match.group("part1").upper() != "YEAR":
+        return None
+    column = match.group("col1")
+    if match.group("values") is not None:
+        years = sorted({int(v.strip().strip("'")) for v in match.group("values").split(",")})
+        if not all(_valid_year(y) for y in years):
+            return None
+        # Consecutive years are one range; gaps need one range per run of years
+        runs = []
+        for year in years:
+            if runs and year == runs[-1][1] + 1:
+                runs[-1][1] = year
+            else:
+                runs.append([year, year])
+        ranges = [_range(column, date(low, 1, 1), date(high + 1, 1, 1)) for low, high in runs]
+        return ranges[0] if len(ranges) == 1 else f"({' OR '.join(ranges)})"
+    if match.group("low") is not None:
+        low, high = int(match.group("low")), int(match.group("high"))
+        if not (_valid_year(low) and _valid_year(high)):
+            return None
+        if low > high:
+            return "FALSE"
+        return _range(column, date(low, 1, 1), date(high + 1, 1, 1))
+    op, year = match.group("op"), int(match.group("value"))
+    if not _valid_year(year) or op in ("<>", "!="):
+        return None
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    return {
+        "=": _range(column, start, end),
+        ">=": _range(column, start, None),
+        ">": _range(column, end, None),
+        "<": _range(column, None, start),
+        "<=": _range(column, None, end),
+    }[op]
+
+def _follows_operator(text, position):
+    """True if the predicate at position is an operand (NOT x, 1 + x, y = x) rather than a whole condition."""
+    before = text[:position].rstrip()
+    return bool(re.search(r"(?:[-+*/%|^=<>!]|\bNOT|\bBETWEEN)$", before, re.IGNORECASE))
+
+def _rewrite_clause(clause):
+    def apply(pattern, rewrite, text):
+        def replace(match):
+            if _follows_operator(text, match.start()):
+                return match.group(0)
+            return rewrite(match) or match.group(0)
+        return pattern.sub(replace, text)
+    clause = apply(_PAIR, _rewrite_pair, clause)
+    return apply(_YEAR, _rewrite_year, clause)
+
+def _subquery_end(masked, position):
+    """Offset just past the parenthesis closing the nested query opened at position."""
+    depth = 0
+    for paren in re.finditer(r"[()]", masked[position:]):
+        depth += 1 if paren.group(0) == "(" else -1
+        if depth == 0:
+            return position + paren.end()
+    return len(masked)
+
+def _where_clauses(masked):
+    """(start, end) spans of every WHERE clause's condition, nested queries cut out.
+
+    In WHERE amount > (SELECT ...) AND EXTRACT(...) = 2024 the outer condition is
+    two spans, before and after the subquery; the subquery's WHERE is its own span.
+    """
+    spans = []
+    for where in _WHERE.finditer(masked):
+        depth = 0
+        start = where.end()
+        position = start
+        end = len(masked)
+        while True:
+            token = _CLAUSE_END.search(masked, position)
+            if token is None:
+                break
+            position = token.end()
+            if token.group(0) == "(" and re.match(r"\s*(?:SELECT|WITH)\b", masked[token.end():], re.IGNORECASE):
+                spans.append((start, token.start()))
+                start = position = _subquery_end(masked, token.start())
+            elif token.group(0) == "(":
+                depth += 1
+            elif token.group(0) == ")" and depth:
+                depth -= 1
+            else:
+                # Other keywords (or an unmatched ")") end the clause at any depth
+                end = token.start()
+                break
+        spans.append((start, end))
+    return sorted(span for span in spans if span[0] < span[1])
+
+def rewrite_date_predicates(sql):
+    """Turn EXTRACT(YEAR/MONTH/QUARTER FROM col) filters into half-open date ranges.
+
+    EXTRACT(YEAR FROM s.sale_date) = 2024 becomes
+    (s.sale_date >= DATE '2024-01-01' AND s.sale_date < DATE '2025-01-01'), which
+    an index or partition on sale_date can serve; year + month (or quarter) pairs
+    become a single month (or quarter) range. Only WHERE conditions are rewritten:
+    in the select list or HAVING the column may not be grouped. Filters without a
+    year (every February) have no range equivalent and are left as they are.
+    """
+    if not re.search(r"\bEXTRACT\b", sql, re.IGNORECASE):
+        return sql
+    # Mask string literals (except quoted years) so nothing inside them is rewritten
+    literals = []
+    def mask(match):
+        if re.fullmatch(r"'\d{1,4}'", match.group(0)):
+            return match.group(0)
+        literals.append(match.group(0))
+        return f"__lit{len(literals) - 1}__"
+    masked = _STRING_LITERAL.sub(mask, sql)
+
+    # Right to left so earlier spans keep their offsets
+    for start, end in reversed(_where_clauses(masked)):
+        masked = masked[:start] + _rewrite_clause(masked[start:end]) + masked[end:]
+    return re.sub(r"__lit(\d+)__", lambda m: literals[int(m.group(1))], masked)
@@ -0,0 +1,308 @@
+import re
+import time
+from collections import deque
+import numpy as np
+import pandas as pd
+from settings import get_setting
+
+# Results kept per browser session for answering follow-up questions locally
+FOLLOWUP_MAX_RESULTS = int(get_setting("FOLLOWUP_MAX_RESULTS", "5"))
+FOLLOWUP_MAX_BYTES = int(get_setting("FOLLOWUP_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Clauses longer than this are treated as new questions, not refinements
+MAX_CLAUSE_WORDS = 6
+
+# Refinements may start with a filler word: "now only North", "ok, top 5"
+_FILLER = r"(?:(?:now|and|then|also|ok|okay|instead|please)\s*,?\s+)*"
+_VERBS = r"(?:now|only|just|exclude|excluding|without|top|bottom|split|break|group|sort|order|by)\b"
+# "and"/"then" only separate clauses when a refinement follows ("split by product and month" is one)
+_CLAUSE_SPLIT = re.compile(r"\s*(?:[,;]|\b(?:and then|and|then)\b(?=\s+" + _VERBS + r"))\s*")
+_ONLY = re.compile(r"^" + _FILLER + r"(?:only|just)\s+(?:for\s+|in\s+|the\s+)?(.+)$")
+_EXCLUDE = re.compile(r"^" + _FILLER + r"(?:exclude|excluding|without)\s+(?:the\s+)?(.+)$")
+_TOP = re.compile(r"^" + _FILLER + r"(top|bottom)\s+(\d+)(?:\s+(?:of\s+(?:those|these|them)|rows|results))?(?:\s+by\s+(.+))?$")
+_GROUP = re.compile(r"^" + _FILLER + r"(split|break(?:\s+it)?\s+down|group|by)\s*(?:by\s+|per\s+)?(.+)$")
+_SORT = re.compile(r"^" + _FILLER + r"(?:sort|order)(?:\s+(?:it|them|those))?\s+by\s+(.+?)(?:\s+(asc|ascending|desc|descending))?$")
+_PATTERNS = (_TOP, _SORT, _ONLY, _EXCLUDE, _GROUP)
+_TRAILING_NOISE = re.compile(r"\s+(?:of\s+(?:those|these|them)|please|instead|too|as well)$")
+
+_TIME_GRAINS = {
+    "day": ("day", "D"), "days": ("day", "D"), "daily": ("day", "D"),
+    "week": ("week", "W"), "weeks": ("week", "W"), "weekly": ("week", "W"),
+    "month": ("month", "M"), "months": ("month", "M"), "monthly": ("month", "M"),
+    "quarter": ("quarter", "Q"), "quarters": ("quarter", "Q"), "quarterly": ("quarter", "Q"),
+    "year": ("year", "Y"), "years": ("year", "Y"), "yearly": ("year", "Y"),
+}
+# Measures that cannot be re-aggregated at all
+_NON_ADDITIVE = re.compile(r"avg|average|mean|median|pct|percent|ratio|rate|distinct|unique")
+# Extremes re-aggregate with the same function instead of a sum
+_EXTREMES = {
+    "max": re.compile(r"(?<![a-z])(?:max(?:imum)?|highest|largest|biggest|peak)(?![a-z])"),
+    "min": re.compile(r"(?<![a-z])(?:min(?:imum)?|lowest|smallest)(?![a-z])"),
+}
+
+
+def _clauses(question):
+    return [c for c in _CLAUSE_SPLIT.split(_clean(question)) if c]
+
+def is_followup(question):
+    """True if every clause of the question is a refinement ("only North, top 5")."""
+    clauses = _clauses(question)
+    return bool(clauses) and all(
+        len(clause.split()) <= MAX_CLAUSE_WORDS and any(p.match(clause) for p in _PATTERNS)
+        for clause in clauses
+    )
+
+def _clean(text):
+    text = re.sub(r"\s+", " ", text.strip().lower()).rstrip("?.! ")
+    return _TRAILING_NOISE.sub("", text)
+
+def _words(text):
+    return re.findall(r"[a-z0-9]+", text)
+
+
+class FollowUp:
+    """A follow-up answered from a previous result, without a database round trip."""
+
+    def __init__(self, df, base, steps):
+        self.df = df
+        self.base = base
+        self.steps = steps
+
+    @property
+    def description(self):
+        return ", then ".join(self.steps)
+
+
+class SessionResult:
+    def __init__(self, question, sql, df):
+        self.question = question
+        self.sql = sql
+        self.df = df
+        self.created_at = time.time()
+        self.size = int(df.memory_usage(deep=True).sum())
+
+
+class SessionResults:
+    """The last few results of one browser session, newest last.
+
+    Follow-ups such as "only North", "split by month" or "top 5 of those" are
+    answered by filtering, re-grouping or sorting one of these DataFrames. Anything
+    that needs rows or columns the stored results do not have returns None and
+    goes back to the database via contextualize().
+    """
+
+    def __init__(self, max_results=FOLLOWUP_MAX_RESULTS, max_bytes=FOLLOWUP_MAX_BYTES):
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self._results = deque()
+        # The latest locally computed answer, so "top 5 of those" can refine it again;
+        # kept apart so chains of follow-ups do not evict the results they came from
+        self._derived = None
+        # Streamlit reruns the script with the same question; answer it only once
+        self._answered = (None, None)
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, question, sql, df):
+        # A truncated result would give wrong answers to local refinements
+        if df is None or df.empty or df.attrs.get("truncated"):
+            return
+        result = SessionResult(question, sql, df)
+        if result.size > self.max_bytes:
+            return
+        if self._results and self._results[-1].question == question:
+            self._results.pop()
+        self._results.append(result)
+        self._derived = None
+        self._answered = (None, None)
+        while len(self._results) > self.max_results or self._bytes() > self.max_bytes:
+            self._results.popleft()
+
+    def _bytes(self):
+        return sum(r.size for r in self._results)
+
+    def clear(self):
+        self._results.clear()
+        self._derived = None
+        self._answered = (None, None)
+
+    @property
+    def last(self):
+        if self._derived is not None:
+            return self._derived
+        return self._results[-1] if self._results else None
+
+    def contextualize(self, question):
+        """The question to send to the generator: follow-ups are merged with the question they refine."""
+        if self.last is None or not is_followup(question):
+            return question
+        return f"{self.last.question.rstrip('?.! ')}, {question.strip()}"
+
+    def answer(self, question):
+        """A FollowUp computed from a stored result, or None if the database is needed."""
+        if self._answered[0] == question:
+            return self._answered[1]
+        if not is_followup(question):
+            return None
+        clauses = _clauses(question)
+        # Newest first: "only South" after "only North" falls back to the unfiltered result
+        candidates = list(reversed(self._results))
+        if self._derived is not None:
+            candidates.insert(0, self._derived)
+        for result in candidates:
+            df, steps = result.df, []
+            for clause in clauses:
+                applied = _apply(df, clause)
+                if applied is None:
+                    break
+                df, step = applied
+                steps.append(step)
+            else:
+                self.hits += 1
+                followup = FollowUp(df.reset_index(drop=True), result, steps)
+                self._derived = SessionResult(f"{result.question.rstrip('?.! ')}, {question.strip()}", None, followup.df)
+                self._answered = (question, followup)
+                return followup
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {"results": len(self._results), "bytes": self._bytes(), "hits": self.hits, "misses": self.misses}
+
+
+# --- Refinements: each returns (DataFrame, description) or None ---
+
+def _apply(df, clause):
+    for pattern, refine in zip(_PATTERNS, (_top_n, _sort, _keep, _drop, _regroup)):
+        match = pattern.match(clause)
+        if match:
+            return refine(df, *match.groups())
+    return None
+
+def _find_column(df, phrase):
+    """Column named by phrase ("product" → product_name, "sales" → total_sales)."""
+    words = _words(phrase)
+    if not words:
+        return None
+    for col in df.columns:
+        if _words(str(col).lower()) == words:
+            return col
+    for col in df.columns:
+        col_words = _words(str(col).lower())
+        if all(any(w.rstrip("s") == c.rstrip("s") for c in col_words) for w in words):
+            return col
+    return None
+
+def _is_text(series):
+    return (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+            or isinstance(series.dtype, pd.CategoricalDtype))
+
+def _dimension_columns(df):
+    return [c for c in df.columns if _is_text(df[c])]
+
+def _date_columns(df):
+    columns = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    for c in df.columns:
+        if c not in columns and _is_text(df[c]) and re.search(r"date|day|time", str(c).lower()):
+            columns.append(c)
+    return columns
+
+def _measure_columns(df):
+    return [c for c in df.columns
+            if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])
+            and not re.search(r"(^|_)id$", str(c).lower())
+            and str(c).lower() not in ("year", "month", "quarter", "week", "day")]
+
+def _value_mask(df, phrase):
+    """Boolean mask for rows where some text column equals phrase (or phrase minus a column hint)."""
+    words = _words(phrase)
+    candidates = [(" ".join(words), None)]
+    # "north region" → value "north" in the region column
+    for i in range(len(words) - 1, 0, -1):
+        hint = _find_column(df, " ".join(words[i:]))
+        if hint is not None:
+            candidates.append((" ".join(words[:i]), hint))
+    for value, hint in candidates:
+        columns = [hint] if hint is not None else _dimension_columns(df)
+        for col in columns:
+            if not _is_text(df[col]):
+                continue
+            mask = df[col].astype(str).str.strip().str.lower().to_numpy() == value
+            if mask.any():
+                return col, df[col][mask].iloc[0], mask
+    return None
+
+def _keep(df, phrase):
+    found = _value_mask(df, phrase)
+    if found is None:
+        return None
+    col, value, mask = found
+    return df[mask], f"kept {col} = {value}"
+
+def _drop(df, phrase):
+    found = _value_mask(df, phrase)
+    if found is None:
+        return None
+    col, value, mask = found
+    return df[~mask], f"dropped {col} = {value}"
+
+def _top_n(df, direction, n, by):
+    measures = _measure_columns(df)
+    column = _find_column(df, by) if by else (measures[-1] if measures else None)
+    if column is None or not pd.api.types.is_numeric_dtype(df[column]):
+        return None
+    n = int(n)
+    values = df[column].to_numpy(dtype=np.float64)
+    order = np.argsort(-values if direction == "top" else values, kind="stable")
+    return df.iloc[order[:n]], f"{direction} {n} by {column}"
+
+def _sort(df, phrase, direction):
+    column = _find_column(df, phrase)
+    if column is None:
+        return None
+    ascending = direction in ("asc", "ascending") or (direction is None and not pd.api.types.is_numeric_dtype(df[column]))
+    return df.sort_values(column, ascending=ascending, kind="stable"), f"sorted by {column}"
+
+def _regroup(df, verb, phrase):
+    """Re-aggregate additive measures by a dimension or a time grain of a date column.
+
+    Sums are summed again and max/min columns keep their max/min; anything else
+    (averages, ratios, distinct counts) cannot be regrouped from the result.
+    """
+    measures = _measure_columns(df)
+    if not measures or any(_NON_ADDITIVE.search(str(m).lower()) for m in measures):
+        return None
+    functions = {}
+    for measure in measures:
+        name = str(measure).lower()
+        functions[measure] = next((f for f, pattern in _EXTREMES.items() if pattern.search(name)), "sum")
+
+    keys = []
+    adding = not verb.startswith(("group", "by"))
+    if adding:
+        # "split by month" keeps the current grouping if the result is already aggregated
+        dimensions = [c for c in _dimension_columns(df) if c not in _date_columns(df)]
+        if dimensions and not df.duplicated(dimensions).any():
+            keys = dimensions
+
+    frame = df
+    for part in re.split(r"\s*(?:&|\+|\band\b)\s*", phrase):
+        if part in _TIME_GRAINS:
+            dates = _date_columns(frame)
+            if not dates:
+                return None
+            name, grain = _TIME_GRAINS[part]
+            period = pd.to_datetime(frame[dates[0]], errors="coerce").dt.to_period(grain)
+            frame = frame.assign(**{name: period.dt.start_time})
+            keys.append(name)
+            continue
+        column = _find_column(frame, part)
+        if column is None or column in measures:
+            return None
+        if column not in keys:
+            keys.append(column)
+
+    grouped = frame.groupby(keys, sort=True, dropna=False)[measures].agg(functions).reset_index()
+    if grouped.empty:
+        return None
+    return grouped, f"grouped by {', '.join(map(str, keys))}"
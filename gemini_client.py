@@ -0,0 +1,217 @@
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+import google.generativeai as genai
+from settings import get_setting
+from tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = get_setting("GEMINI_MODEL", "gemini-2.5-flash")
+# Point the client at another server, e.g. http://localhost:8765 for mock_gemini_server.py
+GEMINI_API_ENDPOINT = get_setting("GEMINI_API_ENDPOINT")
+GEMINI_STREAM = str(get_setting("GEMINI_STREAM", "true")).lower() in ("1", "true", "yes")
+# Upload the schema once as cached context instead of sending it with every question
+GEMINI_CONTEXT_CACHE = str(get_setting("GEMINI_CONTEXT_CACHE", "false")).lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL = int(get_setting("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+
+# A statement starts at the beginning of a line, possibly right after an opening fence
+_SQL_START = re.compile(r"^[ \t]*(?:```(?:sql)?\s*)?(SELECT|WITH)\b", re.IGNORECASE | re.MULTILINE)
+
+
+def get_gemini_api_key():
+    """Get Gemini API key from env or Streamlit secrets."""
+    api_key = get_setting("GEMINI_API_KEY")
+    if not api_key or api_key == "your_gemini_api_key_here":
+        try:
+            import streamlit as st
+            api_key = st.secrets.get("GEMINI_API_KEY")
+        except:
+            pass
+    return api_key
+
+
+class StreamingSQLParser:
+    """Extracts the SQL statement from a model response while it is still streaming.
+
+    Leading markdown fences or prose are skipped up to the first SELECT/WITH, and
+    the statement is complete at the first semicolon outside a string literal or
+    at a closing fence, so the rest of the stream does not have to be waited for.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.start = None
+        self.end = None
+        self._scanned = 0
+        self._quote = None
+
+    def feed(self, text):
+        """Add a chunk; returns True once the statement is complete."""
+        self.raw += text
+        if self.start is None:
+            match = _SQL_START.search(self.raw)
+            if match is None:
+                return False
+            self.start = self._scanned = match.start(1)
+        raw = self.raw
+        i = self._scanned
+        while i < len(raw):
+            ch = raw[i]
+            if self._quote:
+                if ch == self._quote:
+                    self._quote = None
+            elif ch in ("'", '"'):
+                self._quote = ch
+            elif ch == ";":
+                self.end = i
+                return True
+            elif raw.startswith("```", i):
+                self.end = i
+                return True
+            elif ch == "`" and len(raw) - i < 3:
+                # Possibly the start of a closing fence split across chunks
+                break
+            i += 1
+        self._scanned = i
+        return False
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def sql(self):
+        if self.start is None:
+            # No recognisable statement; hand back the response minus fences as before
+            text = self.raw.strip()
+            if text.startswith("```sql"):
+                text = text[6:]
+            if text.endswith("```"):
+                text = text[:-3]
+            return text.strip()
+        return self.raw[self.start:self.end].rstrip("`").strip()
+
+
+class GeminiClient:
+    """Long-lived Gemini client: configured once, with cached model objects.
+
+    The API key lookup (which may touch st.secrets), genai.configure and model
+    construction happen on first use only. Models built on top of a provider-side
+    context cache are kept per cache key until their TTL is close to running out.
+    """
+
+    def __init__(self, model_name=GEMINI_MODEL, api_endpoint=GEMINI_API_ENDPOINT):
+        self.model_name = model_name
+        self.api_endpoint = api_endpoint
+        self._api_key = None
+        self._configured = False
+        self._models = {}
+        self._context_models = {}
+        self._context_failures = set()
+        self._lock = threading.Lock()
+
+    def api_key(self):
+        if self._api_key is None:
+            self._api_key = get_gemini_api_key()
+        return self._api_key
+
+    def configure(self):
+        """Configure genai once; returns False when no API key is available."""
+        if self._configured:
+            return True
+        api_key = self.api_key()
+        if not api_key:
+            return False
+        with self._lock:
+            if not self._configured:
+                options = {}
+                if self.api_endpoint:
+                    # The REST transport honours http:// endpoints, which the gRPC one does not
+                    options = {"transport": "rest", "client_options": {"api_endpoint": self.api_endpoint}}
+                genai.configure(api_key=api_key, **options)
+                self._configured = True
+        return True
+
+    def model(self, system_instruction=None):
+        """Cached GenerativeModel for an (optional) static system instruction."""
+        model = self._models.get(system_instruction)
+        if model is None:
+            with self._lock:
+                model = self._models.get(system_instruction)
+                if model is None:
+                    kwargs = {"system_instruction": system_instruction} if system_instruction else {}
+                    model = genai.GenerativeModel(self.model_name, **kwargs)
+                    self._models[system_instruction] = model
+        return model
+
+    def context_model(self, key, system_instruction, contents):
+        """Model backed by a provider context cache holding contents, or None if unavailable.
+
+        key identifies the cached contents (e.g. the schema fingerprint); a new cache
+        is created when it changes. Caching fails for prompts below the provider's
+        minimum size, in which case the caller should send the contents inline.
+        """
+        if not GEMINI_CONTEXT_CACHE or key in self._context_failures:
+            return None
+        with self._lock:
+            entry = self._context_models.get(key)
+            if entry is not None and time.time() - entry["created"] < GEMINI_CONTEXT_CACHE_TTL * 0.9:
+                return entry["model"]
+            try:
+                from google.generativeai import caching
+                cached = caching.CachedContent.create(
+                    model=f"models/{self.model_name}",
+                    display_name="bi-schema",
+                    system_instruction=system_instruction,
+                    contents=contents,
+                    ttl=timedelta(seconds=GEMINI_CONTEXT_CACHE_TTL),
+                )
+                model = genai.GenerativeModel.from_cached_content(cached_content=cached)
+            except Exception as e:
+                logger.info("Gemini context caching unavailable, sending schema inline: %s", e)
+                self._context_failures.add(key)
+                return None
+            for old in self._context_models.values():
+                try:
+                    old["cache"].delete()
+                except Exception:
+                    pass
+            self._context_models = {key: {"model": model, "cache": cached, "created": time.time()}}
+            return model
+
+    def generate_text(self, prompt, model=None):
+        """Send prompt and return the full response text (no streaming, no parsing)."""
+        model = model or self.model()
+        with span("llm_call", model=self.model_name, stream=False) as llm_span:
+            text = model.generate_content(prompt).text
+            llm_span.set(response_chars=len(text))
+        return text
+
+    def generate_sql(self, prompt, model=None, stream=GEMINI_STREAM):
+        """Send prompt and return the SQL statement from the response.
+
+        With streaming on, the statement is parsed as tokens arrive and the stream
+        is abandoned as soon as it is complete.
+        """
+        model = model or self.model()
+        parser = StreamingSQLParser()
+        with span("llm_call", model=self.model_name, stream=stream) as llm_span:
+            started = time.perf_counter()
+            if stream:
+                for chunk in model.generate_content(prompt, stream=True):
+                    if "first_token_seconds" not in llm_span.attributes:
+                        llm_span.set(first_token_seconds=round(time.perf_counter() - started, 4))
+                    if parser.feed(chunk.text):
+                        break
+            else:
+                parser.feed(model.generate_content(prompt).text)
+            llm_span.set(response_chars=len(parser.raw), stopped_early=parser.complete)
+        logger.debug("Gemini raw response:\n%s", parser.raw)
+        with span("sql_cleanup"):
+            return parser.sql()
+
+
+client = GeminiClient()
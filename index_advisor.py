@@ -0,0 +1,390 @@
+"""Index and partition advisor for date filters on sales.sale_date.
+
+Reads the query log, works out which logged queries filter sales by date and how
+wide their windows are, then looks at the table's size, physical order, existing
+indexes and partitions and recommends what the workload needs: a BRIN index when
+the rows are stored in date order, a btree otherwise, and monthly range
+partitions for large tables that are mostly queried a few months at a time.
+
+    python index_advisor.py
+    python index_advisor.py --since-days 7 --output advice.json
+    python index_advisor.py --apply
+
+--apply creates the recommended index (CONCURRENTLY, so writes are not blocked)
+and missing monthly partitions of an already partitioned sales table. Turning an
+existing table into a partitioned one rewrites it, so that plan is only printed.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from datetime import date
+from sqlalchemy import text
+from postgresql_database import get_db_connection, get_sqlalchemy_engine
+from settings import get_setting
+from cost_guard import COST_GUARD_LOG
+from date_ranges import rewrite_date_predicates
+
+# Fewer date-filtered queries than this in the log are not worth an index
+ADVISOR_MIN_QUERIES = int(get_setting("ADVISOR_MIN_QUERIES", "5"))
+# BRIN needs rows stored roughly in sale_date order (pg_stats correlation) and enough of them
+ADVISOR_BRIN_MIN_ROWS = int(get_setting("ADVISOR_BRIN_MIN_ROWS", "1000000"))
+ADVISOR_BRIN_MIN_CORRELATION = float(get_setting("ADVISOR_BRIN_MIN_CORRELATION", "0.9"))
+# Partitioning only pays off for large tables queried a few months at a time
+ADVISOR_PARTITION_MIN_ROWS = int(get_setting("ADVISOR_PARTITION_MIN_ROWS", "50000000"))
+ADVISOR_PARTITION_MAX_WINDOW_DAYS = float(get_setting("ADVISOR_PARTITION_MAX_WINDOW_DAYS", "366"))
+# Monthly partitions kept created ahead of the current month
+ADVISOR_MONTHS_AHEAD = int(get_setting("ADVISOR_MONTHS_AHEAD", "3"))
+
+# Routes that scanned the Postgres sales table (rollup and local routes did not)
+_SALES_ROUTES = (None, "postgres", "shared")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_DATE_VALUE = r"(?:(?:DATE\s*)?'(\d{4}-\d{2}-\d{2})[^']*'|CAST\s*\(\s*'(\d{4}-\d{2}-\d{2})[^']*'\s+AS\s+DATE\s*\))"
+_SALE_DATE = r"(?:\b\w+\.)?\bsale_date\b"
+_BOUND = re.compile(rf"{_SALE_DATE}\s*(>=|>|<=|<|=)\s*{_DATE_VALUE}", re.IGNORECASE)
+_BETWEEN = re.compile(rf"{_SALE_DATE}\s+BETWEEN\s+{_DATE_VALUE}\s+AND\s+{_DATE_VALUE}", re.IGNORECASE)
+_RELATIVE = re.compile(
+    rf"{_SALE_DATE}\s*>=?\s*CURRENT_DATE\s*-\s*(?:make_interval\(\s*(months|days)\s*=>\s*(\d+)\s*\)"
+    r"|INTERVAL\s*'(\d+)\s*(month|day)s?')",
+    re.IGNORECASE,
+)
+# sale_date wrapped in a function or cast, which no plain index on the column can serve
+_WRAPPED = re.compile(
+    rf"(?:\b(?:EXTRACT\s*\(\s*\w+\s+FROM|DATE_TRUNC\s*\(\s*'\w+'\s*,|DATE_PART\s*\(\s*'\w+'\s*,|TO_CHAR\s*\()\s*{_SALE_DATE}"
+    rf"|{_SALE_DATE}\s*::\s*\w+)",
+    re.IGNORECASE,
+)
+_WHERE = re.compile(r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+_SALES_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+sales\b", re.IGNORECASE)
+
+
+class Recommendation:
+    """One suggested change: what, why, which logged queries it helps and the SQL to do it."""
+
+    def __init__(self, kind, reason, statements, queries=0, seconds=0.0, applicable=True):
+        self.kind = kind
+        self.reason = reason
+        self.statements = statements
+        self.queries = queries
+        self.seconds = seconds
+        # False for plans that are only printed, never run by --apply
+        self.applicable = applicable
+        self.applied = []
+        self.errors = []
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def read_log(log_path=None, since=None):
+    """Query log entries, optionally only those logged after the since timestamp."""
+    log_path = log_path or COST_GUARD_LOG
+    if not os.path.exists(log_path):
+        return []
+    entries = []
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("sql") and (since is None or (entry.get("ts") or 0) >= since):
+                entries.append(entry)
+    return entries
+
+def _where_text(sql):
+    return " ".join(match.group(1) for match in _WHERE.finditer(sql))
+
+def _parse_date(match, first_group):
+    value = match.group(first_group) or match.group(first_group + 1)
+    return date.fromisoformat(value)
+
+def date_window(sql):
+    """Days covered by the sale_date filter of a query (None if it is open-ended or has none)."""
+    where = _where_text(sql)
+    relative = _RELATIVE.search(where)
+    if relative:
+        unit = (relative.group(1) or relative.group(4)).lower()
+        count = int(relative.group(2) or relative.group(3))
+        return count * 30.44 if unit.startswith("month") else float(count)
+    between = _BETWEEN.search(where)
+    if between:
+        return float((_parse_date(between, 3) - _parse_date(between, 1)).days + 1)
+    lower = upper = None
+    for bound in _BOUND.finditer(where):
+        op, day = bound.group(1), _parse_date(bound, 2)
+        if op == "=":
+            return 1.0
+        if op.startswith(">"):
+            lower = day if lower is None else max(lower, day)
+        else:
+            upper = day if upper is None else min(upper, day)
+    if lower is not None and upper is not None:
+        return float(max((upper - lower).days, 0))
+    return None
+
+def classify(sql):
+    """How a query filters on sale_date: "range", "rewritable", "function" or None (no date filter)."""
+    where = _where_text(sql)
+    if _WRAPPED.search(where):
+        rewritten = rewrite_date_predicates(sql)
+        if rewritten != sql and not _WRAPPED.search(_where_text(rewritten)):
+            return "rewritable"
+        return "function"
+    if _BOUND.search(where) or _BETWEEN.search(where) or _RELATIVE.search(where):
+        return "range"
+    return None
+
+def analyze_workload(entries):
+    """Summarize which logged sales queries filter by date, how widely and at what cost."""
+    summary = {"queries": 0, "seconds": 0.0, "windows": [],
+               **{kind: {"queries": 0, "seconds": 0.0} for kind in ("range", "rewritable", "function", "unfiltered")}}
+    for entry in entries:
+        sql = _STRING_LITERAL.sub(lambda m: m.group(0) if re.fullmatch(r"'[\d\-: .]+'", m.group(0)) else "''",
+                                  entry["sql"])
+        if entry.get("route") not in _SALES_ROUTES or not _SALES_TABLE.search(sql):
+            continue
+        seconds = entry.get("actual_seconds") or 0.0
+        kind = classify(sql) or "unfiltered"
+        summary["queries"] += 1
+        summary["seconds"] += seconds
+        summary[kind]["queries"] += 1
+        summary[kind]["seconds"] += seconds
+        if kind in ("range", "rewritable"):
+            window = date_window(rewrite_date_predicates(sql) if kind == "rewritable" else sql)
+            if window is not None:
+                summary["windows"].append(window)
+    windows = summary.pop("windows")
+    summary["median_window_days"] = statistics.median(windows) if windows else None
+    summary["windows_measured"] = len(windows)
+    return summary
+
+
+def table_profile(conn):
+    """Size, physical order, indexes and partitioning of the sales table."""
+    row = conn.execute(text(
+        "SELECT c.reltuples::bigint, c.relkind, pg_total_relation_size(c.oid) "
+        "FROM pg_class c WHERE c.oid = to_regclass('sales')"
+    )).fetchone()
+    if row is None:
+        raise RuntimeError("Table sales not found")
+    rows, relkind, size = row
+    correlation = conn.execute(text(
+        "SELECT correlation FROM pg_stats "
+        "WHERE schemaname = current_schema() AND tablename = 'sales' AND attname = 'sale_date'"
+    )).scalar()
+    indexes = [dict(r._mapping) for r in conn.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'sales'"
+    ))]
+    profile = {
+        "rows": max(rows, 0),
+        "bytes": size,
+        "partitioned": relkind == "p",
+        "correlation": correlation,
+        "indexes": indexes,
+        "sale_date_indexes": [i["indexname"] for i in indexes
+                              if re.search(r"USING \w+ \(sale_date\b", i["indexdef"], re.IGNORECASE)],
+        "partition_key": None,
+        "partitions": [],
+    }
+    if profile["partitioned"]:
+        profile["partition_key"] = conn.execute(text("SELECT pg_get_partkeydef('sales'::regclass)")).scalar()
+        profile["partitions"] = [dict(r._mapping) for r in conn.execute(text(
+            "SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'sales'::regclass ORDER BY 1"
+        ))]
+    return profile
+
+def _date_range(conn):
+    return conn.execute(text("SELECT min(sale_date)::date, max(sale_date)::date FROM sales")).fetchone()
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def _add_months(day, months):
+    for _ in range(months):
+        day = _next_month(day)
+    return day
+
+def _months(first, last):
+    month = _month_start(first)
+    while month <= last:
+        yield month
+        month = _next_month(month)
+
+def _partition_name(month):
+    return f"sales_y{month.year}m{month.month:02d}"
+
+def _partition_ddl(parent, month):
+    return (f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')")
+
+def _covered_months(partitions):
+    """Month starts already covered by a partition's FROM ... TO bound."""
+    covered = set()
+    for partition in partitions:
+        bound = re.search(r"FROM \('(\d{4}-\d{2}-\d{2})[^']*'\) TO \('(\d{4}-\d{2}-\d{2})[^']*'\)", partition["bound"] or "")
+        if bound:
+            start, end = date.fromisoformat(bound.group(1)), date.fromisoformat(bound.group(2))
+            covered.update(m for m in _months(start, end) if m >= start and m < end)
+    return covered
+
+def recommend(workload, profile, date_range=None, today=None):
+    """Recommendations for the analyzed workload and table profile."""
+    today = today or date.today()
+    recommendations = []
+    filtered = workload["range"]["queries"] + workload["rewritable"]["queries"]
+    filtered_seconds = workload["range"]["seconds"] + workload["rewritable"]["seconds"]
+    window = workload["median_window_days"]
+    window_text = f"median window {window:.0f} days" if window is not None else "open-ended windows"
+
+    if workload["rewritable"]["queries"]:
+        recommendations.append(Recommendation(
+            "rewrite",
+            f"{workload['rewritable']['queries']} logged queries filter with EXTRACT() on sale_date; "
+            "the pipeline now rewrites these into date ranges, so they will use the index below",
+            [], workload["rewritable"]["queries"], workload["rewritable"]["seconds"], applicable=False,
+        ))
+    if workload["function"]["queries"]:
+        recommendations.append(Recommendation(
+            "no_index",
+            f"{workload['function']['queries']} logged queries filter on a function of sale_date with no range "
+            "equivalent (e.g. a month across all years); no index on sale_date helps them",
+            [], workload["function"]["queries"], workload["function"]["seconds"], applicable=False,
+        ))
+
+    if filtered >= ADVISOR_MIN_QUERIES and not profile["sale_date_indexes"]:
+        # Partitioned parents cannot build indexes concurrently; the partitions get theirs from the parent
+        concurrently = "" if profile["partitioned"] else " CONCURRENTLY"
+        correlation = profile["correlation"]
+        if profile["rows"] >= ADVISOR_BRIN_MIN_ROWS and correlation is not None \
+                and abs(correlation) >= ADVISOR_BRIN_MIN_CORRELATION:
+            recommendations.append(Recommendation(
+                "brin_index",
+                f"{filtered} queries filter by sale_date ({window_text}); rows are stored in date order "
+                f"(correlation {correlation:.2f}), so a BRIN index skips non-matching blocks at a fraction "
+                "of a btree's size",
+                [f"CREATE INDEX{concurrently} IF NOT EXISTS sales_sale_date_brin ON sales USING brin (sale_date)"],
+                filtered, filtered_seconds,
+            ))
+        else:
+            order = f"correlation {correlation:.2f}" if correlation is not None else "no statistics yet"
+            recommendations.append(Recommendation(
+                "btree_index",
+                f"{filtered} queries filter by sale_date ({window_text}); rows are not stored in date order "
+                f"({order}) or the table is small, so a btree index is the better fit",
+                [f"CREATE INDEX{concurrently} IF NOT EXISTS sales_sale_date_idx ON sales (sale_date)"],
+                filtered, filtered_seconds,
+            ))
+
+    narrow = window is not None and window <= ADVISOR_PARTITION_MAX_WINDOW_DAYS
+    if profile["partitioned"]:
+        if re.search(r"RANGE \(sale_date\)", profile["partition_key"] or "", re.IGNORECASE):
+            covered = _covered_months(profile["partitions"])
+            wanted = _months(_month_start(today), _add_months(_month_start(today), ADVISOR_MONTHS_AHEAD))
+            missing = [month for month in wanted if month not in covered]
+            if missing:
+                recommendations.append(Recommendation(
+                    "partitions",
+                    f"monthly partitions missing for {', '.join(m.strftime('%Y-%m') for m in missing)}; "
+                    "new rows would land in the default partition (or be rejected)",
+                    [_partition_ddl("sales", month) for month in missing],
+                ))
+    elif profile["rows"] >= ADVISOR_PARTITION_MIN_ROWS and filtered and narrow \
+            and filtered >= workload["queries"] / 2:
+        first, last = date_range or (today, today)
+        first = first or today
+        last = _add_months(_month_start(last or today), ADVISOR_MONTHS_AHEAD)
+        statements = [
+            "CREATE TABLE sales_partitioned (LIKE sales INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE (sale_date)",
+            *[_partition_ddl("sales_partitioned", month) for month in _months(first, last)],
+            "CREATE TABLE IF NOT EXISTS sales_default PARTITION OF sales_partitioned DEFAULT",
+            "INSERT INTO sales_partitioned SELECT * FROM sales",
+            # Unique keys on a partitioned table must include the partition key
+            "ALTER TABLE sales_partitioned ADD PRIMARY KEY (sale_id, sale_date)",
+            "ALTER TABLE sales RENAME TO sales_unpartitioned",
+            "ALTER TABLE sales_partitioned RENAME TO sales",
+        ]
+        recommendations.append(Recommendation(
+            "partition_table",
+            f"{profile['rows']:,} rows and {filtered} of {workload['queries']} sales queries filter by date "
+            f"({window_text}); monthly range partitions let Postgres skip every other month. "
+            "Run during a maintenance window: the copy rewrites the table and foreign keys must be recreated",
+            statements, filtered, filtered_seconds, applicable=False,
+        ))
+    return recommendations
+
+def apply(recommendations):
+    """Run the statements of every applicable recommendation, outside a transaction."""
+    engine = get_sqlalchemy_engine()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET statement_timeout = 0"))
+        for recommendation in recommendations:
+            if not recommendation.applicable:
+                continue
+            for statement in recommendation.statements:
+                try:
+                    conn.execute(text(statement))
+                    recommendation.applied.append(statement)
+                except Exception as e:
+                    recommendation.errors.append(f"{statement}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=COST_GUARD_LOG, help="query log to analyze")
+    parser.add_argument("--since-days", type=float, help="only consider queries from the last N days")
+    parser.add_argument("--apply", action="store_true", help="create the recommended indexes and partitions")
+    parser.add_argument("--output", help="also write the analysis and recommendations as JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.since_days * 86400 if args.since_days else None
+    workload = analyze_workload(read_log(args.log, since))
+    with get_db_connection() as conn:
+        profile = table_profile(conn)
+        date_range = _date_range(conn) if not profile["partitioned"] \
+            and profile["rows"] >= ADVISOR_PARTITION_MIN_ROWS else None
+    recommendations = recommend(workload, profile, date_range)
+
+    print(f"Analyzed {workload['queries']:,} sales queries from {args.log} ({workload['seconds']:.1f}s total)")
+    for kind, label in (("range", "date ranges"), ("rewritable", "EXTRACT() with a year"),
+                        ("function", "other functions of sale_date"), ("unfiltered", "no date filter")):
+        print(f"  {label:30s} {workload[kind]['queries']:6,} queries {workload[kind]['seconds']:10.1f}s")
+    if workload["median_window_days"] is not None:
+        print(f"  median window {workload['median_window_days']:.0f} days over {workload['windows_measured']} queries")
+    correlation = f"{profile['correlation']:.2f}" if profile["correlation"] is not None else "n/a"
+    print(f"sales: ~{profile['rows']:,} rows, {profile['bytes'] / 1024 / 1024:.0f} MB, "
+          f"sale_date correlation {correlation}, "
+          + (f"partitioned ({profile['partition_key']}, {len(profile['partitions'])} partitions)"
+             if profile["partitioned"] else "not partitioned")
+          + (f", sale_date indexes: {', '.join(profile['sale_date_indexes'])}" if profile["sale_date_indexes"] else ""))
+
+    if args.apply:
+        apply(recommendations)
+    if not recommendations:
+        print("\nNo changes recommended.")
+    for recommendation in recommendations:
+        print(f"\n[{recommendation.kind}] {recommendation.reason}")
+        for statement in recommendation.statements:
+            done = " (applied)" if statement in recommendation.applied else ""
+            print(f"  {statement};{done}")
+        for error in recommendation.errors:
+            print(f"  FAILED: {error}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"workload": workload, "table": profile,
+                       "recommendations": [r.to_dict() for r in recommendations]}, f, indent=2, default=str)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    main()
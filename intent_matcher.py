@@ -0,0 +1,394 @@
+import re
+from collections import deque
+from datetime import date
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+}
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _last_match(pattern, q):
+    matches = pattern.findall(q)
+    return matches[-1] if matches else None
+
+_YEAR = re.compile(r"\b((?:19|20)\d{2})\b")
+_MONTH = re.compile(r"\b(" + "|".join(MONTHS) + r")\b")
+_REGION = re.compile(r"\b(north|south|east|west)\b")
+_TOP_N = re.compile(r"\btop (\d+)\b")
+_LAST_N = re.compile(r"\blast (\d+)\b(?!\s*(?:months?|weeks?|days?|years?)\b)")
+_LAST_N_MONTHS = re.compile(r"\blast (\d+) months?\b")
+_LAST_N_DAYS = re.compile(r"\blast (\d+) days?\b")
+_MORE_THAN = re.compile(r"\bmore than \$?(\d[\d,]*(?:\.\d+)?)")
+_PRODUCT = re.compile(r"\bproduct\b\s*(.*?)\s*[?.!]*$")
+
+# Date filters are half-open ranges on the column itself (sale_date >= start AND sale_date < end)
+# so an index or partition on sale_date can serve them; EXTRACT() on the column cannot
+def _slot_year(q):
+    match = _YEAR.search(q)
+    if not match:
+        return None
+    year = int(match.group(1))
+    return {"year_start": date(year, 1, 1), "year_end": date(year + 1, 1, 1)}
+
+def _slot_years(q):
+    if not _YEAR.search(q):
+        return None
+    years = sorted({int(y) for y in _YEAR.findall(q)})
+    return {"years": years, "years_start": date(years[0], 1, 1), "years_end": date(years[-1] + 1, 1, 1)}
+
+def _slot_month_of_year(q):
+    month, year = _MONTH.search(q), _YEAR.search(q)
+    if not (month and year):
+        return None
+    start = date(int(year.group(1)), MONTHS[month.group(1)], 1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return {"month_start": start, "month_end": end}
+
+def _slot_product(q):
+    product = _last_match(_PRODUCT, q)
+    return {"product_pattern": f"%{_escape_like(product)}%"} if product else None
+
+# Slot extractors: question → dict of bind parameters, or None if the slot is absent
+SLOTS = {
+    "year": _slot_year,
+    "years": _slot_years,
+    "month": lambda q: {"month": MONTHS[_MONTH.search(q).group(1)]} if _MONTH.search(q) else None,
+    "month_of_year": _slot_month_of_year,
+    "region": lambda q: {"region": _REGION.search(q).group(1).title()} if _REGION.search(q) else None,
+    "top_n": lambda q: {"n": int(_TOP_N.search(q).group(1))} if _TOP_N.search(q) else None,
+    "last_n": lambda q: {"n": int(_LAST_N.search(q).group(1))} if _LAST_N.search(q) else None,
+    "last_n_months": lambda q: {"months": int(_LAST_N_MONTHS.search(q).group(1))} if _LAST_N_MONTHS.search(q) else None,
+    "last_n_days": lambda q: {"days": int(_LAST_N_DAYS.search(q).group(1))} if _LAST_N_DAYS.search(q) else None,
+    "threshold": lambda q: {"threshold": float(_MORE_THAN.search(q).group(1).replace(",", ""))} if _MORE_THAN.search(q) else {"threshold": 5000},
+    "product": _slot_product,
+}
+
+
+class Intent:
+    """A rule: keyword requirements, slots to extract and a parameterized SQL template.
+
+    requires is a list of keyword groups; every group must have at least one of
+    its keywords in the question. Templates use :name bind parameters.
+    """
+
+    def __init__(self, name, requires, sql, slots=(), defaults=None):
+        self.name = name
+        self.requires = [tuple(group) if isinstance(group, (tuple, list)) else (group,) for group in requires]
+        self.sql = sql
+        self.slots = slots
+        self.defaults = defaults or {}
+
+
+class IntentMatch:
+    def __init__(self, intent, params):
+        self.intent = intent
+        self.params = params
+
+    @property
+    def sql(self):
+        """Template with :name placeholders, for parameterized execution."""
+        return self.intent.sql
+
+    def render(self, dialect="postgres"):
+        """Inline the bound parameters as safely quoted literals."""
+        return to_dialect(render_sql(self.intent.sql, self.params), dialect)
+
+
+class FallbackSQL(str):
+    """SQL from the rule-based fallback after the primary generator failed.
+
+    It answers the question for now but must not be cached: the next attempt may
+    reach the primary generator again.
+    """
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, date):
+        return f"DATE '{value.isoformat()}'"
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_literal(v) for v in value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def render_sql(sql, params):
+    """Replace :name bind parameters (not :: casts) with SQL literals."""
+    return re.sub(r"(?<!:):(\w+)\b", lambda m: _literal(params[m.group(1)]) if m.group(1) in params else m.group(0), sql)
+
+
+_ORACLE_TRUNC_UNITS = {"year": "YYYY", "quarter": "Q", "month": "MM", "week": "IW", "day": "DD"}
+
+def _split_select_list(select):
+    items, depth, current = [], 0, ""
+    for ch in select:
+        depth += ch == "("
+        depth -= ch == ")"
+        if ch == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    items.append(current.strip())
+    return items
+
+def _group_by_expressions(sql):
+    """Replace GROUP BY output aliases with the expressions they name (Oracle before 23ai)."""
+    select = re.match(r"\s*SELECT\s+", sql, re.IGNORECASE)
+    group_by = re.search(r"\bGROUP BY\s+(.*?)(\s+(?:HAVING|ORDER BY|FETCH)\b.*)?$", sql, re.IGNORECASE | re.DOTALL)
+    if select is None or group_by is None:
+        return sql
+    # The select list ends at the first FROM outside parentheses (EXTRACT(... FROM ...) has its own)
+    depth, from_at = 0, None
+    for token in re.finditer(r"[()]|\bFROM\b", sql[select.end():], re.IGNORECASE):
+        if token.group(0) == "(":
+            depth += 1
+        elif token.group(0) == ")":
+            depth -= 1
+        elif depth == 0:
+            from_at = select.end() + token.start()
+            break
+    if from_at is None:
+        return sql
+    aliases = {}
+    for item in _split_select_list(sql[select.end():from_at]):
+        aliased = re.match(r"(.+?)\s+AS\s+(\w+)$", item, re.IGNORECASE | re.DOTALL)
+        if aliased:
+            aliases[aliased.group(2).lower()] = aliased.group(1).strip()
+    group_items = [aliases.get(item.lower(), item) for item in _split_select_list(group_by.group(1))]
+    return sql[:group_by.start(1)] + ", ".join(group_items) + (group_by.group(2) or "")
+
+def to_dialect(sql, dialect):
+    """Translate the Postgres constructs used by the intent templates to another dialect.
+
+    Only "oracle" is supported besides "postgres": LIMIT becomes FETCH FIRST,
+    make_interval/DATE_TRUNC/ILIKE/EXTRACT(QUARTER) get Oracle equivalents and
+    GROUP BY aliases are expanded.
+    """
+    if dialect != "oracle":
+        return sql
+    sql = re.sub(r"\bLIMIT\s+(\d+)\s*;?\s*$", r"FETCH FIRST \1 ROWS ONLY", sql.rstrip(), flags=re.IGNORECASE)
+    sql = re.sub(r"CURRENT_DATE\s*-\s*make_interval\(\s*months\s*=>\s*([^)]+)\)", r"ADD_MONTHS(CURRENT_DATE, -\1)",
+                 sql, flags=re.IGNORECASE)
+    sql = re.sub(r"make_interval\(\s*days\s*=>\s*([^)]+)\)", r"\1", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"DATE_TRUNC\(\s*'(\w+)'\s*,\s*([^)]+)\)",
+                 lambda m: f"TRUNC({m.group(2)}, '{_ORACLE_TRUNC_UNITS.get(m.group(1).lower(), 'DD')}')",
+                 sql, flags=re.IGNORECASE)
+    sql = re.sub(r"([\w.]+)\s+ILIKE\s+('(?:[^']|'')*')", r"UPPER(\1) LIKE UPPER(\2) ESCAPE '\\'",
+                 sql, flags=re.IGNORECASE)
+    sql = re.sub(r"EXTRACT\(\s*QUARTER\s+FROM\s+([^)]+)\)", r"TO_NUMBER(TO_CHAR(\1, 'Q'))", sql, flags=re.IGNORECASE)
+    return _group_by_expressions(sql)
+
+
+class _KeywordAutomaton:
+    """Aho-Corasick automaton: finds every keyword occurrence in one pass over the text."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.output[state].add(keyword)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] |= self.output[self.fail[nxt]]
+
+    def find(self, text):
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.output[state]:
+                found |= self.output[state]
+        return found
+
+
+class IntentRegistry:
+    """Intents compiled once into a keyword automaton; first matching intent wins."""
+
+    def __init__(self, intents, fallback_sql):
+        self.intents = list(intents)
+        self.fallback_sql = fallback_sql
+        keywords = {kw for intent in self.intents for group in intent.requires for kw in group}
+        self._automaton = _KeywordAutomaton(sorted(keywords))
+
+    def match(self, natural_language_query):
+        """Return the IntentMatch for the question, or None."""
+        q = natural_language_query.lower()
+        present = self._automaton.find(q)
+        for intent in self.intents:
+            if not all(any(kw in present for kw in group) for group in intent.requires):
+                continue
+            params = dict(intent.defaults)
+            for slot in intent.slots:
+                value = SLOTS[slot](q)
+                if value is None:
+                    break
+                params.update(value)
+            else:
+                return IntentMatch(intent, params)
+        return None
+
+    def generate(self, natural_language_query, dialect="postgres"):
+        match = self.match(natural_language_query)
+        return match.render(dialect) if match else to_dialect(self.fallback_sql, dialect)
+
+
+RULE_BASED_INTENTS = [
+    # --- Sales Analysis ---
+    Intent("product_sales_last_n_months", ["total sales", "last"], """SELECT p.product_name, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  WHERE s.sale_date >= CURRENT_DATE - make_interval(months => :months)
+                  GROUP BY p.product_name
+                  ORDER BY total_sales DESC""", slots=("last_n_months",)),
+    Intent("top_region_in_year", ["highest sales"], """SELECT c.region, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  WHERE s.sale_date >= :year_start AND s.sale_date < :year_end
+                  GROUP BY c.region
+                  ORDER BY total_sales DESC LIMIT 1""", slots=("year",)),
+    Intent("monthly_product_trend", ["monthly", "trend", "product"], """SELECT DATE_TRUNC('month', s.sale_date) as month, SUM(s.amount) as total_sales
+                   FROM sales s
+                   JOIN products p ON s.product_id = p.product_id
+                   WHERE p.product_name ILIKE :product_pattern
+                   GROUP BY month
+                   ORDER BY month""", slots=("product",)),
+    Intent("compare_product_region", ["compare", "product", "region"], """SELECT p.product_name, c.region, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  GROUP BY p.product_name, c.region
+                  ORDER BY p.product_name, c.region"""),
+
+    # --- Customer Insights ---
+    Intent("top_customers", ["top", "customers"], """SELECT c.customer_name, SUM(s.amount) as total_spent
+                  FROM sales s
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  GROUP BY c.customer_name
+                  ORDER BY total_spent DESC LIMIT :n""", slots=("top_n",)),
+    Intent("high_spenders", [("purchased more than", "spending")], """SELECT c.customer_name, SUM(s.amount) as total_spent
+                  FROM sales s
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  GROUP BY c.customer_name
+                  HAVING SUM(s.amount) > :threshold
+                  ORDER BY total_spent DESC""", slots=("threshold",)),
+    Intent("unique_customers_in_month", ["unique customers"], """SELECT COUNT(DISTINCT customer_id) as unique_customers
+                  FROM sales
+                  WHERE sale_date >= :month_start AND sale_date < :month_end""", slots=("month_of_year",)),
+
+    # --- Product Insights ---
+    Intent("average_sales_by_category", ["average sales", "category"], """SELECT p.category, AVG(s.amount) as avg_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  GROUP BY p.category
+                  ORDER BY avg_sales DESC"""),
+    Intent("lowest_product_in_year", ["lowest sales"], """SELECT p.product_name, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  WHERE s.sale_date >= :year_start AND s.sale_date < :year_end
+                  GROUP BY p.product_name
+                  ORDER BY total_sales ASC LIMIT 1""", slots=("year",)),
+    Intent("category_distribution", ["distribution", "categories"], """SELECT p.category, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  GROUP BY p.category"""),
+
+    # --- Time-based Trends ---
+    Intent("daily_sales_last_n_days", ["daily sales", "last"], """SELECT s.sale_date, SUM(s.amount) as daily_sales
+                  FROM sales s
+                  WHERE s.sale_date >= CURRENT_DATE - make_interval(days => :days)
+                  GROUP BY s.sale_date
+                  ORDER BY s.sale_date""", slots=("last_n_days",)),
+    Intent("quarterly_sales", ["quarterly"], """SELECT EXTRACT(YEAR FROM s.sale_date) as year,
+                         EXTRACT(QUARTER FROM s.sale_date) as quarter,
+                         SUM(s.amount) as total_sales
+                  FROM sales s
+                  WHERE s.sale_date >= :years_start AND s.sale_date < :years_end
+                  GROUP BY year, quarter
+                  HAVING EXTRACT(YEAR FROM s.sale_date) IN (:years)
+                  ORDER BY year, quarter""", slots=("years",)),
+    Intent("highest_single_sale", [("highest sale amount", "single transaction")],
+           """SELECT MAX(amount) as highest_sale FROM sales"""),
+
+    # --- Mixed Insights ---
+    Intent("product_region_in_year", ["sales by product and region"], """SELECT p.product_name, c.region, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  WHERE s.sale_date >= :year_start AND s.sale_date < :year_end
+                  GROUP BY p.product_name, c.region""", slots=("year",)),
+    Intent("region_customers_for_product", ["customers", ("north", "south", "east", "west"), "product"], """SELECT DISTINCT c.customer_name
+                   FROM sales s
+                   JOIN products p ON s.product_id = p.product_id
+                   JOIN customers c ON s.customer_id = c.customer_id
+                   WHERE c.region = :region AND p.product_name ILIKE :product_pattern""", slots=("region", "product")),
+    Intent("top_products_in_region", ["top", "products", ("north", "south", "east", "west")], """SELECT p.product_name, SUM(s.amount) as total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  WHERE c.region = :region
+                  GROUP BY p.product_name
+                  ORDER BY total_sales DESC LIMIT :n""", slots=("top_n", "region")),
+]
+
+# Smaller rule set used when the Gemini call is unavailable or fails
+GEMINI_FALLBACK_INTENTS = [
+    Intent("last_n_sales", ["last"], """SELECT s.sale_id, p.product_name, c.customer_name, s.amount, s.sale_date
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  ORDER BY s.sale_date DESC LIMIT :n""", slots=("last_n",)),
+    Intent("total_sales_by_product", ["total sales", "product"], """SELECT p.product_name, SUM(s.amount) AS total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  GROUP BY p.product_name ORDER BY total_sales DESC"""),
+    Intent("average_sale_by_product", ["average", "product"], """SELECT p.product_name, AVG(s.amount) AS average_sale
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  GROUP BY p.product_name ORDER BY average_sale DESC"""),
+    Intent("north_vs_south", [("north", "south")], """SELECT c.region, SUM(s.amount) AS total_sales
+                  FROM sales s
+                  JOIN customers c ON s.customer_id = c.customer_id
+                  WHERE c.region IN ('North', 'South')
+                  GROUP BY c.region"""),
+    Intent("product_sales_in_month_of_year", [tuple(MONTHS)], """SELECT p.product_name, SUM(s.amount) AS total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  WHERE s.sale_date >= :month_start AND s.sale_date < :month_end
+                  GROUP BY p.product_name""", slots=("month_of_year",)),
+    # Without a year the month repeats every year; there is no single range for it
+    Intent("product_sales_in_month", [tuple(MONTHS)], """SELECT p.product_name, SUM(s.amount) AS total_sales
+                  FROM sales s
+                  JOIN products p ON s.product_id = p.product_id
+                  WHERE EXTRACT(MONTH FROM s.sale_date) = :month
+                  GROUP BY p.product_name""", slots=("month",)),
+]
+
+DEFAULT_FALLBACK_SQL = "SELECT * FROM sales LIMIT 10"
+
+rule_based_registry = IntentRegistry(RULE_BASED_INTENTS, DEFAULT_FALLBACK_SQL)
+gemini_fallback_registry = IntentRegistry(GEMINI_FALLBACK_INTENTS, DEFAULT_FALLBACK_SQL)
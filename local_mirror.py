@@ -0,0 +1,286 @@
+import logging
+import os
+import re
+import threading
+import time
+import pandas as pd
+from sqlalchemy import text
+from postgresql_database import get_db_connection
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MIRROR_ENABLED = str(get_setting("LOCAL_MIRROR_ENABLED", "false")).lower() in ("1", "true", "yes")
+LOCAL_MIRROR_PATH = get_setting("LOCAL_MIRROR_PATH", os.path.join(".cache", "mirror.duckdb"))
+# Minimum seconds between background syncs
+LOCAL_MIRROR_SYNC_INTERVAL = float(get_setting("LOCAL_MIRROR_SYNC_INTERVAL", "60"))
+# Serve queries locally while the mirror is at most this many seconds behind (0 = must be current)
+LOCAL_MIRROR_MAX_LAG = float(get_setting("LOCAL_MIRROR_MAX_LAG", "0"))
+LOCAL_MIRROR_CHUNK_ROWS = int(get_setting("LOCAL_MIRROR_CHUNK_ROWS", "200000"))
+# Incremental syncs re-copy this many sale_ids below the last mirrored one, so rows
+# whose transaction committed after a higher id was already mirrored are picked up
+LOCAL_MIRROR_LOOKBACK_IDS = int(get_setting("LOCAL_MIRROR_LOOKBACK_IDS", "10000"))
+# Seconds between row-count comparisons with Postgres; a mismatch forces a full copy
+LOCAL_MIRROR_RECONCILE_INTERVAL = float(get_setting("LOCAL_MIRROR_RECONCILE_INTERVAL", "3600"))
+
+MIRRORED_TABLES = ("sales", "products", "customers")
+
+_sync_lock = threading.Lock()
+_connection_lock = threading.Lock()
+_connection = None
+_state = {
+    "last_sale_id": None,
+    "mod_count": None,
+    "watermark": None,
+    "syncing": False,
+    "synced_at": None,
+    "reconciled_at": None,
+    "remote_last_sale_id": None,
+    "last_error": None,
+}
+
+# Constructs the mirror cannot answer (catalog access, Postgres-only functions, writes)
+_POSTGRES_ONLY = re.compile(
+    r"\bpg_\w+|\binformation_schema\b|::\s*regclass\b|\bto_regclass\b|\bmake_interval\b|\bto_char\b"
+    r"|\b(?:INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|COPY|GRANT)\b",
+    re.IGNORECASE,
+)
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+# Postgres LIKE treats backslash as the escape character, DuckDB has no default escape
+_LIKE_BACKSLASH = re.compile(r"\bI?LIKE\s+E?'(?:[^'\\]|'')*\\", re.IGNORECASE)
+# Constructs both engines accept but answer differently; EXPLAIN cannot catch these
+_DIVERGENT = (
+    # Postgres truncates int / int, DuckDB returns a double
+    (re.compile(r"/"), "uses division, which truncates integers in Postgres only"),
+    # numeric (PG14+) vs bigint/double results
+    (re.compile(r"\b(?:EXTRACT|DATE_PART)\s*\(", re.IGNORECASE), "uses EXTRACT/date_part, whose result type differs"),
+    # timestamp vs date results, and time zone handling
+    (re.compile(r"\bDATE_TRUNC\s*\(", re.IGNORECASE), "uses date_trunc, whose result type differs"),
+    (re.compile(r"\bAGE\s*\(|\bINTERVAL\b|\bAT\s+TIME\s+ZONE\b", re.IGNORECASE),
+     "uses interval or time zone arithmetic, which differs"),
+)
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+def _duckdb():
+    try:
+        import duckdb
+        return duckdb
+    except ImportError:
+        return None
+
+def is_enabled():
+    return LOCAL_MIRROR_ENABLED and _duckdb() is not None
+
+def _get_connection():
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            os.makedirs(os.path.dirname(LOCAL_MIRROR_PATH) or ".", exist_ok=True)
+            _connection = _duckdb().connect(LOCAL_MIRROR_PATH)
+            _connection.execute("""
+                CREATE TABLE IF NOT EXISTS mirror_state (
+                    name VARCHAR PRIMARY KEY, last_sale_id BIGINT, mod_count BIGINT, synced_at DOUBLE
+                )
+            """)
+            _connection.execute("ALTER TABLE mirror_state ADD COLUMN IF NOT EXISTS watermark VARCHAR")
+            row = _connection.execute(
+                "SELECT last_sale_id, mod_count, synced_at, watermark FROM mirror_state WHERE name = 'sales'"
+            ).fetchone()
+            if row:
+                _state["last_sale_id"], _state["mod_count"], _state["synced_at"], _state["watermark"] = row
+        # DuckDB connections are not thread-safe; each caller gets its own cursor
+        return _connection.cursor()
+
+def _copy_table(local, conn, table, query, params=None, replace=True):
+    """Stream a Postgres query into a DuckDB table chunk by chunk.
+
+    With replace the rows are loaded into a staging table that is then swapped in;
+    the caller's transaction makes the swap atomic for readers.
+    """
+    target = f"{table}__staging" if replace else table
+    first = True
+    stream = conn.execution_options(stream_results=True, max_row_buffer=LOCAL_MIRROR_CHUNK_ROWS)
+    for chunk in pd.read_sql(text(query), stream, params=params, chunksize=LOCAL_MIRROR_CHUNK_ROWS):
+        local.register("chunk_df", chunk)
+        if first and replace:
+            local.execute(f"CREATE OR REPLACE TABLE {target} AS SELECT * FROM chunk_df")
+        else:
+            local.execute(f"INSERT INTO {target} SELECT * FROM chunk_df")
+        local.unregister("chunk_df")
+        first = False
+    if replace and not first:
+        local.execute(f"DROP TABLE IF EXISTS {table}")
+        local.execute(f"ALTER TABLE {target} RENAME TO {table}")
+
+def sync(full=False):
+    """Bring the mirror up to date.
+
+    products and customers are small dimensions and are copied in full; sales is
+    copied incrementally from LOCAL_MIRROR_LOOKBACK_IDS below the last mirrored
+    sale_id, because ids are assigned before commit and a lower id can become
+    visible after a higher one. Every LOCAL_MIRROR_RECONCILE_INTERVAL seconds the
+    row counts are compared to catch anything committed later than that. When
+    the Postgres update/delete counter for sales has moved, or the counts
+    disagree, sales is re-copied in full. All of it lands in one DuckDB
+    transaction, and no query is routed to the mirror until the sync has finished.
+    """
+    if not is_enabled():
+        return
+    with _sync_lock:
+        local = _get_connection()
+        # Stale from here on: the warehouse has (or may have) moved past the mirror
+        previous_watermark = _state["watermark"]
+        _state["syncing"] = True
+        _state["watermark"] = None
+        try:
+            local.execute("BEGIN TRANSACTION")
+            with get_db_connection() as conn:
+                # Same shape as result_cache.get_data_watermark() so the two compare equal
+                row = conn.execute(text("""
+                    SELECT (SELECT COALESCE(MAX(sale_id), 0) FROM sales),
+                           COALESCE(st.n_tup_upd + st.n_tup_del, 0),
+                           COALESCE(st.n_tup_ins + st.n_tup_upd + st.n_tup_del, 0)
+                    FROM (SELECT 1) AS one
+                    LEFT JOIN pg_stat_user_tables st
+                      ON st.schemaname = 'public' AND st.relname = 'sales';
+                """)).fetchone()
+                remote_max, mod_count = int(row[0]), int(row[1])
+                watermark = f"{row[0]}:{row[2]}"
+                _state["remote_last_sale_id"] = remote_max
+
+                _copy_table(local, conn, "products", "SELECT * FROM products")
+                _copy_table(local, conn, "customers", "SELECT * FROM customers")
+
+                last_sale_id = _state["last_sale_id"]
+                full = full or last_sale_id is None or _state["mod_count"] != mod_count or last_sale_id > remote_max
+                if not full:
+                    # Replace the lookback window rather than append to it
+                    from_id = max(last_sale_id - LOCAL_MIRROR_LOOKBACK_IDS, 0)
+                    local.execute("DELETE FROM sales WHERE sale_id > ?", [from_id])
+                    _copy_table(local, conn, "sales",
+                                "SELECT * FROM sales WHERE sale_id > :from_id AND sale_id <= :max_id ORDER BY sale_id",
+                                {"from_id": from_id, "max_id": remote_max}, replace=False)
+                reconciled_at = _state["reconciled_at"]
+                if not full and (reconciled_at is None or time.time() - reconciled_at >= LOCAL_MIRROR_RECONCILE_INTERVAL):
+                    remote_count = conn.execute(text("SELECT COUNT(*) FROM sales WHERE sale_id <= :max_id"),
+                                                {"max_id": remote_max}).scalar()
+                    local_count = local.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+                    full = remote_count != local_count
+                    if full:
+                        logger.warning("Local mirror has %s sales rows, Postgres %s; re-copying",
+                                       local_count, remote_count)
+                    reconciled_at = time.time()
+                if full:
+                    _copy_table(local, conn, "sales",
+                                "SELECT * FROM sales WHERE sale_id <= :max_id ORDER BY sale_id", {"max_id": remote_max})
+                    reconciled_at = time.time()
+
+            synced_at = time.time()
+            local.execute(
+                "INSERT OR REPLACE INTO mirror_state (name, last_sale_id, mod_count, synced_at, watermark) "
+                "VALUES ('sales', ?, ?, ?, ?)",
+                [remote_max, mod_count, synced_at, watermark],
+            )
+            local.execute("COMMIT")
+            _state.update(last_sale_id=remote_max, mod_count=mod_count, watermark=watermark,
+                          synced_at=synced_at, reconciled_at=reconciled_at, last_error=None)
+            logger.info("Local mirror synced up to sale_id %s", remote_max)
+        except Exception as e:
+            try:
+                local.execute("ROLLBACK")
+            except Exception:
+                pass
+            # The rollback left the mirror as it was before the sync
+            _state["watermark"] = previous_watermark
+            _state["last_error"] = str(e)
+            logger.warning("Local mirror sync failed: %s", e)
+        finally:
+            _state["syncing"] = False
+            local.close()
+
+def maybe_sync():
+    """Sync if enabled and the last sync is older than LOCAL_MIRROR_SYNC_INTERVAL."""
+    if not is_enabled():
+        return
+    synced_at = _state["synced_at"]
+    if synced_at is None or time.time() - synced_at >= LOCAL_MIRROR_SYNC_INTERVAL:
+        sync()
+
+def get_lag():
+    """Seconds since the last sync and sales rows not yet mirrored."""
+    synced_at = _state["synced_at"]
+    rows_behind = None
+    if _state["remote_last_sale_id"] is not None and _state["last_sale_id"] is not None:
+        rows_behind = max(_state["remote_last_sale_id"] - _state["last_sale_id"], 0)
+    return {
+        "seconds": time.time() - synced_at if synced_at else None,
+        "rows_behind": rows_behind,
+        "last_error": _state["last_error"],
+    }
+
+def _is_current(watermark):
+    """True if the mirror matches the data watermark, or is within LOCAL_MIRROR_MAX_LAG of it.
+
+    The whole watermark is compared: updates and deletes leave max(sale_id) alone.
+    """
+    if _state["syncing"] or _state["last_sale_id"] is None:
+        return False
+    if _state["watermark"] is not None and _state["watermark"] == watermark:
+        return True
+    synced_at = _state["synced_at"]
+    return LOCAL_MIRROR_MAX_LAG > 0 and synced_at is not None and time.time() - synced_at <= LOCAL_MIRROR_MAX_LAG
+
+def check_dialect(sql):
+    """(ok, reason): whether the generated Postgres SQL can run unchanged on the mirror.
+
+    A successful DuckDB EXPLAIN only proves the query binds, so constructs known to
+    return different values or types on the two engines are refused first.
+    """
+    if _POSTGRES_ONLY.search(sql):
+        return False, "uses Postgres-only syntax or writes"
+    if _LIKE_BACKSLASH.search(sql):
+        return False, "LIKE pattern uses backslash escapes"
+    # Literals, quoted identifiers and comments cannot contain a divergent construct
+    code = _QUOTED.sub(" ", sql)
+    for pattern, reason in _DIVERGENT:
+        if pattern.search(code):
+            return False, reason
+    tables = {name.split(".")[-1].lower() for name in _TABLE_REF.findall(code)}
+    unknown = tables - set(MIRRORED_TABLES)
+    if unknown:
+        return False, f"references tables that are not mirrored: {', '.join(sorted(unknown))}"
+    local = _get_connection()
+    try:
+        # Binding the query in DuckDB catches dialect differences the regex misses
+        local.execute(f"EXPLAIN {sql.strip().rstrip(';')}")
+    except Exception as e:
+        return False, f"DuckDB could not plan it: {str(e).splitlines()[0]}"
+    finally:
+        local.close()
+    return True, "compatible"
+
+def route(sql, watermark):
+    """Decide where a query runs. Returns (use_local, reason)."""
+    if not is_enabled():
+        return False, "local mirror disabled"
+    if _connection is None:
+        # Opening the mirror loads the persisted sync state
+        _get_connection().close()
+    if not _is_current(watermark):
+        return False, "mirror is behind the warehouse"
+    return check_dialect(sql)
+
+def execute_local(sql, max_rows):
+    """Run sql on the mirror, capped at max_rows; sets df.attrs["truncated"]."""
+    local = _get_connection()
+    try:
+        query = f"SELECT * FROM ({sql.strip().rstrip(';')}) AS q LIMIT {int(max_rows) + 1}"
+        df = local.execute(query).df()
+    finally:
+        local.close()
+    truncated = len(df) > max_rows
+    if truncated:
+        df = df.iloc[:max_rows]
+    df.attrs["truncated"] = truncated
+    return df
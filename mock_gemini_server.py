@@ -0,0 +1,113 @@
+"""Local stand-in for the Gemini REST API, for exercising the app without a key or quota.
+
+    python mock_gemini_server.py --port 8765 --latency 0.3
+    GEMINI_API_ENDPOINT=http://localhost:8765 GEMINI_API_KEY=mock streamlit run app.py
+
+generateContent and streamGenerateContent answer with the rule-based SQL for the
+question at the end of the prompt, wrapped in a markdown fence like the real model
+tends to. --rate-limit-every N answers every Nth request with a 429 to exercise
+the scheduler's backoff. Context caching is not implemented, so the client falls
+back to sending the schema inline.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from intent_matcher import rule_based_registry
+
+CHUNK_CHARS = 16
+
+_counter_lock = threading.Lock()
+_requests = 0
+
+
+def _prompt_text(body):
+    parts = [part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])]
+    return "\n".join(parts)
+
+def _candidate(text, finished):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate]}
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    # Chunked streaming responses need HTTP/1.1
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    rate_limit_every = 0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        global _requests
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?", 1)[0]
+
+        with _counter_lock:
+            _requests += 1
+            throttled = self.rate_limit_every and _requests % self.rate_limit_every == 0
+        if throttled:
+            self._send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted (mock)",
+                                            "status": "RESOURCE_EXHAUSTED"}})
+            return
+
+        if not path.endswith((":generateContent", ":streamGenerateContent")):
+            self._send_json(404, {"error": {"code": 404, "message": f"{path} is not mocked", "status": "NOT_FOUND"}})
+            return
+
+        question = _prompt_text(body).rsplit("Natural language query:", 1)[-1].strip()
+        text = f"```sql\n{rule_based_registry.generate(question)}\n```"
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path.endswith(":generateContent"):
+            self._send_json(200, _candidate(text, True))
+            return
+
+        # Streaming responses are a JSON array written out element by element
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)]
+        for i, piece in enumerate(pieces):
+            element = ("[" if i == 0 else ",") + json.dumps(_candidate(piece, i == len(pieces) - 1))
+            self._write_chunk(element + ("]" if i == len(pieces) - 1 else ""))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        data = data.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with 429")
+    args = parser.parse_args()
+
+    MockGeminiHandler.latency = args.latency
+    MockGeminiHandler.rate_limit_every = args.rate_limit_every
+    server = ThreadingHTTPServer((args.host, args.port), MockGeminiHandler)
+    print(f"Mock Gemini API on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
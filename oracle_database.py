@@ -1,94 +1,209 @@
-import oracledb
-import os
-from dotenv import load_dotenv
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+from settings import get_setting
+from schema_format import format_schema
 
-# Try to initialize thick mode (for local development)
-try:
-    oracledb.init_oracle_client()
-except Exception as e:
-    print(f"Thick mode initialization warning: {e}")
-    print("Falling back to thin mode...")
+logger = logging.getLogger(__name__)
 
-load_dotenv()
+ORACLE_POOL_MIN = int(get_setting("ORACLE_POOL_MIN", "1"))
+ORACLE_POOL_MAX = int(get_setting("ORACLE_POOL_MAX", "5"))
+ORACLE_POOL_INCREMENT = int(get_setting("ORACLE_POOL_INCREMENT", "1"))
+# Rows per fetch round trip; the first round trip is piggybacked on execute via prefetchrows
+ORACLE_ARRAYSIZE = int(get_setting("ORACLE_ARRAYSIZE", "1000"))
+ORACLE_PREFETCH_ROWS = int(get_setting("ORACLE_PREFETCH_ROWS", str(ORACLE_ARRAYSIZE)))
+ORACLE_STMT_CACHE_SIZE = int(get_setting("ORACLE_STMT_CACHE_SIZE", "50"))
+# Thick mode needs Oracle Client libraries; only initialised when asked for, on first connect
+ORACLE_THICK_MODE = str(get_setting("ORACLE_THICK_MODE", "false")).lower() in ("1", "true", "yes")
+ORACLE_CLIENT_LIB_DIR = get_setting("ORACLE_CLIENT_LIB_DIR")
+
+_pool = None
+_pool_lock = threading.Lock()
+_thick_initialised = False
+_metrics_lock = threading.Lock()
+# checked_out counts sessions borrowed through get_oracle_connection, for the peak
+_metrics = {"acquires": 0, "wait_seconds_total": 0.0, "checked_out": 0, "peak_checked_out": 0}
+
+
+def _oracledb():
+    import oracledb
+    return oracledb
+
+def _init_thick_mode():
+    """Switch python-oracledb to thick mode once, before the first connection."""
+    global _thick_initialised
+    if _thick_initialised or not (ORACLE_THICK_MODE or ORACLE_CLIENT_LIB_DIR):
+        return
+    _thick_initialised = True
+    try:
+        _oracledb().init_oracle_client(lib_dir=ORACLE_CLIENT_LIB_DIR)
+    except Exception as e:
+        logger.info("Thick mode initialization failed (%s); falling back to thin mode", e)
+
+def _get_credentials():
+    user = get_setting("ORACLE_USER")
+    password = get_setting("ORACLE_PASSWORD")
+    dsn = get_setting("ORACLE_DSN")
+    return user, password, dsn
+
+def get_oracle_pool():
+    """Process-wide session pool (created on first use); None if not configured."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            user, password, dsn = _get_credentials()
+            if not all([user, password, dsn]):
+                logger.error("Missing database connection parameters: "
+                             "set ORACLE_USER, ORACLE_PASSWORD and ORACLE_DSN")
+                return None
+            _init_thick_mode()
+            oracledb = _oracledb()
+            _pool = oracledb.create_pool(
+                user=user,
+                password=password,
+                dsn=dsn,
+                min=ORACLE_POOL_MIN,
+                max=ORACLE_POOL_MAX,
+                increment=ORACLE_POOL_INCREMENT,
+                stmtcachesize=ORACLE_STMT_CACHE_SIZE,
+                getmode=oracledb.POOL_GETMODE_WAIT,
+            )
+            logger.info("Oracle session pool created (%s-%s sessions)", ORACLE_POOL_MIN, ORACLE_POOL_MAX)
+    return _pool
+
+@contextmanager
+def get_oracle_connection():
+    """Borrow a pooled session; it goes back to the pool on exit."""
+    pool = get_oracle_pool()
+    if pool is None:
+        raise RuntimeError("Oracle connection is not configured")
+    started = time.perf_counter()
+    conn = pool.acquire()
+    with _metrics_lock:
+        _metrics["acquires"] += 1
+        _metrics["wait_seconds_total"] += time.perf_counter() - started
+        _metrics["checked_out"] += 1
+        _metrics["peak_checked_out"] = max(_metrics["peak_checked_out"], _metrics["checked_out"])
+    try:
+        yield conn
+    finally:
+        with _metrics_lock:
+            _metrics["checked_out"] -= 1
+        pool.release(conn)
 
 def init_oracle_connection():
+    """Keep old name for backward compatibility → return the session pool"""
     try:
-        # Get connection parameters from environment variables
-        user = os.getenv("ORACLE_USER")
-        password = os.getenv("ORACLE_PASSWORD")
-        dsn = os.getenv("ORACLE_DSN")
-        
-        # For Streamlit Cloud deployment, check secrets
-        if not all([user, password, dsn]):
-            try:
-                import streamlit as st
-                user = st.secrets.get("ORACLE_USER")
-                password = st.secrets.get("ORACLE_PASSWORD")
-                dsn = st.secrets.get("ORACLE_DSN")
-            except:
-                pass
-        
-        if not all([user, password, dsn]):
-            print("Missing database connection parameters")
-            print("Please set ORACLE_USER, ORACLE_PASSWORD, and ORACLE_DSN environment variables")
-            return None
-        
-        # Oracle connection details - use thin mode for compatibility
-        connection = oracledb.connect(
-            user=user,
-            password=password,
-            dsn=dsn
-        )
-        print("Successfully connected to Oracle database!")
-        return connection
+        return get_oracle_pool()
     except Exception as e:
-        print(f"Error connecting to Oracle: {e}")
+        logger.error("Error connecting to Oracle: %s", e)
         return None
 
+def get_oracle_pool_metrics():
+    pool = get_oracle_pool()
+    with _metrics_lock:
+        acquires = _metrics["acquires"]
+        wait_seconds_total = _metrics["wait_seconds_total"]
+        peak_checked_out = _metrics["peak_checked_out"]
+    return {
+        "pool_size": pool.max if pool else 0,
+        "checked_out": pool.busy if pool else 0,
+        "idle": (pool.opened - pool.busy) if pool else 0,
+        "peak_checked_out": peak_checked_out,
+        "connects": pool.opened if pool else 0,
+        "avg_wait_seconds": wait_seconds_total / acquires if acquires else 0.0,
+    }
+
+def _tune(cursor):
+    cursor.arraysize = ORACLE_ARRAYSIZE
+    cursor.prefetchrows = ORACLE_PREFETCH_ROWS
+
+def read_sql(sql, max_rows=None):
+    """Run a query and return a DataFrame, fetching ORACLE_ARRAYSIZE rows per round trip.
+
+    If max_rows is given, at most that many rows are kept and df.attrs["truncated"]
+    says whether more were available.
+    """
+    with get_oracle_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            _tune(cursor)
+            cursor.execute(sql.strip().rstrip(";"))
+            columns = [col[0] for col in cursor.description]
+            rows = []
+            while max_rows is None or len(rows) <= max_rows:
+                batch = cursor.fetchmany()
+                if not batch:
+                    break
+                rows.extend(batch)
+        finally:
+            cursor.close()
+    truncated = max_rows is not None and len(rows) > max_rows
+    if truncated:
+        rows = rows[:max_rows]
+    df = pd.DataFrame(rows, columns=columns)
+    df.attrs["truncated"] = truncated
+    return df
+
+def fetch_schema_tables():
+    """Return {table: [(column, data_type), ...]} for the connected user's tables."""
+    tables = {}
+    with get_oracle_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            _tune(cursor)
+            cursor.execute("""
+                SELECT table_name, column_name, data_type
+                FROM user_tab_columns
+                ORDER BY table_name, column_id
+            """)
+            for table, column, dtype in cursor:
+                tables.setdefault(table.lower(), []).append((column.lower(), dtype))
+        finally:
+            cursor.close()
+    return tables
+
+def get_db_schema():
+    """Fetch schema info for the connected user's tables (uncached)."""
+    try:
+        return format_schema(fetch_schema_tables())
+    except Exception as e:
+        return f"⚠️ Error fetching schema: {e}"
+
 def test_connection():
-    """Test the database connection and verify the sales table exists"""
-    conn = init_oracle_connection()
-    if conn is None:
-        print("Failed to connect to Oracle database")
-        return False
-    
+    """Test the database connection and verify the sales table exists.
+
+    Existence and row count come from the user_tables catalog (the row count is
+    the optimizer's estimate), so no query scans the table.
+    """
     try:
-        cursor = conn.cursor()
-        
-        # Check if sales table exists
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM user_tables 
-            WHERE table_name = UPPER('sales')
-        """)
-        table_exists = cursor.fetchone()[0] > 0
-        
-        if table_exists:
-            print("Sales table exists!")
-            
-            # Check data in sales table
-            cursor.execute("SELECT COUNT(*) FROM sales")
-            row_count = cursor.fetchone()[0]
-            print(f"Sales table has {row_count} rows")
-            
-            # Show a sample of the data
-            cursor.execute("SELECT * FROM sales WHERE ROWNUM <= 5")
-            sample_data = cursor.fetchall()
-            print("Sample data:")
-            for row in sample_data:
-                print(row)
-        else:
-            print("Sales table does not exist!")
-            
-        cursor.close()
+        with get_oracle_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT table_name, num_rows FROM user_tables WHERE table_name = :name",
+                               name="SALES")
+                row = cursor.fetchone()
+                table_exists = row is not None
+
+                if table_exists:
+                    table_name, num_rows = row
+                    logger.info("Sales table exists (about %s rows)", num_rows if num_rows is not None else "?")
+                    cursor.execute(f'SELECT * FROM "{table_name}" FETCH FIRST 5 ROWS ONLY')
+                    for sample in cursor.fetchall():
+                        logger.info("Sample row: %s", sample)
+                else:
+                    logger.warning("Sales table does not exist")
+            finally:
+                cursor.close()
         return table_exists
-        
     except Exception as e:
-        print(f"Error testing connection: {e}")
+        logger.error("Error testing connection: %s", e)
         return False
-    finally:
-        if conn:
-            conn.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     test_connection()
@@ -0,0 +1,306 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from postgresql_database import get_db_connection
+from settings import get_setting
+from schema_catalog import get_schema_text
+from result_cache import (cached_generate_sql, result_cache_key, get_cached_result, put_cached_result,
+                          get_data_watermark, normalize_question)
+from query_executor import stream_query, RESULT_MAX_ROWS
+from rollups import route_query, ensure_rollup_fresh, is_rollup_current
+import local_mirror
+from cost_guard import guard, log_execution
+from scheduler import scheduler
+from backends import get_backend
+from tracing import Trace, span, register_gauges
+from sql_validation import repair_sql, sql_fingerprint, CheckedSQL
+from date_ranges import rewrite_date_predicates
+from intent_matcher import FallbackSQL
+
+PIPELINE_WORKERS = int(get_setting("PIPELINE_WORKERS", "8"))
+
+# One executor for the whole process so concurrent sessions share the worker threads
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="bi-pipeline")
+_warm_lock = threading.Lock()
+_warmed = set()
+
+def _warm_once(name, fn):
+    """Run a warm-up step at most once per process (retried if it failed)."""
+    with _warm_lock:
+        if name in _warmed:
+            return
+    fn()
+    with _warm_lock:
+        _warmed.add(name)
+
+def _warm_pool():
+    with get_db_connection() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+class PipelineRun:
+    """One question moving through generate → fetch, with overlapping background stages.
+
+    Schema loading, pool warm-up, LLM client set-up and the data watermark lookup
+    are started together; SQL generation starts immediately and picks up the
+    schema as soon as it is cached. Each stage's latency is recorded in timings.
+
+    LLM calls and query execution go through the process-wide scheduler under
+    user_id, so identical in-flight requests are coalesced and each backend's
+    concurrency is bounded; time spent queued is recorded as queue_llm/queue_db.
+    """
+
+    def __init__(self, question, generate_fn, warm_llm_fn=None, user_id="default"):
+        self.question = question
+        self.generate_fn = generate_fn
+        self.user_id = user_id
+        self.timings = {}
+        self.cancelled = False
+        self.streamed = None
+        self.from_cache = False
+        self.used_rollup = False
+        self.executed_sql = None
+        self.route = None
+        self.route_reason = None
+        self.guard_decision = None
+        self.trace = Trace(question)
+        self.backend = get_backend()
+        self._started = time.perf_counter()
+        self._futures = {}
+        if self.backend.full_pipeline:
+            self._submit("schema", get_schema_text)
+            self._submit("pool_warmup", _warm_once, "pool", _warm_pool)
+        else:
+            self._submit("schema", self.backend.get_schema_text)
+            self._submit("pool_warmup", _warm_once, "pool", self.backend.warm)
+        if warm_llm_fn is not None:
+            self._submit("llm_warmup", _warm_once, "llm", warm_llm_fn)
+        self._submit("generate_sql", cached_generate_sql, question, self._generate_checked)
+        if self.backend.full_pipeline:
+            self._submit("watermark", get_data_watermark)
+
+    def _record_wait(self, stage):
+        def record(seconds):
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        return record
+
+    def _scheduled_generate(self, question):
+        key = ("sql", normalize_question(question))
+        return scheduler.run("llm", self.user_id, key, self.generate_fn, question,
+                             on_wait=self._record_wait("queue_llm"))
+
+    def _generate_checked(self, question):
+        """Generate SQL, then repair or reject it locally before it is cached or run.
+
+        EXTRACT() date filters are rewritten into ranges an index on sale_date can use.
+        """
+        sql = self._scheduled_generate(question)
+        with span("sql_validation") as validation_span:
+            if isinstance(sql, CheckedSQL):
+                # The generator already repaired it (re-prompting the model if needed)
+                validated_sql = str(sql)
+                validation_span.set(parser="generator", repairs=0)
+            else:
+                try:
+                    schema = self.backend.get_schema_tables()
+                except Exception:
+                    schema = None
+                validated = repair_sql(sql, schema, self.backend.dialect)
+                validated_sql = validated.sql
+                validation_span.set(parser=validated.parser, repairs=len(validated.repairs))
+            checked = rewrite_date_predicates(validated_sql)
+            validation_span.set(date_ranges=checked != validated_sql)
+        # Keep the fallback marker so cached_generate_sql still skips it
+        return FallbackSQL(checked) if isinstance(sql, FallbackSQL) else checked
+
+    def _submit(self, stage, fn, *args):
+        def timed():
+            started = time.perf_counter()
+            try:
+                with span(stage):
+                    return fn(*args)
+            finally:
+                self.timings[stage] = time.perf_counter() - started
+        # Stage threads record their spans into this run's trace
+        with self.trace.activate():
+            context = contextvars.copy_context()
+        self._futures[stage] = _executor.submit(context.run, timed)
+
+    def sql(self):
+        """Wait for SQL generation and return the query."""
+        return self._futures["generate_sql"].result()
+
+    def fetch(self, on_preview=None):
+        """Return the result DataFrame, from cache or by streaming it from the database.
+
+        on_preview(df) is called with the first chunk while the rest is still being fetched.
+        """
+        with self.trace.activate():
+            return self._fetch(on_preview)
+
+    def _fetch(self, on_preview):
+        sql_query = self.sql()
+        if not self.backend.full_pipeline:
+            if self.cancelled:
+                return None
+            key = ("result", self.backend.name, sql_fingerprint(sql_query, self.backend.dialect))
+            return scheduler.run("db", self.user_id, key, self._execute_direct, sql_query,
+                                 on_wait=self._record_wait("queue_db"))
+        watermark = self._futures["watermark"].result()
+        cache_key = result_cache_key(sql_query, watermark)
+        with span("result_cache_lookup") as lookup_span:
+            df = get_cached_result(cache_key)
+            lookup_span.set(cache_hit=df is not None)
+        if df is not None:
+            self.from_cache = True
+            self.timings["fetch"] = 0.0
+            # Logged so the warmer keeps counting questions that are answered from cache
+            log_execution(sql_query, seconds=0.0, rows=len(df), route="cache",
+                          question=self.question, user=self.user_id)
+            return df
+
+        if self.cancelled:
+            return None
+        # Keep the mirror and rollup up to date for the next question without delaying this one
+        _executor.submit(local_mirror.maybe_sync)
+
+        df = scheduler.run("db", self.user_id, ("result", cache_key), self._execute, sql_query, watermark,
+                           cache_key, on_preview, on_wait=self._record_wait("queue_db"))
+        if df is None and not self.cancelled:
+            # The run this one was coalesced with got cancelled; execute it ourselves
+            df = scheduler.run("db", self.user_id, None, self._execute, sql_query, watermark, cache_key,
+                               on_preview, on_wait=self._record_wait("queue_db"))
+        elif df is not None and self.route is None:
+            self.route, self.route_reason = "shared", "coalesced with an identical in-flight query"
+        return df
+
+    def _execute(self, sql_query, watermark, cache_key, on_preview):
+        if self.cancelled:
+            return None
+        use_local, self.route_reason = local_mirror.route(sql_query, watermark)
+        if use_local:
+            self.route = "local"
+            self.executed_sql = sql_query
+            started = time.perf_counter()
+            with span("fetch", route=self.route) as fetch_span:
+                df = local_mirror.execute_local(sql_query, RESULT_MAX_ROWS)
+                fetch_span.set(rows=len(df))
+            self.timings["fetch"] = time.perf_counter() - started
+            log_execution(sql_query, seconds=self.timings["fetch"], rows=len(df), route=self.route,
+                          question=self.question, user=self.user_id)
+            put_cached_result(cache_key, df)
+            return df
+
+        self.executed_sql, self.used_rollup = route_query(sql_query, watermark)
+        self.route = "rollup" if self.used_rollup else "postgres"
+        if not is_rollup_current(watermark):
+            # Also after updates/deletes, which leave a rewritable query on the stale rollup otherwise
+            _executor.submit(ensure_rollup_fresh, watermark)
+
+        started = time.perf_counter()
+        try:
+            with span("plan_check") as plan_span:
+                self.guard_decision = guard(self.executed_sql, watermark)
+                plan_span.set(action=self.guard_decision.action, est_cost=self.guard_decision.estimate["cost"],
+                              est_rows=self.guard_decision.estimate["rows"])
+        except Exception as e:
+            log_execution(self.executed_sql, route=self.route, error=str(e), question=self.question,
+                          user=self.user_id)
+            raise
+        self.timings["plan_check"] = time.perf_counter() - started
+        self.executed_sql = self.guard_decision.sql
+        if self.guard_decision.action == "rollup":
+            self.used_rollup = True
+            self.route = "rollup"
+
+        started = time.perf_counter()
+        try:
+            with span("execution", route=self.route) as execution_span:
+                self.streamed = stream_query(self.executed_sql)
+                preview_df = self.streamed.preview()
+                execution_span.set(rows=len(preview_df))
+            self.timings["first_rows"] = time.perf_counter() - started
+            if on_preview is not None and not self.streamed.done and not preview_df.empty:
+                on_preview(preview_df)
+            with span("fetch", route=self.route) as fetch_span:
+                df = self.streamed.result()
+                fetch_span.set(rows=len(df), truncated=bool(df.attrs.get("truncated")))
+        except Exception as e:
+            log_execution(self.executed_sql, self.guard_decision, time.perf_counter() - started,
+                          route=self.route, error=str(e), question=self.question, user=self.user_id)
+            raise
+        self.timings["fetch"] = time.perf_counter() - started
+        if self.streamed.cancelled:
+            return None
+        log_execution(self.executed_sql, self.guard_decision, self.timings["fetch"], len(df), self.route,
+                      question=self.question, user=self.user_id)
+        put_cached_result(cache_key, df)
+        return df
+
+    def _execute_direct(self, sql_query):
+        """Run on a backend without the Postgres extras (cache, rollups, mirror, cost guard)."""
+        self.route = self.backend.name
+        self.route_reason = f"{self.backend.display_name} backend"
+        self.executed_sql = sql_query
+        started = time.perf_counter()
+        try:
+            with span("fetch", route=self.route) as fetch_span:
+                df = self.backend.read_sql(sql_query, RESULT_MAX_ROWS)
+                fetch_span.set(rows=len(df), truncated=bool(df.attrs.get("truncated")))
+        except Exception as e:
+            log_execution(sql_query, seconds=time.perf_counter() - started, route=self.route, error=str(e),
+                          question=self.question, user=self.user_id)
+            raise
+        self.timings["fetch"] = time.perf_counter() - started
+        log_execution(sql_query, seconds=self.timings["fetch"], rows=len(df), route=self.route,
+                      question=self.question, user=self.user_id)
+        return df
+
+    def cancel(self):
+        """Abandon this run; a running database query is cancelled server-side."""
+        self.cancelled = True
+        for future in self._futures.values():
+            future.cancel()
+        if self.streamed is not None:
+            self.streamed.cancel()
+
+    @property
+    def done(self):
+        if self.streamed is not None:
+            return self.streamed.done
+        return all(f.done() for f in self._futures.values())
+
+    def total_seconds(self):
+        return time.perf_counter() - self._started
+
+
+def start_pipeline(question, generate_fn, warm_llm_fn=None, user_id="default"):
+    """Kick off all stages for a question and return the run handle."""
+    return PipelineRun(question, generate_fn, warm_llm_fn, user_id)
+
+def warm_up(warm_llm_fn=None):
+    """Start schema load, pool warm-up and LLM set-up in the background at app start."""
+    backend = get_backend()
+    if backend.full_pipeline:
+        _executor.submit(get_schema_text)
+        _executor.submit(_warm_once, "pool", _warm_pool)
+    else:
+        _executor.submit(backend.get_schema_text)
+        _executor.submit(_warm_once, "pool", backend.warm)
+    if warm_llm_fn is not None:
+        _executor.submit(_warm_once, "llm", warm_llm_fn)
+
+def _pipeline_gauges():
+    """Pool and scheduler state for the Prometheus endpoint."""
+    gauges = {f"bi_pool_{key}": value for key, value in get_backend().pool_metrics().items()
+              if isinstance(value, (int, float))}
+    stats = scheduler.stats()
+    gauges["bi_scheduler_coalesced_total"] = stats.pop("coalesced")
+    for backend, backend_stats in stats.items():
+        for key, value in backend_stats.items():
+            gauges[f"bi_scheduler_{backend}_{key}"] = value
+    return gauges
+
+register_gauges(_pipeline_gauges)
@@ -1,66 +1,236 @@
-import os
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from settings import get_setting
+from schema_format import format_schema
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+_engine_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_engines = {}
+_pool_metrics = {}
+
+def _get_pool_config():
+    return {
+        "pool_size": int(get_setting("DB_POOL_SIZE", "5")),
+        "max_overflow": int(get_setting("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(get_setting("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(get_setting("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": str(get_setting("DB_POOL_PRE_PING", "true")).lower() in ("1", "true", "yes"),
+    }
+
+def _get_database_url():
+    url = get_setting("POSTGRES_URL")
+    if url:
+        return url
+
+    user = get_setting("POSTGRES_USER")
+    password = get_setting("POSTGRES_PASSWORD")
+    host = get_setting("POSTGRES_HOST")
+    port = get_setting("POSTGRES_PORT", "5432")
+    db = get_setting("POSTGRES_DB")
+
+    if not all([user, password, host, db]):
+        raise ValueError("❌ Missing database environment variables. Check your .env file.")
+
+    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
+
+def _instrument_engine(engine, metrics):
+    """Attach pool listeners that keep connection counters up to date."""
+    statement_timeout_ms = int(get_setting("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, connection_record):
+        with _metrics_lock:
+            metrics["connects"] += 1
+        if statement_timeout_ms > 0:
+            cursor = dbapi_conn.cursor()
+            cursor.execute(f"SET statement_timeout = {statement_timeout_ms}")
+            cursor.close()
+            dbapi_conn.commit()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, connection_record, connection_proxy):
+        with _metrics_lock:
+            metrics["checked_out"] += 1
+            metrics["checkouts"] += 1
+            metrics["peak_checked_out"] = max(metrics["peak_checked_out"], metrics["checked_out"])
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_conn, connection_record):
+        with _metrics_lock:
+            metrics["checked_out"] = max(metrics["checked_out"] - 1, 0)
 
 def init_postgres_connection():
     """Keep old name for backward compatibility → return SQLAlchemy engine"""
     return get_sqlalchemy_engine()
 
+def _get_engine_and_metrics():
+    url = _get_database_url()
+    engine = _engines.get(url)
+    if engine is not None:
+        return engine, _pool_metrics[url]
+
+    with _engine_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            sslmode = get_setting("POSTGRES_SSLMODE", "require")
+            engine = create_engine(url, connect_args={"sslmode": sslmode}, **_get_pool_config())
+            metrics = {
+                "connects": 0,
+                "checkouts": 0,
+                "checked_out": 0,
+                "peak_checked_out": 0,
+                "wait_seconds_total": 0.0,
+                "wait_seconds_max": 0.0,
+                "timed_checkouts": 0,
+            }
+            _instrument_engine(engine, metrics)
+            _pool_metrics[url] = metrics
+            _engines[url] = engine
+    return engine, _pool_metrics[url]
+
 def get_sqlalchemy_engine():
-    """Create and return a SQLAlchemy engine for PostgreSQL (Neon/Cloud)."""
-    user = os.getenv("POSTGRES_USER")
-    password = os.getenv("POSTGRES_PASSWORD")
-    host = os.getenv("POSTGRES_HOST")
-    port = os.getenv("POSTGRES_PORT", "5432")
-    db = os.getenv("POSTGRES_DB")
+    """Return the process-wide SQLAlchemy engine for PostgreSQL (Neon/Cloud).
 
-    if not all([user, password, host, db]):
-        raise ValueError("❌ Missing database environment variables. Check your .env file.")
+    The engine (and its connection pool) is created once per database URL and
+    shared by every helper, the Streamlit app and the query generators.
+    """
+    return _get_engine_and_metrics()[0]
 
-    url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
-    engine = create_engine(url, connect_args={"sslmode": "require"})
-    return engine
+@contextmanager
+def get_db_connection():
+    """Check a connection out of the shared pool, recording how long the checkout waited."""
+    engine, metrics = _get_engine_and_metrics()
+    started = time.perf_counter()
+    conn = engine.connect()
+    waited = time.perf_counter() - started
+    with _metrics_lock:
+        metrics["timed_checkouts"] += 1
+        metrics["wait_seconds_total"] += waited
+        metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def get_pool_metrics():
+    """Snapshot of pool usage for the shared engine."""
+    engine, metrics = _get_engine_and_metrics()
+    with _metrics_lock:
+        metrics = dict(metrics)
+    metrics["pool_size"] = engine.pool.size()
+    metrics["idle"] = engine.pool.checkedin()
+    metrics["overflow"] = engine.pool.overflow()
+    metrics["avg_wait_seconds"] = (
+        metrics["wait_seconds_total"] / metrics["timed_checkouts"] if metrics["timed_checkouts"] else 0.0
+    )
+    return metrics
 
 def test_connection():
     """Check if the sales table exists in PostgreSQL."""
     try:
-        engine = get_sqlalchemy_engine()
-        with engine.connect() as conn:
+        with get_db_connection() as conn:
             result = conn.execute(
                 text("SELECT to_regclass('public.sales');")
             ).fetchone()
             if result and result[0]:
-                print("✅ Sales table exists.")
+                logger.info("Sales table exists")
                 return True
             else:
-                print("⚠️ Sales table not found.")
+                logger.warning("Sales table not found")
                 return False
     except Exception as e:
-        print(f"❌ Connection test failed: {e}")
+        logger.error("Connection test failed: %s", e)
         return False
 
+def fetch_schema_tables():
+    """Return {table: [(column, data_type), ...]} for all tables in the public schema."""
+    with get_db_connection() as conn:
+        result = conn.execute(text("""
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = 'public'
+            ORDER BY table_name, ordinal_position;
+        """)).fetchall()
+
+    tables = {}
+    for table, col, dtype in result:
+        tables.setdefault(table, []).append((col, dtype))
+    return tables
+
+def fetch_schema_fingerprint():
+    """Cheap catalog fingerprint that changes whenever DDL touches the public schema.
+
+    Reads pg_class/pg_attribute directly instead of the information_schema views:
+    any CREATE/ALTER/DROP rewrites the catalog rows, which bumps their xmin.
+    """
+    with get_db_connection() as conn:
+        row = conn.execute(text("""
+            SELECT COUNT(*),
+                   COALESCE(MAX(c.xmin::text::bigint), 0),
+                   COALESCE(MAX(c.relfilenode::bigint), 0),
+                   (SELECT COALESCE(MAX(a.xmin::text::bigint), 0)
+                      FROM pg_attribute a
+                      JOIN pg_class ac ON ac.oid = a.attrelid
+                      JOIN pg_namespace an ON an.oid = ac.relnamespace
+                     WHERE an.nspname = 'public' AND a.attnum > 0)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relkind IN ('r', 'v', 'm', 'p', 'f');
+        """)).fetchone()
+    return ":".join(str(v) for v in row)
+
+def fetch_schema_metadata(tables, sample_values=True, max_samples=20):
+    """Foreign keys, comments and sample values used to rank tables for a question.
+
+    Returns {"foreign_keys": [[table, column, ref_table, ref_column], ...],
+             "comments": {table: {"": table_comment, column: comment}},
+             "samples": {table: {column: [value, ...]}}}.
+    """
+    metadata = {"foreign_keys": [], "comments": {}, "samples": {}}
+    with get_db_connection() as conn:
+        metadata["foreign_keys"] = [list(row) for row in conn.execute(text("""
+            SELECT cl.relname, att.attname, ref.relname, ref_att.attname
+            FROM pg_constraint con
+            JOIN pg_class cl ON cl.oid = con.conrelid
+            JOIN pg_namespace n ON n.oid = cl.relnamespace
+            JOIN pg_class ref ON ref.oid = con.confrelid
+            CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(attnum, ref_attnum)
+            JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+            JOIN pg_attribute ref_att ON ref_att.attrelid = con.confrelid AND ref_att.attnum = k.ref_attnum
+            WHERE con.contype = 'f' AND n.nspname = 'public';
+        """)).fetchall()]
+
+        for table, column, comment in conn.execute(text("""
+            SELECT c.relname, COALESCE(a.attname, ''), d.description
+            FROM pg_description d
+            JOIN pg_class c ON c.oid = d.objoid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = d.objsubid AND d.objsubid > 0
+            WHERE n.nspname = 'public' AND d.classoid = 'pg_class'::regclass;
+        """)).fetchall():
+            metadata["comments"].setdefault(table, {})[column] = comment
+
+        if sample_values:
+            for table, cols in tables.items():
+                for col, dtype in cols:
+                    if dtype not in ("text", "character varying", "character"):
+                        continue
+                    # Only look at the first rows so sampling stays cheap on large tables
+                    rows = conn.execute(text(
+                        f'SELECT DISTINCT "{col}" FROM (SELECT "{col}" FROM "{table}" LIMIT 1000) t '
+                        f'WHERE "{col}" IS NOT NULL LIMIT {int(max_samples)}'
+                    )).fetchall()
+                    metadata["samples"].setdefault(table, {})[col] = [str(r[0])[:60] for r in rows]
+    return metadata
+
 def get_db_schema():
-    """Fetch schema info for all tables in the current database."""
+    """Fetch schema info for all tables in the current database (uncached)."""
     try:
-        engine = get_sqlalchemy_engine()
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT table_name, column_name, data_type
-                FROM information_schema.columns
-                WHERE table_schema = 'public'
-                ORDER BY table_name, ordinal_position;
-            """)).fetchall()
-
-            schema_dict = {}
-            for table, col, dtype in result:
-                schema_dict.setdefault(table, []).append(f"{col} {dtype}")
-
-            schema_text = ""
-            for table, cols in schema_dict.items():
-                schema_text += f"TABLE: {table} ({', '.join(cols)})\n"
-
-            return schema_text.strip()
+        return format_schema(fetch_schema_tables())
     except Exception as e:
         return f"⚠️ Error fetching schema: {e}"
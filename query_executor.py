@@ -0,0 +1,131 @@
+import logging
+import threading
+import pandas as pd
+from postgresql_database import get_db_connection
+from settings import get_setting
+from arrow_fetch import use_arrow, iter_sql_arrow
+from cost_guard import apply_session_guards
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_ROWS = int(get_setting("STREAM_CHUNK_ROWS", "10000"))
+PREVIEW_ROWS = int(get_setting("PREVIEW_ROWS", "1000"))
+RESULT_MAX_ROWS = int(get_setting("RESULT_MAX_ROWS", "200000"))
+RESULT_MAX_BYTES = int(get_setting("RESULT_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+class StreamedResult:
+    """Result of a query that is fetched chunk by chunk on a background thread."""
+
+    def __init__(self, sql, chunksize, max_rows, max_bytes):
+        self.sql = sql
+        self.chunksize = chunksize
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+        self.cancelled = False
+        self.error = None
+        self._chunks = []
+        self._dbapi_conn = None
+        self._first_ready = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with get_db_connection() as conn:
+                self._dbapi_conn = conn.connection.dbapi_connection
+                apply_session_guards(conn)
+                if use_arrow():
+                    # Columnar path: COPY parsed block by block, one chunk per block
+                    chunks = iter_sql_arrow(self.sql, conn, max_rows=self.max_rows)
+                else:
+                    # stream_results makes psycopg2 use a server-side (named) cursor,
+                    # so only one chunk at a time is held client-side. The SQL goes to
+                    # the driver verbatim (no text()): ':30' in a literal such as
+                    # '10:30' must not become a bind parameter
+                    conn = conn.execution_options(stream_results=True, max_row_buffer=self.chunksize,
+                                                  no_parameters=True)
+                    chunks = pd.read_sql(self.sql, conn, chunksize=self.chunksize)
+                try:
+                    for chunk in chunks:
+                        if self.cancelled or not self._accept(chunk):
+                            break
+                finally:
+                    # Stops an unfinished COPY or server-side cursor early
+                    close = getattr(chunks, "close", None)
+                    if close is not None:
+                        close()
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            self._dbapi_conn = None
+            self._first_ready.set()
+            self._done.set()
+
+    def _accept(self, chunk):
+        """Keep chunk within the row/byte budget; False once fetching should stop."""
+        if chunk.empty:
+            return True
+        # The budget is checked when more rows arrive, so a result that
+        # exactly fills it is not reported as truncated
+        if self.rows >= self.max_rows or self.bytes >= self.max_bytes:
+            self.truncated = True
+            return False
+        remaining = self.max_rows - self.rows
+        if len(chunk) > remaining:
+            chunk = chunk.iloc[:remaining]
+            self.truncated = True
+        self._chunks.append(chunk)
+        self.rows += len(chunk)
+        self.bytes += int(chunk.memory_usage(deep=True).sum())
+        self._first_ready.set()
+        return not self.truncated
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Stop fetching and ask the server to cancel the running statement."""
+        self.cancelled = True
+        dbapi_conn = self._dbapi_conn
+        if dbapi_conn is not None and not self.done:
+            try:
+                dbapi_conn.cancel()
+            except Exception as e:
+                logger.warning("Could not cancel running query: %s", e)
+
+    def preview(self, n=PREVIEW_ROWS, timeout=None):
+        """Block until the first chunk has arrived and return its first n rows."""
+        self._first_ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        if not self._chunks:
+            return pd.DataFrame()
+        return self._chunks[0].head(n)
+
+    def result(self, timeout=None):
+        """Block until fetching finishes (or the budget is hit) and return the full frame."""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        if not self._chunks:
+            df = pd.DataFrame()
+            df.attrs["truncated"] = self.truncated
+            return df
+        df = pd.concat(self._chunks, ignore_index=True) if len(self._chunks) > 1 else self._chunks[0]
+        df.attrs["truncated"] = self.truncated
+        return df
+
+
+def stream_query(sql, chunksize=STREAM_CHUNK_ROWS, max_rows=RESULT_MAX_ROWS, max_bytes=RESULT_MAX_BYTES):
+    """Start fetching sql in the background with a server-side cursor and row/byte budget."""
+    return StreamedResult(sql, chunksize, max_rows, max_bytes).start()
@@ -1,98 +1,218 @@
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
-from postgresql_database import get_db_schema
-
-load_dotenv()
-
-def get_gemini_api_key():
-    """Get Gemini API key from env or Streamlit secrets."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key or api_key == "your_gemini_api_key_here":
+import logging
+import re
+import zlib
+from gemini_client import client
+from semantic_cache import semantic_cache
+from intent_matcher import gemini_fallback_registry, to_dialect, FallbackSQL
+from backends import get_backend
+from settings import get_setting
+from scheduler import is_rate_limit_error
+from tracing import span
+from sql_validation import repair_sql, SQLValidationError, CheckedSQL
+
+
+logger = logging.getLogger(__name__)
+
+# Questions per prompt in generate_sql_queries
+GEMINI_BATCH_SIZE = int(get_setting("GEMINI_BATCH_SIZE", "20"))
+# Re-prompts with the validation errors when local repair cannot fix the generated SQL
+SQL_RETRIES = int(get_setting("SQL_RETRIES", "1"))
+
+SYSTEM_PROMPT_TEMPLATE = """
+You are an expert SQL generator.
+Convert the following natural language request into a valid {dialect} SQL query.
+
+Rules:
+- Use {dialect} syntax.
+- {limit_rule}
+- Filter dates with ranges on the column, e.g. sale_date >= DATE '2024-02-01' AND sale_date < DATE '2024-03-01' for February 2024; never use EXTRACT() on sale_date in WHERE
+- Always JOIN products and customers when referencing product_name or customer_name.
+- Only return the SQL query (no explanation, no markdown).
+"""
+
+def system_prompt(backend=None):
+    """The static instructions for the configured backend's dialect."""
+    backend = backend or get_backend()
+    return SYSTEM_PROMPT_TEMPLATE.format(dialect=backend.display_name, limit_rule=backend.limit_rule)
+
+def _schema_for(backend):
+    """(schema text, schema version) for the backend; Postgres uses the cached catalog."""
+    if backend.full_pipeline:
+        # Imported here so loading this module does not pull in SQLAlchemy
+        from schema_catalog import get_schema_text, get_schema_fingerprint
+        # Loads (or revalidates) the cached catalog so the fingerprint is current
+        return get_schema_text(), get_schema_fingerprint()
+    schema_text = backend.get_schema_text()
+    return schema_text, f"{backend.name}:{zlib.crc32(schema_text.encode('utf-8')):08x}"
+
+def warm_up():
+    """Configure the Gemini client ahead of the first question."""
+    if client.configure():
+        client.model(system_prompt())
+
+def _checked_sql(sql, backend):
+    """The SQL after local repair; raises SQLValidationError if it cannot be made valid.
+
+    The result is marked CheckedSQL so the pipeline does not repair it a second time.
+    """
+    try:
+        schema = backend.get_schema_tables()
+    except Exception:
+        schema = None
+    return CheckedSQL(repair_sql(sql, schema, backend.dialect).sql)
+
+def _generate_valid_sql(prompt, model, backend):
+    """Generate SQL, feeding validation errors back to the model up to SQL_RETRIES times."""
+    sql = to_dialect(client.generate_sql(prompt, model), backend.dialect)
+    for attempt in range(SQL_RETRIES + 1):
         try:
-            import streamlit as st
-            api_key = st.secrets.get("GEMINI_API_KEY")
-        except:
-            pass
-    return api_key
+            return _checked_sql(sql, backend)
+        except SQLValidationError as e:
+            if attempt == SQL_RETRIES:
+                raise
+            with span("sql_retry", attempt=attempt + 1, problems=len(e.problems)):
+                retry_prompt = (
+                    f"{prompt}\n\nYour previous answer was:\n{sql}\n"
+                    f"It is invalid: {'; '.join(e.problems)}.\nReturn a corrected query."
+                )
+                sql = to_dialect(client.generate_sql(retry_prompt, model), backend.dialect)
 
 def generate_sql_query(natural_language_query):
-    api_key = get_gemini_api_key()
-    if not api_key:
+    with span("key_lookup") as key_span:
+        configured = client.configure()
+        key_span.set(found=configured)
+    if not configured:
         return generate_fallback_query(natural_language_query)
 
+    from schema_linker import get_pruned_schema, estimate_tokens
     try:
-        genai.configure(api_key=api_key)
-
-        schema_text = get_db_schema()
-        print("🔎 Injected DB Schema:")
-        print(schema_text)
-
-        prompt = f"""
-        You are an expert SQL generator.
-        Convert the following natural language request into a valid PostgreSQL SQL query.
-
-        Database schema:
-        {schema_text}
-
-        Rules:
-        - Use PostgreSQL syntax.
-        - For limiting results, use: LIMIT N
-        - Use EXTRACT(MONTH FROM sale_date) for month filters
-        - Always JOIN products and customers when referencing product_name or customer_name.
-        - Only return the SQL query (no explanation, no markdown).
-
-        Natural language query: {natural_language_query}
-        """
-
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
-
-        print("🔎 Gemini Raw Response:")
-        print(response.text)
-
-        sql_query = response.text.strip()
-
-        # Cleanup if wrapped in markdown fences
-        if sql_query.startswith("```sql"):
-            sql_query = sql_query[6:]
-        if sql_query.endswith("```"):
-            sql_query = sql_query[:-3]
-
-        return sql_query.strip()
+        backend = get_backend()
+        instructions = system_prompt(backend)
+        with span("schema_fetch") as schema_span:
+            full_schema, schema_version = _schema_for(backend)
+
+            cached_sql = semantic_cache.lookup(natural_language_query, schema_version)
+            schema_span.set(cache_hit=cached_sql is not None)
+            if cached_sql is not None:
+                # Only validated SQL is put in the semantic cache
+                return CheckedSQL(cached_sql)
+
+            # With provider-side context caching the full schema is uploaded once per
+            # schema version; otherwise the pruned schema goes inline with the question
+            model = None
+            if not full_schema.startswith("⚠️"):
+                model = client.context_model(schema_version, instructions, [f"Database schema:\n{full_schema}"])
+            schema_span.set(context_cached=model is not None)
+            schema_text = None
+            # Per-request stats; the cached context holds every table
+            schema_stats = {}
+            if model is None:
+                # Schema linking needs the Postgres catalog metadata; other backends get the full schema
+                if backend.full_pipeline:
+                    schema_text, schema_stats = get_pruned_schema(natural_language_query)
+                else:
+                    schema_text = full_schema
+        if schema_text is not None:
+            logger.debug("Injected DB schema:\n%s", schema_text)
+
+        with span("prompt_build") as prompt_span:
+            if schema_text is None:
+                prompt = f"Natural language query: {natural_language_query}"
+            else:
+                prompt = f"Database schema:\n{schema_text}\n\nNatural language query: {natural_language_query}"
+                model = client.model(instructions)
+
+            prompt_span.set(
+                prompt_tokens=estimate_tokens(instructions) + estimate_tokens(prompt),
+                tables_selected=schema_stats.get("tables_selected"),
+                tables_total=schema_stats.get("tables_total"),
+            )
+
+        sql_query = _generate_valid_sql(prompt, model, backend)
+        semantic_cache.put(natural_language_query, sql_query, schema_version)
+        return sql_query
     except Exception as e:
-        print(f"❌ Error with Gemini API: {e}")
-        return generate_fallback_query(natural_language_query)
+        if is_rate_limit_error(e):
+            # Let the scheduler back off and retry instead of silently degrading
+            raise
+        if isinstance(e, SQLValidationError):
+            # The model was asked and re-asked; a keyword-matched fallback would answer a different question
+            raise
+        logger.warning("Error with Gemini API: %s", e)
+        # Marked so the SQL cache does not pin this answer to the question
+        return FallbackSQL(generate_fallback_query(natural_language_query))
+
+def _split_batch_response(text, count):
+    """Map question number → SQL from a "-- Q<n>" delimited batch answer."""
+    text = re.sub(r"^```\w*\s*$", "", text, flags=re.MULTILINE)
+    answers = {}
+    parts = re.split(r"^\s*--\s*Q(\d+)\s*$", text, flags=re.MULTILINE)
+    for number, body in zip(parts[1::2], parts[2::2]):
+        index = int(number) - 1
+        sql = body.strip().rstrip(";").strip()
+        if 0 <= index < count and sql:
+            answers[index] = sql
+    return answers
+
+def generate_sql_queries(questions, batch_size=GEMINI_BATCH_SIZE):
+    """Generate SQL for many questions with one LLM call per batch_size questions.
+
+    Semantic cache hits are answered locally; questions the batch answer is
+    missing are generated one at a time with generate_sql_query. A question whose
+    SQL cannot be made valid gets its SQLValidationError in place of the SQL.
+    """
+    results = [None] * len(questions)
+    if not client.configure():
+        return [generate_fallback_query(q) for q in questions]
+
+    from schema_linker import get_pruned_schema, estimate_tokens
+    backend = get_backend()
+    instructions = system_prompt(backend)
+    full_schema, schema_version = _schema_for(backend)
+    pending = []
+    for i, question in enumerate(questions):
+        results[i] = semantic_cache.lookup(question, schema_version)
+        if results[i] is None:
+            pending.append(i)
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        try:
+            with span("prompt_build", questions=len(batch)) as prompt_span:
+                # One pruned schema covering every question in the batch
+                if backend.full_pipeline:
+                    schema_text, _ = get_pruned_schema(" ".join(questions[i] for i in batch))
+                else:
+                    schema_text = full_schema
+                numbered = "\n".join(f"Q{n}: {questions[i]}" for n, i in enumerate(batch, 1))
+                prompt = (
+                    f"Database schema:\n{schema_text}\n\n"
+                    "Answer every question below with one SQL query. Put a line \"-- Q<n>\" "
+                    "before the query for question n and nothing else.\n\n"
+                    f"{numbered}"
+                )
+                prompt_span.set(prompt_tokens=estimate_tokens(instructions) + estimate_tokens(prompt))
+            answers = _split_batch_response(client.generate_text(prompt, client.model(instructions)), len(batch))
+        except Exception as e:
+            if is_rate_limit_error(e):
+                raise
+            logger.warning("Batch generation failed, falling back to single questions: %s", e)
+            answers = {}
+        for n, i in enumerate(batch):
+            try:
+                # Invalid or missing answers get a single-question prompt, which can retry
+                results[i] = _checked_sql(to_dialect(answers[n], backend.dialect), backend) if n in answers else None
+            except SQLValidationError as e:
+                logger.info("Batch answer for %r rejected: %s", questions[i], e)
+                results[i] = None
+            if results[i] is not None:
+                semantic_cache.put(questions[i], results[i], schema_version)
+                continue
+            try:
+                results[i] = generate_sql_query(questions[i])
+            except SQLValidationError as e:
+                results[i] = e
+    return results
 
 def generate_fallback_query(natural_language_query):
-    query = natural_language_query.lower()
-
-    if "last 5" in query:
-        return """SELECT s.sale_id, p.product_name, c.customer_name, s.amount, s.sale_date
-                  FROM sales s
-                  JOIN products p ON s.product_id = p.product_id
-                  JOIN customers c ON s.customer_id = c.customer_id
-                  ORDER BY s.sale_date DESC LIMIT 5"""
-    elif "total sales" in query and "product" in query:
-        return """SELECT p.product_name, SUM(s.amount) AS total_sales
-                  FROM sales s
-                  JOIN products p ON s.product_id = p.product_id
-                  GROUP BY p.product_name ORDER BY total_sales DESC"""
-    elif "average" in query and "product" in query:
-        return """SELECT p.product_name, AVG(s.amount) AS average_sale
-                  FROM sales s
-                  JOIN products p ON s.product_id = p.product_id
-                  GROUP BY p.product_name ORDER BY average_sale DESC"""
-    elif "north" in query or "south" in query:
-        return """SELECT c.region, SUM(s.amount) AS total_sales
-                  FROM sales s
-                  JOIN customers c ON s.customer_id = c.customer_id
-                  WHERE c.region IN ('North', 'South')
-                  GROUP BY c.region"""
-    elif "february" in query:
-        return """SELECT p.product_name, SUM(s.amount) AS total_sales
-                  FROM sales s
-                  JOIN products p ON s.product_id = p.product_id
-                  WHERE EXTRACT(MONTH FROM s.sale_date) = 2
-                  GROUP BY p.product_name"""
-    return "SELECT * FROM sales LIMIT 10"
+    return gemini_fallback_registry.generate(natural_language_query, get_backend().dialect)
@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+from sqlalchemy import text
+from postgresql_database import get_db_connection
+from settings import get_setting
+from intent_matcher import FallbackSQL
+from schema_catalog import get_schema_fingerprint
+from tracing import current_span
+from sql_validation import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SQL_CACHE_MAX_ENTRIES = int(get_setting("SQL_CACHE_MAX_ENTRIES", "1000"))
+RESULT_CACHE_MAX_ENTRIES = int(get_setting("RESULT_CACHE_MAX_ENTRIES", "200"))
+RESULT_CACHE_MAX_BYTES = int(get_setting("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Optional on-disk Parquet tier; disabled unless a directory is configured
+RESULT_CACHE_DIR = get_setting("RESULT_CACHE_DIR")
+# How long a data watermark is reused before sales is polled again
+WATERMARK_INTERVAL = float(get_setting("RESULT_CACHE_WATERMARK_INTERVAL", "10"))
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and (optionally) total size."""
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries
+                                  or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _dataframe_size(df):
+    return int(df.memory_usage(deep=True).sum())
+
+_sql_cache = LRUCache(SQL_CACHE_MAX_ENTRIES)
+_result_cache = LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, _dataframe_size)
+_disk_stats = {"hits": 0, "misses": 0, "writes": 0}
+_watermark = {"value": None, "checked_at": 0.0}
+_watermark_lock = threading.Lock()
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip("?.! ")
+
+def get_data_watermark(force_refresh=False):
+    """Version of the sales data: max(sale_id) plus the pg_stat modification counters.
+
+    max(sale_id) is an index lookup and catches appends; the pg_stat counters catch
+    updates and deletes. The value is reused for WATERMARK_INTERVAL seconds.
+    """
+    with _watermark_lock:
+        now = time.time()
+        if not force_refresh and _watermark["value"] is not None \
+                and now - _watermark["checked_at"] < WATERMARK_INTERVAL:
+            return _watermark["value"]
+
+        with get_db_connection() as conn:
+            row = conn.execute(text("""
+                SELECT (SELECT COALESCE(MAX(sale_id), 0) FROM sales),
+                       COALESCE(st.n_tup_ins + st.n_tup_upd + st.n_tup_del, 0)
+                FROM (SELECT 1) AS one
+                LEFT JOIN pg_stat_user_tables st
+                  ON st.schemaname = 'public' AND st.relname = 'sales';
+            """)).fetchone()
+        _watermark["value"] = f"{row[0]}:{row[1]}"
+        _watermark["checked_at"] = now
+        return _watermark["value"]
+
+def cached_generate_sql(question, generate_fn):
+    """Level 1: NL question → SQL, keyed by normalized text and the schema fingerprint."""
+    key = (normalize_question(question), get_schema_fingerprint())
+    sql = _sql_cache.get(key)
+    stage = current_span()
+    if stage is not None:
+        stage.set(cache_hit=sql is not None)
+    if sql is None:
+        sql = generate_fn(question)
+        # A fallback after a transient generator error is used once, never cached
+        if isinstance(sql, FallbackSQL):
+            return sql
+        _sql_cache.put(key, sql)
+        # generating may have loaded the schema for the first time
+        if key[1] is None:
+            _sql_cache.put((key[0], get_schema_fingerprint()), sql)
+    return sql
+
+def get_cached_sql(question):
+    """SQL already generated for question under the current schema, or None."""
+    return _sql_cache.get((normalize_question(question), get_schema_fingerprint()))
+
+def put_cached_sql(question, sql):
+    _sql_cache.put((normalize_question(question), get_schema_fingerprint()), sql)
+
+def _parquet_path(key):
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(RESULT_CACHE_DIR, f"{digest}.parquet")
+
+def _read_disk(key):
+    if not RESULT_CACHE_DIR:
+        return None
+    path = _parquet_path(key)
+    if not os.path.exists(path):
+        _disk_stats["misses"] += 1
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception as e:
+        logger.warning("Could not read cached result %s: %s", path, e)
+        return None
+    _disk_stats["hits"] += 1
+    return df
+
+def _write_disk(key, df):
+    if not RESULT_CACHE_DIR:
+        return
+    try:
+        os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+        path = _parquet_path(key)
+        df.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        _disk_stats["writes"] += 1
+    except Exception as e:
+        logger.warning("Could not persist result cache entry: %s", e)
+
+def result_cache_key(sql, watermark=None):
+    """Key for a result: fingerprint of the canonical SQL plus the sales data watermark.
+
+    Formatting, keyword case and table aliases do not change the fingerprint, so
+    equivalent queries generated differently share an entry.
+    """
+    sql_hash = sql_fingerprint(sql)
+    return (sql_hash, watermark if watermark is not None else get_data_watermark())
+
+def get_cached_result(key):
+    """Look up a result in memory, then on disk. Returns a copy the caller may mutate."""
+    df = _result_cache.get(key)
+    if df is None:
+        df = _read_disk(key)
+        if df is None:
+            return None
+        _result_cache.put(key, df)
+    return df.copy()
+
+def put_cached_result(key, df):
+    _result_cache.put(key, df)
+    _write_disk(key, df)
+
+def cached_read_sql(sql, engine):
+    """Level 2: SQL → DataFrame, keyed by SQL hash and the sales data watermark."""
+    key = result_cache_key(sql)
+    df = get_cached_result(key)
+    if df is None:
+        df = pd.read_sql(sql, engine)
+        put_cached_result(key, df)
+        df = df.copy()
+    return df
+
+def clear_caches():
+    _sql_cache.clear()
+    _result_cache.clear()
+
+def get_cache_stats():
+    """Hit/miss counters for both cache levels."""
+    return {
+        "sql": _sql_cache.stats(),
+        "results": _result_cache.stats(),
+        "disk": dict(_disk_stats, enabled=bool(RESULT_CACHE_DIR)),
+    }
@@ -0,0 +1,343 @@
+import logging
+import re
+import threading
+import time
+from sqlalchemy import text
+from postgresql_database import get_db_connection
+from settings import get_setting
+from schema_catalog import get_schema_tables
+from sql_validation import canonical_sql
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_ENABLED = str(get_setting("ROLLUP_ENABLED", "false")).lower() in ("1", "true", "yes")
+ROLLUP_TABLE = "sales_daily_rollup"
+# Each refresh recomputes the groups touched by this many sale_ids below the last
+# folded-in one, so sales whose transaction committed late are not lost
+ROLLUP_LOOKBACK_IDS = int(get_setting("ROLLUP_LOOKBACK_IDS", "10000"))
+# Seconds between comparisons of the rollup's row count with sales; a mismatch rebuilds it
+ROLLUP_RECONCILE_INTERVAL = float(get_setting("ROLLUP_RECONCILE_INTERVAL", "3600"))
+
+# Bumped when the rollup's columns or meaning change; older rollups are rebuilt
+ROLLUP_VERSION = 2
+
+_refresh_lock = threading.Lock()
+_state = {"last_sale_id": None, "mod_count": None, "watermark": None, "requested": None, "refreshing": False,
+          "reconciled_at": None}
+
+# Day × product × customer region grain; min/max are kept so MIN/MAX(amount) can be answered too.
+# customer_matched separates sales without a customer row, which an INNER JOIN customers drops;
+# amount_count counts non-NULL amounts for AVG, sale_count all rows for COUNT(*)
+CREATE_ROLLUP_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+        sale_date date NOT NULL,
+        product_id integer NOT NULL,
+        region text,
+        customer_matched boolean NOT NULL DEFAULT true,
+        total_amount numeric,
+        sale_count bigint NOT NULL,
+        amount_count bigint NOT NULL DEFAULT 0,
+        min_amount numeric,
+        max_amount numeric
+    );
+    ALTER TABLE {ROLLUP_TABLE} ADD COLUMN IF NOT EXISTS customer_matched boolean NOT NULL DEFAULT true;
+    ALTER TABLE {ROLLUP_TABLE} ADD COLUMN IF NOT EXISTS amount_count bigint NOT NULL DEFAULT 0;
+    ALTER TABLE {ROLLUP_TABLE} ALTER COLUMN total_amount DROP NOT NULL;
+    DROP INDEX IF EXISTS {ROLLUP_TABLE}_grain_idx;
+    CREATE UNIQUE INDEX IF NOT EXISTS {ROLLUP_TABLE}_grain_v2_idx
+        ON {ROLLUP_TABLE} (sale_date, product_id, (COALESCE(region, '')), customer_matched);
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name text PRIMARY KEY,
+        last_sale_id bigint NOT NULL,
+        mod_count bigint NOT NULL
+    );
+    ALTER TABLE rollup_state ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1;
+"""
+
+_ROLLUP_SELECT = f"""
+    INSERT INTO {ROLLUP_TABLE} (sale_date, product_id, region, customer_matched, total_amount, sale_count,
+                                amount_count, min_amount, max_amount)
+    SELECT s.sale_date::date, s.product_id, c.region, c.customer_id IS NOT NULL,
+           SUM(s.amount), COUNT(*), COUNT(s.amount), MIN(s.amount), MAX(s.amount)
+    FROM sales s
+    LEFT JOIN customers c ON s.customer_id = c.customer_id
+"""
+
+REBUILD_SQL = _ROLLUP_SELECT + """
+    WHERE s.sale_id <= :max_sale_id
+    GROUP BY 1, 2, 3, 4;
+"""
+
+# Groups are recomputed from all of their sales rather than added to, so re-reading
+# the lookback window never double counts. A temp table pins the set of groups
+# between the DELETE and the INSERT.
+REFRESH_WINDOW_SQL = (
+    """
+    CREATE TEMP TABLE rollup_touched ON COMMIT DROP AS
+    SELECT DISTINCT s.sale_date::date AS sale_date, s.product_id, c.region,
+           c.customer_id IS NOT NULL AS customer_matched
+    FROM sales s
+    LEFT JOIN customers c ON s.customer_id = c.customer_id
+    WHERE s.sale_id > :from_sale_id AND s.sale_id <= :max_sale_id;
+    """,
+    f"""
+    DELETE FROM {ROLLUP_TABLE} r USING rollup_touched t
+    WHERE r.sale_date = t.sale_date AND r.product_id = t.product_id
+      AND COALESCE(r.region, '') = COALESCE(t.region, '') AND r.customer_matched = t.customer_matched;
+    """,
+    _ROLLUP_SELECT + """
+    JOIN rollup_touched t
+      ON s.sale_date::date = t.sale_date AND s.product_id = t.product_id
+     AND COALESCE(c.region, '') = COALESCE(t.region, '') AND (c.customer_id IS NOT NULL) = t.customer_matched
+    WHERE s.sale_id <= :max_sale_id
+    GROUP BY 1, 2, 3, 4;
+    """,
+)
+
+def _read_source_version(conn):
+    """Current max(sale_id), the update+delete counter for sales and the data watermark.
+
+    The watermark is built like result_cache.get_data_watermark() so the two can be compared.
+    """
+    row = conn.execute(text("""
+        SELECT (SELECT COALESCE(MAX(sale_id), 0) FROM sales),
+               COALESCE(st.n_tup_upd + st.n_tup_del, 0),
+               COALESCE(st.n_tup_ins + st.n_tup_upd + st.n_tup_del, 0)
+        FROM (SELECT 1) AS one
+        LEFT JOIN pg_stat_user_tables st
+          ON st.schemaname = 'public' AND st.relname = 'sales';
+    """)).fetchone()
+    return int(row[0]), int(row[1]), f"{row[0]}:{row[2]}"
+
+def ensure_rollup():
+    """Create the rollup and its bookkeeping table if they do not exist yet."""
+    with get_db_connection() as conn:
+        conn.execute(text(CREATE_ROLLUP_SQL))
+        conn.commit()
+
+def refresh_rollup(full=False):
+    """Bring the rollup up to date with sales.
+
+    sale_id is assigned before commit, so a lower id can become visible after a
+    higher one was folded in. Each refresh therefore recomputes every group
+    touched by sale_ids above the stored watermark minus ROLLUP_LOOKBACK_IDS, and
+    every ROLLUP_RECONCILE_INTERVAL seconds the rollup's row count is compared
+    with sales to catch anything committed later than that. Updates and deletes
+    cannot be applied incrementally, so when the pg_stat update/delete counter
+    has moved, or the counts disagree, the rollup is rebuilt from scratch.
+    """
+    with _refresh_lock, get_db_connection() as conn:
+        max_sale_id, mod_count, watermark = _read_source_version(conn)
+        row = conn.execute(
+            text("SELECT last_sale_id, mod_count, version FROM rollup_state WHERE name = :name"),
+            {"name": ROLLUP_TABLE},
+        ).fetchone()
+
+        rebuild = row is None or full or int(row[1]) != mod_count or int(row[0]) > max_sale_id \
+            or int(row[2]) != ROLLUP_VERSION
+        reconciled_at = _state["reconciled_at"]
+        if not rebuild:
+            params = {"from_sale_id": max(int(row[0]) - ROLLUP_LOOKBACK_IDS, 0), "max_sale_id": max_sale_id}
+            for statement in REFRESH_WINDOW_SQL:
+                conn.execute(text(statement), params)
+            if reconciled_at is None or time.time() - reconciled_at >= ROLLUP_RECONCILE_INTERVAL:
+                counts = conn.execute(text(f"""
+                    SELECT (SELECT COUNT(*) FROM sales WHERE sale_id <= :max_sale_id),
+                           (SELECT COALESCE(SUM(sale_count), 0) FROM {ROLLUP_TABLE});
+                """), {"max_sale_id": max_sale_id}).fetchone()
+                rebuild = int(counts[0]) != int(counts[1])
+                if rebuild:
+                    logger.warning("Rollup covers %s sales, the table has %s; rebuilding", counts[1], counts[0])
+                reconciled_at = time.time()
+        if rebuild:
+            conn.execute(text(f"TRUNCATE {ROLLUP_TABLE}"))
+            conn.execute(text(REBUILD_SQL), {"max_sale_id": max_sale_id})
+            reconciled_at = time.time()
+        conn.execute(text("""
+            INSERT INTO rollup_state (name, last_sale_id, mod_count, version)
+            VALUES (:name, :last_sale_id, :mod_count, :version)
+            ON CONFLICT (name) DO UPDATE SET last_sale_id = EXCLUDED.last_sale_id, mod_count = EXCLUDED.mod_count,
+                                             version = EXCLUDED.version;
+        """), {"name": ROLLUP_TABLE, "last_sale_id": max_sale_id, "mod_count": mod_count, "version": ROLLUP_VERSION})
+        conn.commit()
+
+    _state["last_sale_id"] = max_sale_id
+    _state["mod_count"] = mod_count
+    _state["watermark"] = watermark
+    _state["reconciled_at"] = reconciled_at
+    _state["requested"] = None
+    logger.info("Rollup refreshed up to sale_id %s", max_sale_id)
+
+def is_rollup_current(watermark):
+    """True if the rollup reflects the data version from result_cache.get_data_watermark().
+
+    The whole watermark is compared: updates and deletes leave max(sale_id) alone.
+    The watermark a refresh was asked for also counts, since the refresh read at
+    least that much data (the caller's watermark may be a few seconds old).
+    """
+    return watermark is not None and watermark in (_state["watermark"], _state["requested"])
+
+
+# --- Query rewriting ---
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_FROM_CLAUSE = re.compile(
+    r"\bFROM\s+sales(?:\s+(?:AS\s+)?(?!JOIN\b|WHERE\b|GROUP\b|ORDER\b|LIMIT\b|INNER\b)(\w+))?"
+    r"((?:\s+(?:INNER\s+)?JOIN\s+(?:products|customers)(?:\s+(?:AS\s+)?(?!ON\b)\w+)?\s+ON\s+[\w.]+\s*=\s*[\w.]+)*)"
+    r"(?=\s+(?:WHERE|GROUP|ORDER|LIMIT|HAVING)\b|\s*;?\s*$)",
+    re.IGNORECASE,
+)
+_JOIN = re.compile(
+    r"JOIN\s+(products|customers)(?:\s+(?:AS\s+)?(?!ON\b)(\w+))?\s+ON\s+([\w.]+)\s*=\s*([\w.]+)",
+    re.IGNORECASE,
+)
+# Bare words that are not column references in the queries the rewrite accepts
+_SQL_WORDS = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "OFFSET", "AS", "AND", "OR", "NOT",
+    "IN", "IS", "NULL", "LIKE", "ILIKE", "BETWEEN", "CASE", "WHEN", "THEN", "ELSE", "END", "ASC", "DESC",
+    "NULLS", "FIRST", "LAST", "TRUE", "FALSE", "DATE", "TIMESTAMP", "INTERVAL", "YEAR", "QUARTER", "MONTH",
+    "WEEK", "DAY", "DOW", "CURRENT_DATE", "CURRENT_TIMESTAMP", "ESCAPE", "JOIN", "INNER", "ON",
+}
+_BARE_WORD = re.compile(r"(?<![\w.:$])(?<!AS )([A-Za-z_]\w*)\b(?!\s*[.(])", re.IGNORECASE)
+_UNSUPPORTED = re.compile(r"\b(?:UNION|INTERSECT|EXCEPT|WITH|OVER|DISTINCT)\b|\(\s*SELECT\b", re.IGNORECASE)
+
+def _sale_date_is_date():
+    try:
+        cols = dict(get_schema_tables().get("sales", []))
+    except Exception:
+        return False
+    return cols.get("sale_date") == "date"
+
+def _unknown_bare_columns(body, allowed):
+    """Unqualified column names in body that the rewritten query cannot resolve."""
+    unknown = set()
+    for word in _BARE_WORD.findall(body):
+        if word.upper() in _SQL_WORDS or word.startswith("__") or word.lower() in allowed:
+            continue
+        unknown.add(word.lower())
+    return unknown
+
+def rewrite_for_rollup(sql):
+    """Rewrite an aggregate over sales (joined to products/customers) onto the rollup.
+
+    Returns the rewritten SQL, or None when the query needs row-level data the
+    rollup does not keep (individual sales, customers other than region, etc.).
+    """
+    # Canonical form: one spacing, upper-case keywords and table aliases resolved,
+    # so differently formatted or aliased queries match the same patterns
+    normalized = canonical_sql(sql)
+    if not re.match(r"SELECT\b", normalized, re.IGNORECASE) or _UNSUPPORTED.search(normalized):
+        return None
+    if not re.search(r"\bGROUP BY\b|\b(?:SUM|AVG|MIN|MAX|COUNT)\s*\(", normalized, re.IGNORECASE):
+        return None
+
+    # Mask string literals so identifiers inside them are never rewritten
+    literals = []
+    def mask(match):
+        literals.append(match.group(0))
+        return f"__lit{len(literals) - 1}__"
+    masked = _STRING_LITERAL.sub(mask, normalized)
+
+    from_match = _FROM_CLAUSE.search(masked)
+    # EXTRACT(... FROM col) also contains FROM; only one real FROM clause is allowed
+    without_extract = re.sub(r"\bEXTRACT\s*\(\s*\w+\s+FROM\b", "", masked, flags=re.IGNORECASE)
+    if from_match is None or len(re.findall(r"\bFROM\b", without_extract, re.IGNORECASE)) != 1:
+        return None
+    s_alias = from_match.group(1) or "sales"
+    aliases = {"products": None, "customers": None}
+    for table, alias, left, right in _JOIN.findall(from_match.group(2) or ""):
+        table = table.lower()
+        alias = alias or table
+        key = "product_id" if table == "products" else "customer_id"
+        if {left.lower(), right.lower()} != {f"{s_alias}.{key}".lower(), f"{alias}.{key}".lower()}:
+            return None
+        aliases[table] = alias
+    p_alias, c_alias = aliases["products"], aliases["customers"]
+
+    head = masked[:from_match.start()].rstrip()
+    tail = masked[from_match.end():]
+
+    s = re.escape(s_alias)
+    amount = rf"(?:\b{s}\.)?\bamount\b"
+    aggregates = [
+        (rf"\bSUM\s*\(\s*{amount}\s*\)", "SUM(r.total_amount)", "sum"),
+        (rf"\bAVG\s*\(\s*{amount}\s*\)", "(SUM(r.total_amount) / NULLIF(SUM(r.amount_count), 0))", "avg"),
+        (rf"\bMIN\s*\(\s*{amount}\s*\)", "MIN(r.min_amount)", "min"),
+        (rf"\bMAX\s*\(\s*{amount}\s*\)", "MAX(r.max_amount)", "max"),
+        (r"\bCOUNT\s*\(\s*\*\s*\)", "SUM(r.sale_count)", "count"),
+    ]
+    for pattern, replacement, default_name in aggregates:
+        # In the select list keep Postgres' default output name for unaliased aggregates
+        def keep_name(match, replacement=replacement, default_name=default_name):
+            following = head[match.end():]
+            if re.match(r"\s*(?:,|$)", following):
+                return f"{replacement} AS {default_name}"
+            return replacement
+        head = re.sub(pattern, keep_name, head, flags=re.IGNORECASE)
+        tail = re.sub(pattern, replacement, tail, flags=re.IGNORECASE)
+    body = head + " __FROM__ " + tail
+
+    if re.search(amount, body, re.IGNORECASE):
+        return None
+    if not _sale_date_is_date() and re.search(rf"(?:\b{s}\.)?\bsale_date\b", body, re.IGNORECASE):
+        return None
+    body = re.sub(rf"(?:\b{s}\.)?\bsale_date\b", "r.sale_date", body, flags=re.IGNORECASE)
+    body = re.sub(rf"\b{s}\.product_id\b", "r.product_id", body, flags=re.IGNORECASE)
+    if c_alias:
+        body = re.sub(rf"\b{re.escape(c_alias)}\.region\b", "r.region", body, flags=re.IGNORECASE)
+        if re.search(rf"\b{re.escape(c_alias)}\.", body, re.IGNORECASE):
+            return None
+    # Anything still pointing at the fact table (or a bare customer column) needs raw rows
+    if re.search(rf"\b{s}\.\w+", body, re.IGNORECASE) or \
+            re.search(r"(?<![\w.])(?:sale_id|customer_id|customer_name)\b", body, re.IGNORECASE):
+        return None
+    body = re.sub(r"(?<![\w.])(?<!AS )region\b", "r.region", body, flags=re.IGNORECASE)
+    # Any other bare column must be one the rollup or the joined products table has;
+    # output names defined with AS may be referenced again in GROUP BY / ORDER BY
+    allowed = {name.lower() for name in re.findall(r"\bAS\s+(\w+)", body, re.IGNORECASE)}
+    if p_alias:
+        try:
+            tables = get_schema_tables()
+        except Exception:
+            return None
+        sales_columns = {col for col, _ in tables.get("sales", [])}
+        allowed |= {col for col, _ in tables.get("products", [])} - sales_columns
+    else:
+        allowed.add("product_id")
+    if _unknown_bare_columns(body, allowed):
+        return None
+
+    from_sql = f"FROM {ROLLUP_TABLE} r"
+    if c_alias:
+        # The INNER JOIN customers drops sales without a customer row; so does this filter
+        from_sql = f"FROM (SELECT * FROM {ROLLUP_TABLE} WHERE customer_matched) r"
+    if p_alias:
+        from_sql += f" JOIN products {p_alias} ON r.product_id = {p_alias}.product_id"
+    rewritten = re.sub(r"\s+", " ", body.replace("__FROM__", from_sql)).strip()
+    return re.sub(r"__lit(\d+)__", lambda m: literals[int(m.group(1))], rewritten)
+
+def ensure_rollup_fresh(watermark):
+    """Create/refresh the rollup when enabled and behind the given data watermark."""
+    if not ROLLUP_ENABLED or is_rollup_current(watermark):
+        return
+    with _refresh_lock:
+        # Every question on stale data asks for a refresh; one at a time is enough
+        if _state["refreshing"]:
+            return
+        _state["refreshing"] = True
+    try:
+        if _state["last_sale_id"] is None:
+            ensure_rollup()
+        refresh_rollup()
+        _state["requested"] = watermark
+    finally:
+        _state["refreshing"] = False
+
+def route_query(sql, watermark):
+    """Return (sql_to_run, used_rollup) for a generated query."""
+    if not ROLLUP_ENABLED or not is_rollup_current(watermark):
+        return sql, False
+    rewritten = rewrite_for_rollup(sql)
+    if rewritten is None:
+        return sql, False
+    return rewritten, True
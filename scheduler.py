@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from settings import get_setting
+
+
+BACKEND_LIMITS = {
+    "llm": int(get_setting("LLM_MAX_CONCURRENCY", "4")),
+    "db": int(get_setting("DB_MAX_CONCURRENCY", get_setting("DB_POOL_SIZE", "5"))),
+}
+RATE_LIMIT_RETRIES = int(get_setting("RATE_LIMIT_RETRIES", "4"))
+RATE_LIMIT_BASE_DELAY = float(get_setting("RATE_LIMIT_BASE_DELAY", "1.0"))
+RATE_LIMIT_MAX_DELAY = float(get_setting("RATE_LIMIT_MAX_DELAY", "30.0"))
+# Only the LLM API answers 429; database errors are never retried or paused on
+RATE_LIMITED_BACKENDS = {"llm"}
+
+
+class RateLimited(Exception):
+    """The backend kept answering 429 after all retries."""
+
+
+def is_rate_limit_error(error):
+    """True for HTTP 429 / quota errors from the Gemini client.
+
+    Decided by exception type or HTTP status attribute, never by the message, which
+    may echo literals or ids that happen to contain 429.
+    """
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    response = getattr(error, "response", None)
+    for status in (getattr(error, "code", None), getattr(error, "status_code", None),
+                   getattr(response, "status_code", None)):
+        # google.api_core errors carry the HTTP status as an int (or IntEnum) in .code
+        if isinstance(status, int) and not isinstance(status, bool) and status == 429:
+            return True
+    return False
+
+
+class BackendQueue:
+    """Bounded concurrency for one backend with round-robin fairness across users.
+
+    Each user has their own FIFO of waiting requests; when a slot frees up the
+    next user in rotation is served, so one analyst firing many questions cannot
+    starve the others.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = max(limit, 1)
+        self.running = 0
+        self.paused_until = 0.0
+        self.waits = deque(maxlen=200)
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _grant_next(self):
+        """Hand free slots to waiting users in rotation. Caller holds the lock."""
+        while self.running < self.limit and self._queues:
+            user, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            # Move the user to the back of the rotation (or drop them if nothing is left)
+            del self._queues[user]
+            if queue:
+                self._queues[user] = queue
+            ticket["granted"] = True
+            self.running += 1
+        self._cond.notify_all()
+
+    def acquire(self, user):
+        ticket = {"granted": False}
+        started = time.perf_counter()
+        with self._cond:
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._grant_next()
+            while not ticket["granted"]:
+                self._cond.wait()
+        waited = time.perf_counter() - started
+        self.waits.append(waited)
+        # Honour a backoff pause triggered by another request's 429
+        pause = self.paused_until - time.time()
+        if pause > 0:
+            time.sleep(pause)
+        return waited
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._grant_next()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def stats(self):
+        with self._cond:
+            depth = sum(len(q) for q in self._queues.values())
+            waiting_users = len(self._queues)
+        waits = list(self.waits)
+        return {
+            "running": self.running,
+            "limit": self.limit,
+            "queue_depth": depth,
+            "waiting_users": waiting_users,
+            "avg_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait_seconds": max(waits) if waits else 0.0,
+            "paused_seconds": max(self.paused_until - time.time(), 0.0),
+        }
+
+
+class Scheduler:
+    """Process-wide admission control around LLM calls and query execution."""
+
+    def __init__(self, limits):
+        self.backends = {name: BackendQueue(name, limit) for name, limit in limits.items()}
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _call_with_backoff(self, backend, fn, args):
+        delay = RATE_LIMIT_BASE_DELAY
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise RateLimited(f"{backend.name} is rate limited, please retry shortly") from e
+                # Exponential backoff with jitter; every queued request for this backend waits too
+                sleep_for = min(delay, RATE_LIMIT_MAX_DELAY) * (0.5 + random.random())
+                backend.pause(sleep_for)
+                time.sleep(sleep_for)
+                delay *= 2
+
+    def run(self, backend_name, user, key, fn, *args, on_wait=None):
+        """Run fn(*args) under the backend's limits.
+
+        Requests with the same key that are already in flight are coalesced: only
+        the first one runs, the others wait for and share its result. on_wait is
+        called with the seconds spent queued for a slot.
+        """
+        with self._lock:
+            future = self._in_flight.get(key) if key is not None else None
+            leader = future is None
+            if leader:
+                future = Future()
+                if key is not None:
+                    self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            started = time.perf_counter()
+            try:
+                return future.result()
+            finally:
+                if on_wait is not None:
+                    on_wait(time.perf_counter() - started)
+
+        backend = self.backends[backend_name]
+        try:
+            waited = backend.acquire(user)
+            if on_wait is not None:
+                on_wait(waited)
+            try:
+                if backend_name in RATE_LIMITED_BACKENDS:
+                    result = self._call_with_backoff(backend, fn, args)
+                else:
+                    result = fn(*args)
+            finally:
+                backend.release()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if key is not None:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+    def stats(self):
+        stats = {name: backend.stats() for name, backend in self.backends.items()}
+        stats["coalesced"] = self.coalesced
+        return stats
+
+
+scheduler = Scheduler(BACKEND_LIMITS)
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+import time
+from postgresql_database import fetch_schema_tables, fetch_schema_fingerprint, fetch_schema_metadata
+from schema_format import format_schema
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+# How long a loaded schema is trusted before it is re-introspected regardless of fingerprint
+SCHEMA_CACHE_TTL = int(get_setting("SCHEMA_CACHE_TTL", "3600"))
+# How often the cheap pg_class fingerprint is re-checked while the cache is fresh
+SCHEMA_FINGERPRINT_INTERVAL = int(get_setting("SCHEMA_FINGERPRINT_INTERVAL", "60"))
+SCHEMA_CACHE_PATH = get_setting("SCHEMA_CACHE_PATH", os.path.join(".cache", "schema_catalog.json"))
+SCHEMA_SAMPLE_VALUES = get_setting("SCHEMA_SAMPLE_VALUES", "true").lower() in ("1", "true", "yes")
+
+EMPTY_METADATA = {"foreign_keys": [], "comments": {}, "samples": {}}
+
+_lock = threading.Lock()
+_catalog = {
+    "tables": None,
+    "metadata": EMPTY_METADATA,
+    "text": None,
+    "fingerprint": None,
+    "loaded_at": 0.0,
+    "checked_at": 0.0,
+}
+
+def _load_from_disk():
+    """Read the persisted catalog, or None if missing/corrupt."""
+    try:
+        with open(SCHEMA_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data["tables"] = {t: [tuple(c) for c in cols] for t, cols in data["tables"].items()}
+        return data
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_to_disk():
+    try:
+        os.makedirs(os.path.dirname(SCHEMA_CACHE_PATH) or ".", exist_ok=True)
+        tmp_path = SCHEMA_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "tables": _catalog["tables"],
+                "metadata": _catalog["metadata"],
+                "fingerprint": _catalog["fingerprint"],
+                "loaded_at": _catalog["loaded_at"],
+            }, f)
+        os.replace(tmp_path, SCHEMA_CACHE_PATH)
+    except OSError as e:
+        logger.warning("Could not persist schema cache: %s", e)
+
+def _install(tables, metadata, fingerprint, loaded_at):
+    now = time.time()
+    _catalog["tables"] = tables
+    _catalog["metadata"] = metadata
+    _catalog["text"] = format_schema(tables)
+    _catalog["fingerprint"] = fingerprint
+    _catalog["loaded_at"] = loaded_at
+    _catalog["checked_at"] = now
+
+def _reload(fingerprint=None):
+    if fingerprint is None:
+        fingerprint = fetch_schema_fingerprint()
+    tables = fetch_schema_tables()
+    try:
+        metadata = fetch_schema_metadata(tables, sample_values=SCHEMA_SAMPLE_VALUES)
+    except Exception as e:
+        logger.warning("Could not load schema metadata: %s", e)
+        metadata = EMPTY_METADATA
+    _install(tables, metadata, fingerprint, time.time())
+    _save_to_disk()
+    logger.info("Schema catalog loaded (%d tables)", len(tables))
+
+def _ensure_fresh(force_refresh=False):
+    """Make sure the in-memory catalog is loaded and valid. Caller holds the lock."""
+    now = time.time()
+    if force_refresh:
+        _reload()
+        return
+
+    if _catalog["tables"] is None:
+        fingerprint = fetch_schema_fingerprint()
+        cached = _load_from_disk()
+        if (cached and cached.get("fingerprint") == fingerprint
+                and now - cached.get("loaded_at", 0) < SCHEMA_CACHE_TTL):
+            _install(cached["tables"], cached.get("metadata", EMPTY_METADATA), fingerprint, cached["loaded_at"])
+            return
+        _reload(fingerprint)
+        return
+
+    if now - _catalog["loaded_at"] >= SCHEMA_CACHE_TTL:
+        _reload()
+        return
+
+    if now - _catalog["checked_at"] >= SCHEMA_FINGERPRINT_INTERVAL:
+        fingerprint = fetch_schema_fingerprint()
+        if fingerprint != _catalog["fingerprint"]:
+            _reload(fingerprint)
+        else:
+            _catalog["checked_at"] = now
+
+def get_schema_tables(force_refresh=False):
+    """Return the cached {table: [(column, data_type), ...]} mapping."""
+    with _lock:
+        _ensure_fresh(force_refresh)
+        return _catalog["tables"]
+
+def get_schema_metadata(force_refresh=False):
+    """Return the cached foreign keys, comments and sample values."""
+    with _lock:
+        _ensure_fresh(force_refresh)
+        return _catalog["metadata"]
+
+def get_schema_text(force_refresh=False):
+    """Cached replacement for get_db_schema(); same text format and error convention."""
+    try:
+        with _lock:
+            _ensure_fresh(force_refresh)
+            return _catalog["text"]
+    except Exception as e:
+        return f"⚠️ Error fetching schema: {e}"
+
+def get_schema_fingerprint():
+    """Fingerprint of the currently cached schema (None until first load)."""
+    return _catalog["fingerprint"]
+
+def refresh_schema():
+    """Drop the cached catalog and re-introspect the database."""
+    return get_schema_text(force_refresh=True)
+
+def get_catalog_info():
+    """Summary of the cache state for display in the UI."""
+    loaded_at = _catalog["loaded_at"]
+    return {
+        "tables": len(_catalog["tables"] or {}),
+        "fingerprint": _catalog["fingerprint"],
+        "age_seconds": time.time() - loaded_at if loaded_at else None,
+    }
@@ -0,0 +1,9 @@
+def format_schema(tables):
+    """Render the schema dict as the flat text injected into LLM prompts.
+
+    Kept free of database drivers so every backend can use it.
+    """
+    schema_text = ""
+    for table, cols in tables.items():
+        schema_text += f"TABLE: {table} ({', '.join(f'{col} {dtype}' for col, dtype in cols)})\n"
+    return schema_text.strip()
@@ -0,0 +1,172 @@
+import re
+import threading
+from collections import deque
+from schema_catalog import get_schema_tables, get_schema_metadata, get_schema_fingerprint
+from settings import get_setting
+
+SCHEMA_TOP_K = int(get_setting("SCHEMA_TOP_K", "4"))
+SCHEMA_TOKEN_BUDGET = int(get_setting("SCHEMA_TOKEN_BUDGET", "1500"))
+
+# Weight of a question token matching each kind of schema text
+WEIGHTS = {"table": 3.0, "column": 2.0, "sample": 2.0, "comment": 1.0}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_index_lock = threading.Lock()
+_index = {"fingerprint": None, "postings": None, "graph": None}
+
+def estimate_tokens(text):
+    """Rough token count (≈4 characters per token) used for budgeting."""
+    return (len(text) + 3) // 4
+
+def _stem(token):
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def _tokens(text):
+    return {_stem(t) for t in _TOKEN.findall(str(text).lower())}
+
+def _build_index(tables, metadata):
+    """Inverted index token → {table: score} plus the undirected FK graph."""
+    postings = {}
+
+    def add(text, table, kind):
+        for token in _tokens(text.replace("_", " ")):
+            scores = postings.setdefault(token, {})
+            scores[table] = max(scores.get(table, 0.0), WEIGHTS[kind])
+
+    for table, cols in tables.items():
+        add(table, table, "table")
+        for col, _ in cols:
+            add(col, table, "column")
+        for col, comment in metadata["comments"].get(table, {}).items():
+            add(comment, table, "comment")
+        for col, values in metadata["samples"].get(table, {}).items():
+            for value in values:
+                add(value, table, "sample")
+
+    graph = {table: {} for table in tables}
+    for table, col, ref_table, ref_col in metadata["foreign_keys"]:
+        if table in graph and ref_table in graph:
+            graph[table][ref_table] = (col, ref_col)
+            graph[ref_table][table] = (ref_col, col)
+    return postings, graph
+
+def _get_index():
+    fingerprint = get_schema_fingerprint()
+    with _index_lock:
+        if _index["postings"] is None or _index["fingerprint"] != fingerprint:
+            _index["postings"], _index["graph"] = _build_index(get_schema_tables(), get_schema_metadata())
+            _index["fingerprint"] = fingerprint
+        return _index["postings"], _index["graph"]
+
+def _join_path(graph, start, goal):
+    """Shortest FK path between two tables (list of tables), or None."""
+    previous = {start: None}
+    queue = deque([start])
+    while queue:
+        table = queue.popleft()
+        if table == goal:
+            path = []
+            while table is not None:
+                path.append(table)
+                table = previous[table]
+            return path[::-1]
+        for neighbour in graph.get(table, {}):
+            if neighbour not in previous:
+                previous[neighbour] = table
+                queue.append(neighbour)
+    return None
+
+def rank_tables(question):
+    """Score every table for the question; highest first."""
+    postings, graph = _get_index()
+    scores = {}
+    for token in _tokens(question):
+        for table, weight in postings.get(token, {}).items():
+            scores[table] = scores.get(table, 0.0) + weight
+    if not scores:
+        # Nothing matched: fall back to the best-connected tables (usually the fact table)
+        return sorted(graph, key=lambda t: (-len(graph[t]), t))
+    return sorted(scores, key=lambda t: (-scores[t], t))
+
+def select_tables(question, top_k=SCHEMA_TOP_K):
+    """Top-k tables for the question plus the tables on the FK paths that join them."""
+    _, graph = _get_index()
+    ranked = rank_tables(question)[:top_k]
+    selected = list(ranked)
+    for other in ranked[1:]:
+        path = _join_path(graph, ranked[0], other)
+        for table in path or []:
+            if table not in selected:
+                selected.append(table)
+    return selected
+
+def _render(tables, metadata, selected, graph):
+    lines = []
+    for table in selected:
+        samples = metadata["samples"].get(table, {})
+        cols = []
+        for col, dtype in tables[table]:
+            values = samples.get(col)
+            cols.append(f"{col} {dtype}" + (f" [e.g. {', '.join(values[:5])}]" if values else ""))
+        lines.append(f"TABLE: {table} ({', '.join(cols)})")
+    chosen = set(selected)
+    for table, col, ref_table, ref_col in metadata["foreign_keys"]:
+        if table in chosen and ref_table in chosen:
+            lines.append(f"FK: {table}.{col} -> {ref_table}.{ref_col}")
+    return "\n".join(lines)
+
+def _components(graph, tables):
+    """Number of connected components of the FK graph restricted to tables."""
+    remaining, count = set(tables), 0
+    while remaining:
+        count += 1
+        queue = deque([remaining.pop()])
+        while queue:
+            for neighbour in graph.get(queue.popleft(), {}):
+                if neighbour in remaining:
+                    remaining.discard(neighbour)
+                    queue.append(neighbour)
+    return count
+
+def _drop_one(graph, selected):
+    """selected minus its lowest-ranked table that no other kept table joins through.
+
+    Join-path (bridge) tables rank last but are only dropped once nothing they
+    connect is left; the best match (first) is never dropped.
+    """
+    components = _components(graph, selected)
+    for i in range(len(selected) - 1, 0, -1):
+        rest = selected[:i] + selected[i + 1:]
+        if _components(graph, rest) <= components:
+            return rest
+    return selected[:-1]
+
+def get_pruned_schema(question, top_k=SCHEMA_TOP_K, token_budget=SCHEMA_TOKEN_BUDGET):
+    """(schema text, stats) for the tables relevant to the question, within token_budget.
+
+    stats has tables_total, tables_selected and schema_tokens for the prompt span.
+    """
+    tables = get_schema_tables()
+    metadata = get_schema_metadata()
+    _, graph = _get_index()
+    selected = select_tables(question, top_k)
+
+    schema_text = _render(tables, metadata, selected, graph)
+    # Drop the lowest-ranked leaf tables until the text fits, keeping the bridges
+    # that join what is left (always keep the best match)
+    while len(selected) > 1 and estimate_tokens(schema_text) > token_budget:
+        selected = _drop_one(graph, selected)
+        schema_text = _render(tables, metadata, selected, graph)
+    if estimate_tokens(schema_text) > token_budget:
+        schema_text = schema_text[:token_budget * 4]
+
+    stats = {
+        "tables_total": len(tables),
+        "tables_selected": len(selected),
+        "schema_tokens": estimate_tokens(schema_text),
+    }
+    return schema_text, stats
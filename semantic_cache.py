@@ -0,0 +1,195 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from intent_matcher import MONTHS
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_DIM = int(get_setting("SEMANTIC_CACHE_DIM", "1024"))
+# Calibrated on paraphrase pairs vs. same-entity questions that need different SQL
+# (tests/test_semantic_cache.py): paraphrases score >= 0.82, non-paraphrases <= 0.70
+SEMANTIC_CACHE_THRESHOLD = float(get_setting("SEMANTIC_CACHE_THRESHOLD", "0.78"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(get_setting("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_PATH = get_setting("SEMANTIC_CACHE_PATH", os.path.join(".cache", "semantic_cache.npz"))
+SEMANTIC_CACHE_SAVE_INTERVAL = float(get_setting("SEMANTIC_CACHE_SAVE_INTERVAL", "30"))
+
+# Bumped when embed() changes; persisted vectors of another version are recomputed
+EMBEDDING_VERSION = 2
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Apostrophes inside a word ("what's", "customer's") are not quotes
+_CONTRACTION = re.compile(r"(?<=[A-Za-z])'(?=[A-Za-z])")
+# Question scaffolding that paraphrases swap freely ("What/Which", "Show me/List",
+# "per/for each"); left out of the embedding so the content words decide the score
+_STOP_WORDS = {
+    "a", "an", "the", "what", "whats", "which", "who", "is", "are", "was", "were", "be", "been", "there",
+    "me", "us", "i", "we", "our", "my", "show", "give", "list", "tell", "get", "find", "display", "please",
+    "can", "you", "do", "does", "did", "of", "for", "per", "each", "every", "by", "in", "on", "at", "to",
+    "all", "made", "have", "has", "had",
+}
+# Tokens that change the answer even when the rest of the question is a paraphrase
+_ENTITY_WORDS = set(MONTHS) | {
+    "north", "south", "east", "west",
+    "average", "avg", "mean", "total", "sum", "count", "number",
+    "lowest", "highest", "top", "bottom", "most", "least", "fewest", "best", "worst",
+    "max", "maximum", "min", "minimum", "first", "last",
+    "asc", "ascending", "desc", "descending", "increasing", "decreasing",
+}
+_QUOTED = re.compile(r"'([^']+)'|\"([^\"]+)\"")
+# Capitalised words name products, customers and places ("Widget A"); the first word is skipped
+_NAME = re.compile(r"(?<!^)(?<![.?!]\s)\b[A-Z][A-Za-z0-9_-]*")
+
+
+def _hash(feature):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % SEMANTIC_CACHE_DIM, 1.0 if (h >> 31) & 1 else -1.0
+
+def embed(question):
+    """Hashing-vectorizer embedding of the content words: uni/bigrams plus character trigrams, L2-normalized."""
+    q = _CONTRACTION.sub("", question.lower())
+    words = [word for word in _TOKEN.findall(q) if word not in _STOP_WORDS]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    vec = np.zeros(SEMANTIC_CACHE_DIM, dtype=np.float32)
+    for feature in features:
+        index, sign = _hash(feature)
+        vec[index] += sign
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def _entities(question):
+    """Values a cached answer must share with the question: numbers, names, directions."""
+    question = _CONTRACTION.sub("", question)
+    entities = {f"'{a or b}'".lower() for a, b in _QUOTED.findall(question)}
+    unquoted = _QUOTED.sub(" ", question.strip())
+    entities.update(name.lower() for name in _NAME.findall(unquoted) if name != "I")
+    for word in _TOKEN.findall(unquoted.lower()):
+        # Digits, and codes such as "x100" or single letters ("Widget B") as a whole
+        if word in _ENTITY_WORDS or any(c.isdigit() for c in word) \
+                or (len(word) == 1 and word not in ("a", "i")):
+            entities.add(word)
+    return sorted(entities)
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of question embeddings → SQL for one schema version.
+
+    Vectors live in a preallocated float32 matrix; lookup is one matrix-vector
+    product. Entries whose numbers/regions/months differ from the question are
+    never returned, since those paraphrases need different SQL; likewise for quoted
+    or capitalised names, product codes and ranking/sort words.
+    """
+
+    def __init__(self, path=SEMANTIC_CACHE_PATH, capacity=SEMANTIC_CACHE_MAX_ENTRIES, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self.vectors = np.zeros((capacity, SEMANTIC_CACHE_DIM), dtype=np.float32)
+        self.entries = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_save = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def lookup(self, question, schema_version):
+        """Return cached SQL for a close enough paraphrase, or None."""
+        vec = embed(question)
+        entities = _entities(question)
+        with self._lock:
+            if self.entries:
+                scores = self.vectors[:len(self.entries)] @ vec
+                for index in np.argsort(scores)[::-1][:5]:
+                    if scores[index] < self.threshold:
+                        break
+                    entry = self.entries[index]
+                    if entry["schema_version"] == schema_version and entry["entities"] == entities:
+                        entry["hits"] += 1
+                        entry["last_used"] = time.time()
+                        self.hits += 1
+                        return entry["sql"]
+            self.misses += 1
+            return None
+
+    def put(self, question, sql, schema_version):
+        vec = embed(question)
+        with self._lock:
+            if len(self.entries) >= self.capacity:
+                # Evict the least recently used entry and reuse its slot
+                index = min(range(len(self.entries)), key=lambda i: self.entries[i]["last_used"])
+                self.evictions += 1
+            else:
+                index = len(self.entries)
+                self.entries.append(None)
+            self.vectors[index] = vec
+            self.entries[index] = {
+                "question": question,
+                "sql": sql,
+                "schema_version": schema_version,
+                "entities": _entities(question),
+                "hits": 0,
+                "last_used": time.time(),
+            }
+            self._dirty = True
+            if time.time() - self._last_save >= SEMANTIC_CACHE_SAVE_INTERVAL:
+                self._save_locked()
+
+    def _save_locked(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp.npz"
+            np.savez(tmp_path, vectors=self.vectors[:len(self.entries)],
+                     entries=np.array(json.dumps(self.entries)), version=np.array(EMBEDDING_VERSION))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = time.time()
+        except OSError as e:
+            logger.warning("Could not persist semantic cache: %s", e)
+
+    def save(self):
+        with self._lock:
+            if self._dirty:
+                self._save_locked()
+
+    def load(self):
+        try:
+            data = np.load(self.path)
+            entries = json.loads(str(data["entries"]))
+            vectors = data["vectors"]
+            version = int(data["version"]) if "version" in data.files else 1
+        except (OSError, ValueError, KeyError):
+            return
+        count = min(len(entries), self.capacity)
+        if version != EMBEDDING_VERSION or vectors.shape[1:] != (SEMANTIC_CACHE_DIM,):
+            vectors = np.array([embed(entry["question"]) for entry in entries[:count]],
+                               dtype=np.float32).reshape(count, SEMANTIC_CACHE_DIM)
+        for entry in entries:
+            # Recomputed so entries saved before the entity rules changed are guarded too
+            entry["entities"] = _entities(entry["question"])
+        with self._lock:
+            self.vectors[:count] = vectors[:count]
+            self.entries = entries[:count]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+semantic_cache = SemanticCache()
+atexit.register(semantic_cache.save)
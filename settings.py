@@ -0,0 +1,17 @@
+import os
+from dotenv import load_dotenv
+
+# The one place .env is read; app modules read configuration through get_setting
+# (the benchmark and load-test CLIs only set environment variables before importing them)
+load_dotenv()
+
+def get_setting(name, default=None):
+    """Read a setting from the environment, falling back to Streamlit secrets."""
+    value = os.getenv(name)
+    if value is None:
+        try:
+            import streamlit as st
+            value = st.secrets.get(name)
+        except Exception:
+            pass
+    return default if value is None else value
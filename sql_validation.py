@@ -0,0 +1,517 @@
+import difflib
+import hashlib
+import re
+from functools import lru_cache
+from settings import get_setting
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    sqlglot_available = True
+except ImportError:
+    sqlglot = None
+    exp = None
+    sqlglot_available = False
+
+# "auto" parses with sqlglot when installed, "sqlglot" requires it, "local" always uses the built-in tokenizer
+SQL_PARSER = get_setting("SQL_PARSER", "auto").lower()
+# Unknown tables/columns at least this similar to a real one are renamed instead of rejected
+SQL_REPAIR_CUTOFF = float(get_setting("SQL_REPAIR_CUTOFF", "0.88"))
+
+# Statements that must never reach the warehouse, whatever the parser says
+_FORBIDDEN_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "MERGE", "UPSERT", "DROP", "ALTER", "CREATE", "TRUNCATE", "GRANT",
+    "REVOKE", "COPY", "VACUUM", "CALL", "DO", "EXECUTE", "EXEC", "LOCK", "INTO", "REINDEX", "CLUSTER",
+}
+_FORBIDDEN_FUNCTIONS = {
+    "pg_sleep", "pg_terminate_backend", "pg_cancel_backend", "pg_read_file", "pg_read_binary_file",
+    "pg_ls_dir", "pg_reload_conf", "lo_import", "lo_export", "dblink", "dblink_exec", "set_config",
+    "dbms_lock", "dbms_pipe", "utl_http", "utl_file",
+}
+# Bare names that are not columns
+_PSEUDO_COLUMNS = {
+    "current_date", "current_timestamp", "current_time", "localtimestamp", "localtime", "sysdate",
+    "systimestamp", "rownum", "rowid", "level", "user", "true", "false", "null",
+}
+_BUILTIN_TABLES = {"dual"}
+
+_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "OFFSET", "JOIN", "INNER", "LEFT",
+    "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL", "ON", "USING", "AS", "AND", "OR", "NOT", "IN", "IS", "NULL",
+    "LIKE", "ILIKE", "BETWEEN", "CASE", "WHEN", "THEN", "ELSE", "END", "DISTINCT", "UNION", "ALL", "INTERSECT",
+    "EXCEPT", "MINUS", "WITH", "ASC", "DESC", "NULLS", "FIRST", "LAST", "FETCH", "NEXT", "ROWS", "ROW", "ONLY",
+    "INTERVAL", "TRUE", "FALSE", "ESCAPE", "OVER", "PARTITION", "EXISTS", "ANY", "SOME", "LATERAL", "FILTER",
+    "WITHIN", "CURRENT_DATE", "CURRENT_TIMESTAMP", "SYSDATE", "DATE", "TIMESTAMP", "YEAR", "MONTH", "DAY",
+    "QUARTER", "WEEK", "HOUR", "MINUTE", "SECOND", "RECURSIVE",
+} | _FORBIDDEN_KEYWORDS
+# Keywords that end a FROM clause
+_FROM_END = {"WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "FETCH", "UNION", "INTERSECT", "EXCEPT",
+             "MINUS", "WINDOW", "ON", "USING"}
+
+_TOKEN = re.compile(r"""
+    (?P<string>'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$#]*)
+  | (?P<op>::|<=|>=|<>|!=|=>|\|\||[-+*/%=<>(),.;\[\]:^~!@&|?$])
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+_FENCE = re.compile(r"^\s*```\w*\s*|\s*```\s*$")
+
+
+class SQLValidationError(ValueError):
+    """Generated SQL that is not a valid read-only query against the known schema."""
+
+    def __init__(self, problems, sql=None):
+        self.problems = list(problems)
+        self.sql = sql
+        super().__init__("Invalid SQL: " + "; ".join(self.problems))
+
+
+class CheckedSQL(str):
+    """SQL that already went through repair_sql; the pipeline does not validate it again."""
+
+
+class ValidatedSQL:
+    """A checked statement: the SQL to run, its canonical form and what was fixed on the way."""
+
+    def __init__(self, sql, canonical, tables, parser, repairs=()):
+        self.sql = sql
+        self.canonical = canonical
+        self.tables = tables
+        self.parser = parser
+        self.repairs = list(repairs)
+
+    @property
+    def fingerprint(self):
+        return hashlib.sha256(self.canonical.encode("utf-8")).hexdigest()
+
+
+def _use_sqlglot():
+    if SQL_PARSER == "local":
+        return False
+    if SQL_PARSER == "sqlglot" and not sqlglot_available:
+        raise ImportError("SQL_PARSER=sqlglot needs the sqlglot package")
+    return sqlglot_available
+
+
+# --- Local tokenizer ---
+
+def _tokenize(sql):
+    """[(kind, text)] without whitespace and comments."""
+    return [(m.lastgroup, m.group()) for m in _TOKEN.finditer(sql) if m.lastgroup not in ("space", "comment")]
+
+def _split_statements(tokens):
+    statements, current = [], []
+    for kind, text in tokens:
+        if kind == "op" and text == ";":
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append((kind, text))
+    if current:
+        statements.append(current)
+    return statements
+
+# FROM inside these calls is an argument separator, not a FROM clause
+_FROM_FUNCTIONS = {"EXTRACT", "SUBSTRING", "TRIM", "OVERLAY", "POSITION"}
+
+def _table_refs(tokens):
+    """(alias → table, [table, ...], derived names) for the FROM/JOIN clauses.
+
+    Derived names are CTE names and aliases of subqueries in FROM, whose columns
+    are unknown here; they are not reported as tables.
+    """
+    aliases, tables, derived = {}, [], set()
+    in_from = False
+    from_depth = None
+    # Function (or None) that opened each enclosing parenthesis
+    stack = []
+    # Depths at which a subquery in FROM was opened; its alias follows the ")"
+    subqueries = []
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        upper = text.upper()
+        if text == "(":
+            previous = tokens[i - 1] if i else None
+            stack.append(previous[1].upper() if previous and previous[0] == "word" else None)
+        elif text == ")":
+            if stack:
+                stack.pop()
+            if subqueries and len(stack) == subqueries[-1]:
+                subqueries.pop()
+                j = i + 1
+                if j < len(tokens) and tokens[j][1].upper() == "AS":
+                    j += 1
+                if j < len(tokens) and tokens[j][0] in ("word", "quoted") and tokens[j][1].upper() not in _KEYWORDS:
+                    derived.add(_identifier(tokens[j]))
+                    i = j
+            if from_depth is not None and len(stack) < from_depth:
+                in_from, from_depth = False, None
+        elif kind in ("word", "quoted") and upper not in _KEYWORDS and _is_cte_name(tokens, i):
+            derived.add(_identifier(tokens[i]))
+        elif kind == "word" and upper in ("FROM", "JOIN") and not (stack and stack[-1] in _FROM_FUNCTIONS):
+            in_from, from_depth = True, len(stack)
+            i = _read_source(tokens, i + 1, aliases, tables, subqueries, len(stack))
+            continue
+        elif kind == "word" and upper in _FROM_END and len(stack) == from_depth:
+            in_from = upper in ("ON", "USING") and in_from
+            if upper not in ("ON", "USING"):
+                from_depth = None
+        elif text == "," and in_from and len(stack) == from_depth:
+            i = _read_source(tokens, i + 1, aliases, tables, subqueries, len(stack))
+            continue
+        i += 1
+    return aliases, [t for t in tables if t not in derived], derived
+
+def _is_cte_name(tokens, i):
+    """True for name in "WITH [RECURSIVE] name [(columns)] AS [[NOT] MATERIALIZED] (" or ", name ... AS (."""
+    previous = tokens[i - 1][1].upper() if i else None
+    if previous not in ("WITH", "RECURSIVE", ","):
+        return False
+    j = i + 1
+    if j < len(tokens) and tokens[j][1] == "(":
+        # Column list: skip to its closing parenthesis
+        while j < len(tokens) and tokens[j][1] != ")":
+            j += 1
+        j += 1
+    if j >= len(tokens) or tokens[j][1].upper() != "AS":
+        return False
+    j += 1
+    while j < len(tokens) and tokens[j][1].upper() in ("NOT", "MATERIALIZED"):
+        j += 1
+    return j < len(tokens) and tokens[j][1] == "("
+
+def _read_source(tokens, i, aliases, tables, subqueries, depth):
+    if i < len(tokens) and tokens[i][1] == "(":
+        subqueries.append(depth)
+        return i
+    return _read_table(tokens, i, aliases, tables)
+
+def _read_table(tokens, i, aliases, tables):
+    """Read "table [AS] alias" at i; returns the index after it."""
+    if i >= len(tokens) or tokens[i][0] not in ("word", "quoted") or tokens[i][1].upper() in _KEYWORDS:
+        return i
+    name = _identifier(tokens[i])
+    i += 1
+    # schema.table
+    while i + 1 < len(tokens) and tokens[i][1] == "." and tokens[i + 1][0] in ("word", "quoted"):
+        name = _identifier(tokens[i + 1])
+        i += 2
+    tables.append(name)
+    if i < len(tokens) and tokens[i][1].upper() == "AS":
+        i += 1
+    if i < len(tokens) and tokens[i][0] in ("word", "quoted") and tokens[i][1].upper() not in _KEYWORDS:
+        aliases[_identifier(tokens[i])] = name
+        i += 1
+    return i
+
+def _identifier(token):
+    kind, text = token
+    return text[1:-1].replace('""', '"') if kind == "quoted" else text.lower()
+
+def _join_tokens(tokens):
+    out = []
+    previous = None
+    for kind, text in tokens:
+        if previous is not None and not (
+            previous[1] in ("(", ".") or text in (")", ",", ".")
+            or (text == "(" and previous[0] == "word" and previous[1].upper() not in _KEYWORDS)
+        ):
+            out.append(" ")
+        out.append(text)
+        previous = (kind, text)
+    return "".join(out)
+
+def _local_canonical(tokens):
+    """Keywords/functions upper-cased, identifiers lower-cased, table aliases resolved."""
+    aliases, tables, _ = _table_refs(tokens)
+    # Aliases only carry information when a table is used more than once (self-joins)
+    resolve = len(tables) == len(set(tables))
+    alias_positions = set()
+    if resolve:
+        for i in range(1, len(tokens)):
+            kind, text = tokens[i]
+            if kind not in ("word", "quoted") or _identifier(tokens[i]) not in aliases:
+                continue
+            prev = tokens[i - 1]
+            if prev[1].upper() == "AS" and i >= 2 and _identifier(tokens[i - 2]) == aliases[_identifier(tokens[i])]:
+                alias_positions.update((i - 1, i))
+            elif prev[0] in ("word", "quoted") and _identifier(prev) == aliases[_identifier(tokens[i])] \
+                    and (i + 1 >= len(tokens) or tokens[i + 1][1] != "."):
+                alias_positions.add(i)
+    canonical = []
+    for i, (kind, text) in enumerate(tokens):
+        if i in alias_positions:
+            continue
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if kind == "word":
+            if resolve and following == "." and text.lower() in aliases:
+                text = aliases[text.lower()]
+            elif text.upper() in _KEYWORDS or following == "(":
+                text = text.upper()
+            else:
+                text = text.lower()
+        canonical.append((kind, text))
+    return _join_tokens(canonical)
+
+def _local_check(tokens):
+    """Problems with a single tokenized statement that make it unsafe to run."""
+    problems = []
+    first = next((text.upper() for kind, text in tokens if text != "("), None)
+    if first not in ("SELECT", "WITH"):
+        problems.append(f"only SELECT queries are allowed, got {first or 'an empty statement'}")
+    for i, (kind, text) in enumerate(tokens):
+        if kind != "word":
+            continue
+        if text.upper() in _FORBIDDEN_KEYWORDS:
+            problems.append(f"{text.upper()} is not allowed in a read-only query")
+        elif text.lower() in _FORBIDDEN_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1][1] in ("(", "."):
+            problems.append(f"{text.lower()} is not allowed")
+    depth = 0
+    for kind, text in tokens:
+        depth += (text == "(") - (text == ")")
+        if depth < 0:
+            break
+    if depth != 0:
+        problems.append("unbalanced parentheses")
+    if any(kind == "string" and (len(text) < 2 or not text.endswith("'")) for kind, text in tokens):
+        problems.append("unterminated string literal")
+    return problems
+
+def _local_columns(tokens, aliases):
+    """(qualifier, column) for every qualified column reference."""
+    refs = []
+    for i in range(len(tokens) - 2):
+        if tokens[i][0] in ("word", "quoted") and tokens[i + 1][1] == "." and tokens[i + 2][0] in ("word", "quoted"):
+            if i + 3 < len(tokens) and tokens[i + 3][1] in ("(", "."):
+                continue
+            if i and tokens[i - 1][1] == ".":
+                continue
+            refs.append((_identifier(tokens[i]), _identifier(tokens[i + 2])))
+    return refs
+
+
+# --- sqlglot ---
+
+def _parse(sql, dialect):
+    try:
+        return [s for s in sqlglot.parse(sql, read=dialect) if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLValidationError([f"could not parse the query: {str(e).splitlines()[0]}"], sql) from e
+
+def _sqlglot_check(tree):
+    problems = []
+    if not isinstance(tree, (exp.Select, exp.Union, exp.Intersect, exp.Except, exp.Subquery)):
+        problems.append(f"only SELECT queries are allowed, got {tree.key.upper()}")
+    for node_type in (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter,
+                      exp.Command, exp.Into):
+        for node in tree.find_all(node_type):
+            problems.append(f"{node.key.upper()} is not allowed in a read-only query")
+            break
+    for func in tree.find_all(exp.Anonymous):
+        if str(func.name).lower() in _FORBIDDEN_FUNCTIONS:
+            problems.append(f"{func.name.lower()} is not allowed")
+    return problems
+
+def _sqlglot_refs(tree):
+    """(alias → table, tables, derived source names, qualified and bare column refs, output aliases)."""
+    derived = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    derived |= {sq.alias.lower() for sq in tree.find_all(exp.Subquery) if sq.alias}
+    aliases, tables = {}, []
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower() if not table.this.quoted else table.name
+        if table.alias:
+            # Aliases of a CTE resolve to the CTE, whose columns are not checked
+            aliases[table.alias.lower()] = name
+        if name not in derived:
+            tables.append(name)
+    columns = [(c.table.lower() if c.table else None, c.name if c.this.quoted else c.name.lower())
+               for c in tree.find_all(exp.Column) if not isinstance(c.this, exp.Star)]
+    output = {a.alias.lower() for a in tree.find_all(exp.Alias) if a.alias}
+    return aliases, tables, derived, columns, output
+
+def _sqlglot_canonical(tree, dialect):
+    tree = tree.copy()
+    tables = list(tree.find_all(exp.Table))
+    names = [t.name.lower() for t in tables]
+    if len(names) == len(set(names)):
+        aliases = {}
+        for table in tables:
+            if table.alias:
+                aliases[table.alias.lower()] = table.name
+                table.set("alias", None)
+        for column in tree.find_all(exp.Column):
+            if column.table and column.table.lower() in aliases:
+                column.set("table", exp.to_identifier(aliases[column.table.lower()]))
+    for identifier in tree.find_all(exp.Identifier):
+        if not identifier.quoted:
+            identifier.set("this", identifier.this.lower())
+    return tree.sql(dialect=dialect)
+
+
+# --- Public API ---
+
+def _sqlglot_dialect(dialect):
+    return "oracle" if dialect == "oracle" else "postgres"
+
+def _strip(sql):
+    return _FENCE.sub("", sql.strip()).strip()
+
+@lru_cache(maxsize=2048)
+def canonical_sql(sql, dialect="postgres"):
+    """Canonical text of a statement: same query, same text, whatever the formatting or table aliases."""
+    sql = _strip(sql)
+    if _use_sqlglot():
+        try:
+            statements = sqlglot.parse(sql, read=_sqlglot_dialect(dialect))
+            if len(statements) == 1 and statements[0] is not None:
+                return _sqlglot_canonical(statements[0], _sqlglot_dialect(dialect))
+        except sqlglot.errors.SqlglotError:
+            pass
+    statements = _split_statements(_tokenize(sql))
+    return ";".join(_local_canonical(tokens) for tokens in statements)
+
+def sql_fingerprint(sql, dialect="postgres"):
+    """Stable hash of canonical_sql, used as the cache key for results."""
+    return hashlib.sha256(canonical_sql(sql, dialect).encode("utf-8")).hexdigest()
+
+def _schema_problems(tables, columns, aliases, derived, output, schema, strict_bare):
+    """Unknown tables and columns as (problem, bad name, qualifier, candidates)."""
+    schema = {t.lower(): {c.lower() for c, _ in cols} for t, cols in schema.items()}
+    problems = []
+    for table in tables:
+        if table not in schema and table not in _BUILTIN_TABLES:
+            problems.append((f"unknown table {table}", table, None, list(schema)))
+    known = {t: schema[t] for t in tables if t in schema}
+    for qualifier, column in columns:
+        if qualifier is None:
+            if not strict_bare or column in output or column in _PSEUDO_COLUMNS:
+                continue
+            candidates = set().union(*known.values()) if known else set()
+            # Only decidable when every source is a known table (no CTEs or subqueries)
+            if known and not derived and len(known) == len(set(tables)) and column not in candidates:
+                problems.append((f"unknown column {column}", column, None, sorted(candidates)))
+            continue
+        table = aliases.get(qualifier, qualifier)
+        if table in derived or table in _BUILTIN_TABLES:
+            continue
+        if table not in known:
+            if table not in schema and qualifier not in aliases:
+                problems.append((f"unknown table or alias {qualifier}", qualifier, None, list(aliases) + list(known)))
+            continue
+        if column not in known[table]:
+            problems.append((f"unknown column {qualifier}.{column}", column, qualifier, sorted(known[table])))
+    return problems
+
+def validate_sql(sql, schema=None, dialect="postgres"):
+    """Check that sql is a single read-only SELECT over known tables and columns.
+
+    schema is {table: [(column, data_type), ...]} (e.g. the cached schema catalog);
+    without it only the statement itself is checked. With sqlglot every column is
+    checked; the local tokenizer checks tables and qualified columns only.
+    Returns a ValidatedSQL or raises SQLValidationError.
+    """
+    return _validate(_strip(sql), schema, dialect)[0]
+
+def _validate(sql, schema, dialect):
+    """(ValidatedSQL, []) or raises; schema problems are returned for repair_sql to fix."""
+    if not sql:
+        raise SQLValidationError(["empty query"], sql)
+    tokens = _tokenize(sql)
+    statements = _split_statements(tokens)
+    if len(statements) != 1:
+        raise SQLValidationError([f"expected one statement, got {len(statements)}"], sql)
+    problems = _local_check(statements[0])
+
+    if _use_sqlglot():
+        parsed = _parse(sql, _sqlglot_dialect(dialect))
+        tree = parsed[0]
+        problems += _sqlglot_check(tree)
+        aliases, tables, derived, columns, output = _sqlglot_refs(tree)
+        canonical = _sqlglot_canonical(tree, _sqlglot_dialect(dialect))
+        parser, strict_bare = "sqlglot", True
+    else:
+        aliases, tables, derived = _table_refs(statements[0])
+        output = set()
+        columns = _local_columns(statements[0], aliases)
+        canonical = _local_canonical(statements[0])
+        parser, strict_bare = "local", False
+    if problems:
+        raise SQLValidationError(dict.fromkeys(problems), sql)
+
+    schema_problems = _schema_problems(tables, columns, aliases, derived, output, schema, strict_bare) if schema else []
+    return ValidatedSQL(sql, canonical, sorted(set(tables)), parser), schema_problems
+
+def _replace_identifier(sql, old, new, qualifier=None):
+    """Rename an identifier outside string literals (only after qualifier. when given)."""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    prefix = rf"\b{re.escape(qualifier)}\s*\.\s*" if qualifier else r"(?<![\w.\"])"
+    pattern = re.compile(rf"({prefix}){re.escape(old)}(?![\w\"])", re.IGNORECASE)
+    return "".join(part if i % 2 else pattern.sub(lambda m: m.group(1) + new, part) for i, part in enumerate(parts))
+
+def repair_sql(sql, schema=None, dialect="postgres", max_rounds=3):
+    """validate_sql plus cheap local fixes before anything reaches the database.
+
+    Strips markdown fences and trailing semicolons, keeps the first of several
+    SELECT statements and renames unknown tables/columns to a near-identical
+    real one (e.g. sales_amount → amount). Raises SQLValidationError with what
+    is still wrong, so the caller can retry the LLM with that feedback.
+    """
+    repairs = []
+    sql = _strip(sql)
+    statements = _split_statements(_tokenize(sql))
+    if len(statements) > 1:
+        first_words = {next((t.upper() for k, t in s if t != "("), "") for s in statements}
+        # Several SELECTs are alternatives; anything else mixed in is refused outright
+        if first_words <= {"SELECT", "WITH"}:
+            sql = sql[:_first_statement_end(sql)].strip()
+            repairs.append(f"kept the first of {len(statements)} statements")
+    elif sql.rstrip().endswith(";"):
+        sql = sql.rstrip().rstrip(";").rstrip()
+
+    for _ in range(max_rounds):
+        validated, problems = _validate(sql, schema, dialect)
+        if not problems:
+            validated.repairs = repairs
+            return validated
+        fixed = False
+        for problem, name, qualifier, candidates in problems:
+            replacement = _closest(name, candidates)
+            if replacement is not None:
+                sql = _replace_identifier(sql, name, replacement, qualifier)
+                repairs.append(f"{name} → {replacement}")
+                fixed = True
+        if not fixed:
+            break
+    raise SQLValidationError([problem for problem, *_ in problems], sql)
+
+def _closest(name, candidates):
+    """The one real name an unknown identifier most likely meant, or None."""
+    # sale_amount → amount, sale → sales, products → product
+    related = [c for c in candidates if name.endswith("_" + c) or name in (c + "s", c[:-1]) and c.endswith("s")
+               or c == name + "s"]
+    if len(related) == 1:
+        return related[0]
+    match = difflib.get_close_matches(name, candidates, n=2, cutoff=SQL_REPAIR_CUTOFF)
+    # Two equally plausible fixes means guessing; leave it to the retry
+    if len(match) == 1 or (len(match) == 2 and difflib.SequenceMatcher(None, name, match[0]).ratio()
+                           > difflib.SequenceMatcher(None, name, match[1]).ratio()):
+        return match[0]
+    return None
+
+def _first_statement_end(sql):
+    quote = None
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == ";":
+            return i
+    return len(sql)
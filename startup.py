@@ -0,0 +1,135 @@
+import importlib
+import logging
+import sys
+import threading
+import time
+from settings import get_setting
+from tracing import register_gauges
+
+# The app imports this module first, so this is close enough to process start
+PROCESS_STARTED = time.perf_counter()
+
+# A successful health check is reused for this many seconds; failures are retried on the next rerun
+HEALTH_CHECK_INTERVAL = float(get_setting("HEALTH_CHECK_INTERVAL", "60"))
+# How long a question waits for a health check that is still running
+HEALTH_CHECK_TIMEOUT = float(get_setting("HEALTH_CHECK_TIMEOUT", "30"))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_import_seconds = {}
+_milestones = {}
+
+
+def timed_import(name):
+    """importlib.import_module, recording how long the first import took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _import_seconds.setdefault(name, time.perf_counter() - started)
+    return module
+
+def mark(milestone):
+    """Record the first time a milestone is reached, in seconds since process start."""
+    with _lock:
+        _milestones.setdefault(milestone, time.perf_counter() - PROCESS_STARTED)
+
+def startup_timings():
+    with _lock:
+        return {"imports": dict(_import_seconds), "milestones": dict(_milestones)}
+
+def preload(names, then=None):
+    """Import modules on a daemon thread so the first question does not pay for them.
+
+    then, if given, is called on the same thread once the imports are done.
+    """
+    def run():
+        for name in names:
+            try:
+                timed_import(name)
+            except Exception as e:
+                # The foreground import reports the error properly when the module is needed
+                logger.warning("Preloading %s failed: %s", name, e)
+        if then is not None:
+            try:
+                then()
+            except Exception as e:
+                logger.warning("Warm-up after preloading failed: %s", e)
+        mark("preload_done")
+        logger.info("Startup timings: %s", startup_timings())
+
+    thread = threading.Thread(target=run, name="bi-preload", daemon=True)
+    thread.start()
+    return thread
+
+def _startup_gauges():
+    return {f"bi_startup_{milestone}_seconds": seconds for milestone, seconds in startup_timings()["milestones"].items()}
+
+register_gauges(_startup_gauges)
+
+
+class HealthCheck:
+    """Connect to the backend and check the sales table on a background thread.
+
+    status is "pending" until the first check finishes, then "ok", "no_connection",
+    "no_table" or "error". Results are cached: a passing check is only repeated
+    after HEALTH_CHECK_INTERVAL seconds, a failing one whenever start() is called.
+    """
+
+    def __init__(self, backend, interval=HEALTH_CHECK_INTERVAL):
+        self.backend = backend
+        self.interval = interval
+        self.status = "pending"
+        self.error = None
+        self.seconds = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._running = False
+
+    @property
+    def ok(self):
+        return self.status == "ok"
+
+    def start(self):
+        """Start a check unless one is running or the last good result is still fresh."""
+        with self._lock:
+            if self._running:
+                return
+            if self.ok and time.time() - self.checked_at < self.interval:
+                return
+            if not self.ok:
+                # Make waiters see the new outcome rather than the cached failure
+                self._done.clear()
+            self._running = True
+        threading.Thread(target=self._run, name="bi-health-check", daemon=True).start()
+
+    def _run(self):
+        started = time.perf_counter()
+        error = None
+        try:
+            if not self.backend.connect():
+                status = "no_connection"
+            elif not self.backend.test_connection():
+                status = "no_table"
+            else:
+                status = "ok"
+        except Exception as e:
+            status, error = "error", str(e)
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.seconds = time.perf_counter() - started
+            self.checked_at = time.time()
+            self._running = False
+        self._done.set()
+        mark("health_check_done")
+
+    def wait(self, timeout=HEALTH_CHECK_TIMEOUT):
+        """Block until a result is available (or timeout); returns the status."""
+        self.start()
+        self._done.wait(timeout)
+        return self.status
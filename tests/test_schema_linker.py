@@ -0,0 +1,24 @@
+from schema_linker import _drop_one
+
+# products - sales - customers - regions
+GRAPH = {
+    "sales": {"products": ("product_id", "product_id"), "customers": ("customer_id", "customer_id")},
+    "products": {"sales": ("product_id", "product_id")},
+    "customers": {"sales": ("customer_id", "customer_id"), "regions": ("region_id", "region_id")},
+    "regions": {"customers": ("region_id", "region_id")},
+}
+
+
+def test_bridge_tables_outlive_the_leaves_they_join():
+    # Ranked products, regions; customers and sales were added as the join path
+    selected = ["products", "regions", "customers", "sales"]
+    selected = _drop_one(GRAPH, selected)
+    assert selected == ["products", "customers", "sales"]
+    # customers now joins nothing that is kept, so it goes before sales
+    selected = _drop_one(GRAPH, selected)
+    assert selected == ["products", "sales"]
+    assert _drop_one(GRAPH, selected) == ["products"]
+
+
+def test_unconnected_tables_are_dropped_lowest_ranked_first():
+    assert _drop_one({}, ["sales", "products", "customers"]) == ["sales", "products"]
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+from semantic_cache import SEMANTIC_CACHE_THRESHOLD, SemanticCache, _entities, embed
+
+# Same question, different wording: should be served from the cache
+PARAPHRASES = [
+    ("What product sold the most?", "Which product sold the most?"),
+    ("Show total sales by region", "Show me total sales by region"),
+    ("Total sales per region", "Total sales for each region"),
+    ("Show monthly sales for 2024", "Show the monthly sales in 2024"),
+    ("How many sales were there in March?", "How many sales were made in March?"),
+    ("What is the average sale amount?", "What's the average sale amount?"),
+    ("List the top 5 products by revenue", "List top 5 products by revenue"),
+    ("Total sales in March", "March total sales"),
+    ("What is the total sale amount by region?", "What is the total sales amount by region?"),
+    ("How many orders did we get in 2024?", "How many orders were placed in 2024?"),
+    ("Show revenue by product category", "Revenue broken down by product category"),
+    ("Which products have the highest revenue?", "Which product has the highest revenue?"),
+]
+
+# Same entities, different question: the entity guard lets these through, the score must not
+DIFFERENT = [
+    ("Show total sales by region", "Show total sales by product"),
+    ("Which product sold the most?", "Which customer bought the most?"),
+    ("How many customers are there?", "How many products are there?"),
+    ("Total sales per region", "Total customers per region"),
+    ("Show monthly sales for 2024", "Show daily sales for 2024"),
+    ("Which region has the most customers?", "Which region has the most sales?"),
+    ("How many sales were there in March?", "How many refunds were there in March?"),
+    ("What is the average sale amount per customer?", "What is the average sale amount per product?"),
+]
+
+
+def score(a, b):
+    return float(embed(a) @ embed(b))
+
+
+@pytest.mark.parametrize("question,paraphrase", PARAPHRASES)
+def test_paraphrases_clear_the_threshold(question, paraphrase):
+    assert _entities(question) == _entities(paraphrase)
+    assert score(question, paraphrase) >= SEMANTIC_CACHE_THRESHOLD
+
+
+@pytest.mark.parametrize("question,other", DIFFERENT)
+def test_different_questions_stay_below_the_threshold(question, other):
+    assert _entities(question) == _entities(other)
+    assert score(question, other) < SEMANTIC_CACHE_THRESHOLD
+
+
+def test_lookup_serves_paraphrase_only(tmp_path):
+    cache = SemanticCache(path=str(tmp_path / "semantic.npz"), capacity=8)
+    cache.put("What product sold the most?", "SELECT 1", "v1")
+    assert cache.lookup("Which product sold the most?", "v1") == "SELECT 1"
+    assert cache.lookup("Which customer bought the most?", "v1") is None
+    assert cache.lookup("Which product sold the most?", "v2") is None
+
+
+def test_vectors_from_an_older_embedding_are_recomputed(tmp_path):
+    path = str(tmp_path / "semantic.npz")
+    cache = SemanticCache(path=path, capacity=8)
+    cache.put("What product sold the most?", "SELECT 1", "v1")
+    # A file written before versioning, with vectors the current embed() would not produce
+    np.savez(path, vectors=np.zeros_like(cache.vectors[:1]), entries=np.array(json.dumps(cache.entries)))
+    reloaded = SemanticCache(path=path, capacity=8)
+    assert reloaded.lookup("Which product sold the most?", "v1") == "SELECT 1"
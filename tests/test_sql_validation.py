@@ -0,0 +1,36 @@
+import pytest
+
+import sql_validation
+from sql_validation import SQLValidationError, repair_sql, validate_sql
+
+SCHEMA = {
+    "sales": [("sale_id", "integer"), ("sale_date", "date"), ("product_id", "integer"), ("amount", "numeric")],
+    "products": [("product_id", "integer"), ("product_name", "text")],
+}
+
+CTE_QUERIES = [
+    "WITH totals AS (SELECT product_id, SUM(amount) AS total FROM sales GROUP BY product_id) "
+    "SELECT p.product_name, t.total FROM totals t JOIN products p ON p.product_id = t.product_id",
+    "WITH RECURSIVE days (d) AS (SELECT 1 UNION ALL SELECT d + 1 FROM days WHERE d < 7) SELECT d FROM days",
+    "WITH a AS (SELECT * FROM sales), b AS MATERIALIZED (SELECT * FROM a) SELECT b.amount FROM b",
+]
+
+
+@pytest.fixture(params=["local", "sqlglot"])
+def parser(request, monkeypatch):
+    if request.param == "sqlglot":
+        pytest.importorskip("sqlglot")
+    monkeypatch.setattr(sql_validation, "_use_sqlglot", lambda: request.param == "sqlglot")
+    return request.param
+
+
+@pytest.mark.parametrize("sql", CTE_QUERIES)
+def test_cte_names_are_not_unknown_tables(parser, sql):
+    validated = validate_sql(sql, SCHEMA)
+    assert validated.parser == parser
+    assert set(validated.tables) <= {"sales", "products"}
+
+
+def test_unknown_table_next_to_cte_is_still_rejected(parser):
+    with pytest.raises(SQLValidationError, match="unknown table orders"):
+        repair_sql("WITH t AS (SELECT * FROM sales) SELECT * FROM t JOIN orders o ON o.id = t.sale_id", SCHEMA)
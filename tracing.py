@@ -0,0 +1,246 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from settings import get_setting
+
+
+logger = logging.getLogger(__name__)
+
+# Serve Prometheus metrics on this port (unset = no endpoint)
+METRICS_PORT = get_setting("METRICS_PORT")
+# Spans are also exported over OTLP when this is set and opentelemetry is installed
+OTEL_ENDPOINT = get_setting("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = get_setting("OTEL_SERVICE_NAME", "conversational-bi")
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Numeric span attributes that are also summed into Prometheus counters
+COUNTED_ATTRIBUTES = ("prompt_tokens", "rows")
+
+# (trace, parent span) for the code currently running
+_current = contextvars.ContextVar("bi_trace", default=(None, None))
+_metrics_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauge_sources = []
+_server = None
+_otel_tracer = None
+_otel_checked = False
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes)
+        self.thread = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    """All spans recorded for one request, across the threads that worked on it."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def activate(self):
+        """Make spans opened in this block (and contexts copied from it) part of this trace."""
+        token = _current.set((self, None))
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def waterfall(self):
+        """Spans as rows of name, depth, start/duration in seconds relative to the trace start."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        depths = {}
+        rows = []
+        for s in spans:
+            depth = depths.get(id(s.parent), -1) + 1 if s.parent is not None else 0
+            depths[id(s)] = depth
+            rows.append({
+                "name": s.name,
+                "depth": depth,
+                "start": s.start - self.started,
+                "duration": s.duration,
+                "thread": s.thread,
+                "attributes": s.attributes,
+            })
+        return rows
+
+
+def _get_otel_tracer():
+    global _otel_tracer, _otel_checked
+    if _otel_checked:
+        return _otel_tracer
+    _otel_checked = True
+    if not OTEL_ENDPOINT:
+        return None
+    try:
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk is not installed")
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT itself
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    _otel_tracer = otel_trace.get_tracer(__name__)
+    return _otel_tracer
+
+def _record_metrics(span, error):
+    with _metrics_lock:
+        histogram = _histograms.setdefault(span.name, [0] * len(HISTOGRAM_BUCKETS) + [0.0, 0])
+        duration = span.duration
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if duration <= bound:
+                histogram[i] += 1
+        histogram[-2] += duration
+        histogram[-1] += 1
+        if error:
+            key = ("bi_stage_errors_total", span.name)
+            _counters[key] = _counters.get(key, 0) + 1
+        cache_hit = span.attributes.get("cache_hit")
+        if cache_hit is not None:
+            key = ("bi_stage_cache_hits_total" if cache_hit else "bi_stage_cache_misses_total", span.name)
+            _counters[key] = _counters.get(key, 0) + 1
+        for attribute in COUNTED_ATTRIBUTES:
+            value = span.attributes.get(attribute)
+            if isinstance(value, (int, float)):
+                key = (f"bi_stage_{attribute}_total", span.name)
+                _counters[key] = _counters.get(key, 0) + value
+
+@contextmanager
+def span(name, **attributes):
+    """Time a stage. Yields the Span so attributes can be added while it runs.
+
+    The span joins the active trace (if any), feeds the Prometheus histograms and
+    is mirrored to OpenTelemetry when an OTLP endpoint is configured.
+    """
+    trace, parent = _current.get()
+    s = Span(name, parent, attributes)
+    if trace is not None:
+        trace.add(s)
+    token = _current.set((trace, s))
+    tracer = _get_otel_tracer()
+    otel_span = tracer.start_as_current_span(name) if tracer is not None else None
+    otel = otel_span.__enter__() if otel_span is not None else None
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = e
+        s.set(error=str(e))
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+        _record_metrics(s, error)
+        if otel is not None:
+            for key, value in s.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    otel.set_attribute(key, value)
+            if error is not None:
+                otel_span.__exit__(type(error), error, error.__traceback__)
+            else:
+                otel_span.__exit__(None, None, None)
+
+def current_span():
+    """The innermost open span, or None."""
+    return _current.get()[1]
+
+def register_gauges(source):
+    """Add a callable returning {metric_name: value}, sampled on every scrape."""
+    _gauge_sources.append(source)
+
+
+# --- Prometheus exposition ---
+
+def metrics_text():
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP bi_stage_seconds Time spent per pipeline stage",
+        "# TYPE bi_stage_seconds histogram",
+    ]
+    with _metrics_lock:
+        histograms = {name: list(values) for name, values in _histograms.items()}
+        counters = dict(_counters)
+    for stage, values in sorted(histograms.items()):
+        for bound, count in zip(HISTOGRAM_BUCKETS, values):
+            lines.append(f'bi_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'bi_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {values[-1]}')
+        lines.append(f'bi_stage_seconds_sum{{stage="{stage}"}} {values[-2]}')
+        lines.append(f'bi_stage_seconds_count{{stage="{stage}"}} {values[-1]}')
+
+    for metric in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {metric} counter")
+        for (name, stage), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{name}{{stage="{stage}"}} {value}')
+
+    for source in _gauge_sources:
+        try:
+            gauges = source()
+        except Exception as e:
+            logger.warning("Metrics gauge source failed: %s", e)
+            continue
+        for name, value in gauges.items():
+            if value is not None:
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=None):
+    """Serve /metrics on a daemon thread; no-op without METRICS_PORT or when already running."""
+    global _server
+    port = port or METRICS_PORT
+    if not port or _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Could not start metrics endpoint on port %s: %s", port, e)
+        return None
+    threading.Thread(target=_server.serve_forever, name="bi-metrics", daemon=True).start()
+    logger.info("Prometheus metrics on http://0.0.0.0:%s/metrics", port)
+    return _server
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from settings import get_setting
+
+# Full re-warm at least this often; a change in the sales data triggers one sooner
+WARMER_INTERVAL = float(get_setting("WARMER_INTERVAL", "900"))
+# How often the data watermark is checked between full runs
+WARMER_POLL_INTERVAL = float(get_setting("WARMER_POLL_INTERVAL", "30"))
+# Most frequent logged questions warmed in addition to the sample questions (0 = samples only)
+WARMER_TOP_N = int(get_setting("WARMER_TOP_N", "10"))
+# Only the tail of the query log is counted, so popularity follows recent usage
+WARMER_LOG_LINES = int(get_setting("WARMER_LOG_LINES", "5000"))
+WARMER_ENABLED = str(get_setting("WARMER_ENABLED", "true")).lower() in ("1", "true", "yes")
+# Scheduler user the warm-up runs under, so fair queueing puts real users first
+WARMER_USER = "warmer"
+
+logger = logging.getLogger(__name__)
+
+
+def _tail_lines(path, max_lines):
+    """Last max_lines lines of a text file without reading all of it."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        block = 64 * 1024
+        data = b""
+        while end > 0 and data.count(b"\n") <= max_lines:
+            start = max(0, end - block)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    return data.decode("utf-8", errors="replace").splitlines()[-max_lines:]
+
+def popular_questions(n=WARMER_TOP_N, log_path=None):
+    """The n most asked questions in the recent query log, most frequent first.
+
+    Result cache hits are logged with route "cache" and count like executions, so a
+    question stays popular while the warmer keeps it cached.
+    """
+    from cost_guard import COST_GUARD_LOG
+    from result_cache import normalize_question
+
+    log_path = log_path or COST_GUARD_LOG
+    if n <= 0 or not os.path.exists(log_path):
+        return []
+    counts = Counter()
+    spelling = {}
+    for line in _tail_lines(log_path, WARMER_LOG_LINES):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        question = entry.get("question")
+        # The warmer's own executions would otherwise keep its questions popular forever
+        if not question or entry.get("error") or entry.get("user") == WARMER_USER:
+            continue
+        key = normalize_question(question)
+        counts[key] += 1
+        spelling[key] = question
+    return [spelling[key] for key, _ in counts.most_common(n)]
+
+
+class Warmer:
+    """Pre-generates SQL and results for suggested and popular questions in the background.
+
+    Each run pushes the questions through the normal pipeline, so the SQL cache,
+    semantic cache and result cache end up holding exactly what a click would
+    look up. Runs happen at start, every WARMER_INTERVAL seconds and whenever the
+    sales data watermark moves (the cached results would no longer be hit).
+    """
+
+    def __init__(self, sample_questions, generate_fn, top_n=WARMER_TOP_N):
+        self.sample_questions = list(sample_questions)
+        self.generate_fn = generate_fn
+        self.top_n = top_n
+        self.runs = 0
+        self.warmed = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_seconds = None
+        self.last_error = None
+        self._watermark = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def questions(self):
+        """Sample questions first, then popular ones not already covered."""
+        from result_cache import normalize_question
+
+        seen = set()
+        questions = []
+        for question in self.sample_questions + popular_questions(self.top_n):
+            key = normalize_question(question)
+            if key not in seen:
+                seen.add(key)
+                questions.append(question)
+        return questions
+
+    def warm(self):
+        """Run every question through the pipeline once; returns how many succeeded."""
+        from backends import get_backend
+        from pipeline import start_pipeline
+
+        full_pipeline = get_backend().full_pipeline
+        started = time.perf_counter()
+        warmed = 0
+        for question in self.questions():
+            if self._stop.is_set():
+                break
+            try:
+                run = start_pipeline(question, self.generate_fn, user_id=WARMER_USER)
+                # Without the result cache only the generated SQL can be kept
+                if full_pipeline:
+                    run.fetch()
+                else:
+                    run.sql()
+                warmed += 1
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{question}: {e}"
+                logger.warning("Warming %r failed: %s", question, e)
+        self.runs += 1
+        self.warmed = warmed
+        self.last_run = time.time()
+        self.last_seconds = time.perf_counter() - started
+        logger.info("Warmed %d questions in %.1fs", warmed, self.last_seconds)
+        return warmed
+
+    def _data_changed(self):
+        from backends import get_backend
+        if not get_backend().full_pipeline:
+            return False
+        from result_cache import get_data_watermark
+
+        watermark = get_data_watermark()
+        changed = self._watermark is not None and watermark != self._watermark
+        self._watermark = watermark
+        return changed
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                due = self.last_run is None or time.time() - self.last_run >= WARMER_INTERVAL
+                if self._data_changed() or due:
+                    self.warm()
+            except Exception as e:
+                # Typically the database is not reachable yet; try again on the next poll
+                self.last_error = str(e)
+                logger.warning("Warm-up run failed: %s", e)
+            self._stop.wait(WARMER_POLL_INTERVAL)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="bi-warmer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "warmed": self.warmed,
+            "failures": self.failures,
+            "last_run_age_seconds": time.time() - self.last_run if self.last_run else None,
+            "last_seconds": self.last_seconds,
+            "last_error": self.last_error,
+        }
+
+
+_warmer = None
+
+def start_warmer(sample_questions, generate_fn):
+    """Start the process-wide warmer once (no-op when WARMER_ENABLED is off)."""
+    global _warmer
+    if WARMER_ENABLED and _warmer is None:
+        _warmer = Warmer(sample_questions, generate_fn).start()
+    return _warmer
+
+def get_warmer():
+    return _warmer